@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import FileConversion
+from django.utils.html import format_html_join
+from .models import ConversionArchive, ConversionDailyRollup, FileConversion
 
 
 @admin.register(FileConversion)
@@ -7,24 +8,70 @@ class FileConversionAdmin(admin.ModelAdmin):
     list_display = ['original_filename', 'original_format', 'target_format', 
                     'conversion_type', 'status', 'created_at', 'completed_at']
     list_filter = ['status', 'conversion_type', 'original_format', 'target_format', 'created_at']
-    search_fields = ['original_filename', 'id']
-    readonly_fields = ['id', 'created_at', 'updated_at', 'completed_at', 'task_id']
+    search_fields = ['original_filename', 'id', 'batch_id']
+    readonly_fields = ['id', 'created_at', 'updated_at', 'started_at', 'completed_at', 'task_id',
+                       'priority', 'stage_breakdown']
+    # Skip the unfiltered COUNT(*); totals are in the daily rollups
+    show_full_result_count = False
     
     fieldsets = (
         ('File Information', {
-            'fields': ('id', 'original_filename', 'original_file', 'converted_file')
+            'fields': ('id', 'original_filename', 'original_file', 'converted_file', 'preview_file')
         }),
         ('Conversion Details', {
-            'fields': ('original_format', 'target_format', 'conversion_type', 'status')
+            'fields': ('original_format', 'target_format', 'conversion_type', 'status', 'options')
         }),
         ('File Sizes', {
-            'fields': ('file_size', 'converted_file_size')
+            'fields': ('file_size', 'converted_file_size', 'media_info')
         }),
         ('Task Information', {
-            'fields': ('task_id', 'error_message')
+            'fields': ('task_id', 'priority', 'batch_id', 'user', 'error_message')
         }),
         ('Timestamps', {
-            'fields': ('created_at', 'updated_at', 'completed_at')
+            'fields': ('created_at', 'updated_at', 'started_at', 'completed_at')
+        }),
+        ('Timing', {
+            'fields': ('stage_breakdown',)
         }),
     )
+    
+    @admin.display(description='Stages')
+    def stage_breakdown(self, obj):
+        """Queue time, then one line per stage: start offset and duration"""
+        timings = obj.stage_timings or {}
+        if not timings:
+            return '-'
+        rows = [('queued', '', f"{timings.get('queue', 0):.3f}s")]
+        rows += [(name, f'+{start:.3f}s', f'{duration:.3f}s')
+                 for name, start, duration in timings.get('stages', [])]
+        return format_html_join('<br>', '{} {} {}', rows)
+
 
+@admin.register(ConversionDailyRollup)
+class ConversionDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ['date', 'original_format', 'target_format', 'conversion_type',
+                    'status', 'count', 'input_bytes', 'output_bytes', 'get_average_seconds']
+    list_filter = ['status', 'conversion_type', 'original_format', 'target_format']
+    date_hierarchy = 'date'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ConversionArchive)
+class ConversionArchiveAdmin(admin.ModelAdmin):
+    list_display = ['id', 'original_format', 'target_format', 'conversion_type',
+                    'status', 'created_at', 'completed_at', 'archived_at']
+    list_filter = ['status', 'conversion_type', 'original_format', 'target_format']
+    search_fields = ['id']
+    date_hierarchy = 'created_at'
+    show_full_result_count = False
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
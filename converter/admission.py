@@ -0,0 +1,184 @@
+"""
+Admission control and per-client rate limiting for upload_file
+
+Uploads are refused with 429 + Retry-After when the broker queue is too
+deep or the estimated backlog is too long, and each client draws from a
+token bucket so that a single client cannot monopolise the workers.
+"""
+from celery import current_app
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.db.models import Count
+import math
+import threading
+import time
+
+from .estimator import typical_seconds
+from .models import FileConversion
+
+LOAD_SNAPSHOT_KEY = 'admission_load_snapshot'
+
+# GCRA token bucket in one atomic step. KEYS[1] holds the theoretical
+# arrival time (TAT); ARGV: now, emission interval, tolerance. Returns the
+# seconds to wait, "0" if the token was taken.
+UPLOAD_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local tolerance = tonumber(ARGV[3])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or ARGV[1]), now)
+local wait = tat - now - tolerance
+if wait > 0 then
+    return tostring(wait)
+end
+redis.call('SET', KEYS[1], tostring(tat + interval), 'PX', math.ceil((tat + interval - now) * 1000) + 1000)
+return '0'
+"""
+
+# Serializes the bucket update on caches other than Redis (e.g. LocMemCache,
+# which is per process anyway)
+_bucket_lock = threading.Lock()
+
+
+class AdmissionRejected(Exception):
+    """Raised when an upload must be refused; carries the Retry-After delay"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+def get_queue_depth():
+    """Number of messages waiting in the default Celery queue"""
+    queue_name = current_app.conf.task_default_queue
+    with current_app.connection_for_read() as connection:
+        return connection.default_channel.queue_declare(
+            queue=queue_name, passive=True
+        ).message_count
+
+
+def estimate_job_seconds(conversion_type):
+    """Typical processing time of one conversion of the given type"""
+    return typical_seconds(conversion_type)
+
+
+def get_load_snapshot():
+    """
+    Current queue depth and estimated backlog, cached for ADMISSION_SNAPSHOT_SECONDS
+
+    Returns:
+        dict: queue_depth, jobs (unfinished conversions) and backlog_seconds
+    """
+    snapshot = cache.get(LOAD_SNAPSHOT_KEY)
+    if snapshot is not None:
+        return snapshot
+
+    counts = (
+        FileConversion.objects
+        .filter(status__in=['pending', 'processing'])
+        .values('conversion_type')
+        .annotate(count=Count('id'))
+    )
+    jobs = 0
+    work_seconds = 0
+    for row in counts:
+        jobs += row['count']
+        work_seconds += row['count'] * estimate_job_seconds(row['conversion_type'])
+
+    try:
+        queue_depth = get_queue_depth()
+    except Exception as e:
+        print(f"Could not read broker queue depth: {e}")
+        queue_depth = 0
+
+    snapshot = {
+        'queue_depth': queue_depth,
+        'jobs': jobs,
+        'backlog_seconds': work_seconds / max(1, settings.ADMISSION_WORKER_CONCURRENCY),
+    }
+    cache.set(LOAD_SNAPSHOT_KEY, snapshot, settings.ADMISSION_SNAPSHOT_SECONDS)
+    return snapshot
+
+
+def check_capacity(conversion_type):
+    """
+    Refuse new work when the system is over capacity
+
+    Raises:
+        AdmissionRejected: If the queue is full or the backlog is too long
+    """
+    snapshot = get_load_snapshot()
+    per_job = snapshot['backlog_seconds'] / max(1, snapshot['jobs'])
+
+    excess = snapshot['queue_depth'] - settings.ADMISSION_MAX_QUEUE_DEPTH + 1
+    if excess > 0:
+        raise AdmissionRejected('Conversion queue is full, please retry later', excess * per_job)
+
+    backlog = snapshot['backlog_seconds'] + (
+        estimate_job_seconds(conversion_type) / max(1, settings.ADMISSION_WORKER_CONCURRENCY)
+    )
+    if backlog > settings.ADMISSION_MAX_BACKLOG_SECONDS:
+        raise AdmissionRejected(
+            'Server is busy, please retry later',
+            backlog - settings.ADMISSION_MAX_BACKLOG_SECONDS
+        )
+
+
+def get_client_id(request, user=None):
+    """Identify the client for rate limiting: user id, else IP address"""
+    if user is not None:
+        return f'user:{user.pk}'
+    if settings.UPLOAD_RATE_LIMIT_TRUST_FORWARDED_FOR:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+        if forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}"
+    return f"ip:{request.META.get('REMOTE_ADDR', 'unknown')}"
+
+
+def _take_upload_token(key, now, interval, tolerance):
+    """
+    Run one GCRA step on ``key``; seconds to wait, 0 if the token was taken
+
+    On Redis this is a Lua script, so concurrent uploads on any number of
+    web processes see each other's tokens.
+    """
+    backend = caches['default']
+    if isinstance(backend, RedisCache):
+        key = backend.make_and_validate_key(key)
+        client = backend._cache.get_client(key, write=True)
+        script = client.register_script(UPLOAD_BUCKET_SCRIPT)
+        return float(script(keys=[key], args=[now, interval, tolerance]))
+
+    with _bucket_lock:
+        tat = max(cache.get(key, now), now)
+        wait = tat - now - tolerance
+        if wait > 0:
+            return wait
+        cache.set(key, tat + interval, math.ceil(tat + interval - now) + 1)
+        return 0
+
+
+def consume_upload_token(client_id):
+    """
+    Take one token from the client's bucket
+
+    Buckets hold up to UPLOAD_RATE_LIMIT_BURST tokens and refill at
+    UPLOAD_RATE_LIMIT_PER_MINUTE tokens per minute. The bucket is kept as
+    a GCRA theoretical arrival time: each token pushes it one emission
+    interval further, and a token is refused while it is more than the
+    burst ahead of now.
+
+    Raises:
+        AdmissionRejected: If the bucket is empty
+    """
+    rate = settings.UPLOAD_RATE_LIMIT_PER_MINUTE / 60.0
+    capacity = settings.UPLOAD_RATE_LIMIT_BURST
+    if rate <= 0:
+        return
+
+    interval = 1 / rate
+    tolerance = interval * max(0, capacity - 1)
+    wait = _take_upload_token(f'upload_bucket_{client_id}', time.time(), interval, tolerance)
+
+    if wait > 0:
+        raise AdmissionRejected('Rate limit exceeded, please slow down', wait)
@@ -0,0 +1,167 @@
+"""
+Cooperative cancellation of running conversions
+
+Cancelling a conversion sets a cache flag (``request_cancellation``).
+Tasks run inside ``cancellable(conversion_id)`` (see ``cancellable_task``),
+which starts a watcher thread polling the flag every CANCEL_POLL_SECONDS.
+Once the flag is seen the watcher kills the task's ffmpeg processes
+(started through ``run_process``) and ``checkpoint()`` calls between and
+inside conversion steps raise ``ConversionCancelled``; outside of a
+cancellable block they are no-ops.
+
+Thread pools do not inherit context variables; converters that run
+processes from worker threads submit their work through ``in_context``.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from django.conf import settings
+from django.core.cache import cache
+from functools import wraps
+import inspect
+import subprocess
+import threading
+
+_token = ContextVar('cancel_token', default=None)
+
+
+class ConversionCancelled(Exception):
+    """Raised at a checkpoint of a conversion that was cancelled"""
+
+
+def cancel_key(conversion_id):
+    """Cache key flagging a conversion as cancelled"""
+    return f'conversion_cancelled_{conversion_id}'
+
+
+def request_cancellation(conversion_id):
+    """Flag a conversion so its running tasks stop at their next checkpoint"""
+    cache.set(cancel_key(conversion_id), True, settings.CELERY_TASK_TIME_LIMIT * 2)
+
+
+def is_cancellation_requested(conversion_id):
+    """True if the conversion has been cancelled"""
+    return bool(cache.get(cancel_key(conversion_id)))
+
+
+class CancelToken:
+    """Cancellation state of one running task: a flag and its child processes"""
+
+    def __init__(self, conversion_id):
+        self.conversion_id = conversion_id
+        self.cancelled = threading.Event()
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def poll(self):
+        """
+        Cancel if the conversion has been flagged
+
+        An unreachable cache counts as not cancelled, so it never stops a task.
+        """
+        if self.cancelled.is_set():
+            return
+        try:
+            requested = is_cancellation_requested(self.conversion_id)
+        except Exception as e:
+            print(f"Error checking cancellation of {self.conversion_id}: {e}")
+            return
+        if requested:
+            self.cancel()
+
+    def cancel(self):
+        """Set the flag and kill running child processes"""
+        self.cancelled.set()
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def add_process(self, process):
+        with self._lock:
+            self._processes.add(process)
+        # A process started after the cancellation is killed at once
+        if self.cancelled.is_set():
+            process.kill()
+
+    def discard_process(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+
+@contextmanager
+def cancellable(conversion_id):
+    """Run the enclosed block with a cancellation token for ``conversion_id``"""
+    token = CancelToken(conversion_id)
+    stop = threading.Event()
+
+    def watch():
+        while not stop.wait(settings.CANCEL_POLL_SECONDS) and not token.cancelled.is_set():
+            token.poll()
+
+    watcher = threading.Thread(target=watch, name=f'cancel-watch-{conversion_id}', daemon=True)
+    reset = _token.set(token)
+    token.poll()
+    watcher.start()
+    try:
+        yield token
+    finally:
+        stop.set()
+        _token.reset(reset)
+
+
+def cancellable_task(func):
+    """Run a (Celery task) function inside ``cancellable()`` for its ``conversion_id`` argument"""
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        conversion_id = signature.bind(*args, **kwargs).arguments['conversion_id']
+        with cancellable(conversion_id):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def checkpoint():
+    """
+    Stop here if the current conversion was cancelled
+
+    Raises:
+        ConversionCancelled: If the conversion was cancelled
+    """
+    token = _token.get()
+    if token is not None and token.cancelled.is_set():
+        raise ConversionCancelled(f"Conversion {token.conversion_id} was cancelled")
+
+
+def run_process(args):
+    """
+    subprocess.run(args, capture_output=True) that a cancellation kills
+
+    Raises:
+        ConversionCancelled: If the process was killed by a cancellation
+    """
+    token = _token.get()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if token is not None:
+        token.add_process(process)
+    try:
+        stdout, stderr = process.communicate()
+    finally:
+        if token is not None:
+            token.discard_process(process)
+    checkpoint()
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+
+def in_context(func):
+    """Wrap ``func`` to run in (a copy of) the caller's context, for thread pools"""
+    context = copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return run
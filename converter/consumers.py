@@ -1,8 +1,126 @@
 """
 WebSocket consumers for real-time conversion progress updates
 """
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.core.cache import cache
+import asyncio
 import json
+import uuid
+
+from .models import FileConversion, BATCH_ID_RE, batch_group, session_digest
+from .progress import progress_snapshot_key, revoke_conversion
+from .rollups import FINISHED_STATUSES
+
+# Progress reported for conversions whose cached snapshot has expired
+STATUS_PROGRESS = {
+    'pending': 0,
+    'processing': 10,
+    'completed': 100,
+    'failed': 0,
+    'cancelled': 0,
+}
+
+
+def progress_message(event):
+    """Build the client-facing progress payload from a channel layer event"""
+    return {
+        'type': 'progress',
+        'conversion_id': event['conversion_id'],
+        'progress': event['progress'],
+        'status': event['status'],
+        'error': event.get('error'),
+        'eta_seconds': event.get('eta_seconds')
+    }
+
+
+def is_behind(event, snapshot):
+    """
+    True if a live event is older than a snapshot already sent
+    
+    Events published before the snapshot was read can still be queued for
+    the socket. Progress only grows until a conversion finishes, so an
+    unfinished event below the snapshot's progress, or any event after a
+    finished snapshot, is stale.
+    """
+    if snapshot['status'] in FINISHED_STATUSES:
+        return True
+    return event['status'] not in FINISHED_STATUSES and event['progress'] < snapshot['progress']
+
+
+async def load_progress_snapshots(conversion_ids):
+    """
+    Latest known progress event for each conversion id
+    
+    Snapshots come from the cache; conversions whose snapshot expired fall
+    back to the status stored in the database.
+    
+    Returns:
+        dict: conversion_id -> channel layer style progress event
+    """
+    conversion_ids = [str(c) for c in conversion_ids]
+    cached = await cache.aget_many([progress_snapshot_key(c) for c in conversion_ids])
+    snapshots = {}
+    missing = []
+    
+    for conversion_id in conversion_ids:
+        event = cached.get(progress_snapshot_key(conversion_id))
+        if event:
+            snapshots[conversion_id] = event
+        else:
+            missing.append(conversion_id)
+    
+    if missing:
+        rows = FileConversion.objects.filter(id__in=missing).values('id', 'status', 'error_message')
+        async for row in rows:
+            error = None
+            if row['status'] == 'failed' and row['error_message']:
+                error = row['error_message'].split('\n\n')[0]
+            snapshots[str(row['id'])] = {
+                'conversion_id': str(row['id']),
+                'progress': STATUS_PROGRESS.get(row['status'], 0),
+                'status': row['status'],
+                'error': error,
+            }
+    
+    return snapshots
+
+
+@database_sync_to_async
+def following_groups(conversion_ids):
+    """
+    Channel layer group to join to follow each conversion
+    
+    That is the conversion's batch or user stream group (see
+    get_progress_groups), whose events are then filtered by id. Ids
+    without a row fall back to their own group.
+    
+    Returns:
+        dict: conversion_id -> group name
+    """
+    groups = {str(c): f'conversion_{c}' for c in conversion_ids}
+    rows = FileConversion.objects.filter(id__in=conversion_ids).only('id', 'batch_id', 'user_id')
+    for conversion in rows:
+        groups[str(conversion.id)] = conversion.get_progress_groups()[0]
+    return groups
+
+
+@database_sync_to_async
+def cancel_conversions(conversion_ids):
+    """
+    Cancel conversions by id (see revoke_conversion)
+    
+    Returns:
+        list: Ids of the conversions that were cancelled; finished or
+        unknown ones are skipped
+    """
+    cancelled = []
+    rows = FileConversion.objects.filter(id__in=conversion_ids).only('id', 'task_id', 'batch_id', 'user_id')
+    for conversion in rows:
+        if revoke_conversion(conversion):
+            cancelled.append(str(conversion.id))
+    return cancelled
 
 
 class ConversionConsumer(AsyncWebsocketConsumer):
@@ -13,23 +131,38 @@ class ConversionConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         """Handle WebSocket connection"""
         self.conversion_id = self.scope['url_route']['kwargs'].get('conversion_id')
-        self.room_group_name = f'conversion_{self.conversion_id}'
+        self.room_group_name = None
+        self.snapshot = None
+        try:
+            self.conversion_id = str(uuid.UUID(self.conversion_id))
+        except ValueError:
+            await self.accept()
+            return
         
-        # Join room group
+        # Join the conversion's stream group; other conversions' events are dropped
+        groups = await following_groups([self.conversion_id])
+        self.room_group_name = groups[self.conversion_id]
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         
         await self.accept()
+        
+        # Replay the latest known state so late subscribers don't wait for the next event
+        snapshots = await load_progress_snapshots([self.conversion_id])
+        self.snapshot = snapshots.get(self.conversion_id)
+        if self.snapshot is not None:
+            await self.send(text_data=json.dumps(progress_message(self.snapshot)))
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
         # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        if self.room_group_name:
+            await self.channel_layer.group_discard(
+                self.room_group_name,
+                self.channel_name
+            )
     
     async def receive(self, text_data):
         """Handle messages from WebSocket"""
@@ -42,6 +175,15 @@ class ConversionConsumer(AsyncWebsocketConsumer):
                     'type': 'pong',
                     'timestamp': data.get('timestamp')
                 }))
+            elif message_type == 'cancel':
+                try:
+                    conversion_ids = [uuid.UUID(self.conversion_id)]
+                except ValueError:
+                    conversion_ids = []
+                await self.send(text_data=json.dumps({
+                    'type': 'cancelled',
+                    'conversion_ids': await cancel_conversions(conversion_ids)
+                }))
         except json.JSONDecodeError:
             pass
     
@@ -49,12 +191,234 @@ class ConversionConsumer(AsyncWebsocketConsumer):
         """
         Receive conversion progress from room group and send to WebSocket
         """
+        if event['conversion_id'] != self.conversion_id:
+            return
+        
+        # Drop events older than the snapshot sent on connect
+        if self.snapshot is not None:
+            if is_behind(event, self.snapshot):
+                return
+            self.snapshot = None
+        
         # Send message to WebSocket
+        await self.send(text_data=json.dumps(progress_message(event)))
+
+
+class ConversionStreamConsumer(AsyncWebsocketConsumer):
+    """
+    Multiplexed WebSocket consumer: one socket, many conversions.
+    
+    Clients send ``subscribe``/``unsubscribe`` messages with any of
+    ``conversion_ids``, ``batch_id`` or ``user: true``, and ``cancel``
+    messages with ``conversion_ids``. Progress events are
+    coalesced per conversion and flushed as a single ``progress_batch``
+    message WEBSOCKET_FLUSH_INTERVAL seconds after the first buffered one,
+    so idle sockets schedule nothing.
+    
+    The socket only joins batch and user stream groups (a conversion
+    followed by id is reached through its batch or user group, see
+    following_groups) and drops the events it does not follow, so
+    following many conversions of one batch costs one group membership.
+    """
+    
+    async def connect(self):
+        """Handle WebSocket connection"""
+        self.groups_joined = set()
+        self.conversion_groups = {}
+        self.stream_groups = set()
+        self.snapshots = {}
+        self.pending_updates = {}
+        self.flush_interval = getattr(settings, 'WEBSOCKET_FLUSH_INTERVAL', 0.25)
+        self.max_subscriptions = getattr(settings, 'WEBSOCKET_MAX_SUBSCRIPTIONS', 500)
+        
+        self.flush_task = None
+        await self.accept()
+    
+    async def disconnect(self, close_code):
+        """Handle WebSocket disconnection"""
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        self.conversion_groups.clear()
+        self.stream_groups.clear()
+        await self._sync_groups()
+    
+    async def receive(self, text_data):
+        """Handle messages from WebSocket"""
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        
+        message_type = data.get('type', '')
+        
+        if message_type == 'ping':
+            await self.send(text_data=json.dumps({
+                'type': 'pong',
+                'timestamp': data.get('timestamp')
+            }))
+        elif message_type in ['subscribe', 'unsubscribe']:
+            try:
+                conversion_ids, stream_groups = self._subscriptions_from_message(data)
+            except ValueError as e:
+                await self.send(text_data=json.dumps({'type': 'error', 'error': str(e)}))
+                return
+            
+            if message_type == 'subscribe':
+                await self.subscribe(conversion_ids, stream_groups)
+            else:
+                await self.unsubscribe(conversion_ids, stream_groups)
+        elif message_type == 'cancel':
+            try:
+                conversion_ids = [uuid.UUID(str(c)) for c in data.get('conversion_ids') or []]
+            except ValueError:
+                await self.send(text_data=json.dumps({'type': 'error', 'error': 'Invalid conversion id'}))
+                return
+            await self.send(text_data=json.dumps({
+                'type': 'cancelled',
+                'conversion_ids': await cancel_conversions(conversion_ids[:self.max_subscriptions])
+            }))
+    
+    def _subscriptions_from_message(self, data):
+        """
+        Translate a subscribe/unsubscribe message into what it names
+        
+        Returns:
+            tuple: (conversion ids, batch/user stream group names)
+        """
+        conversion_ids = []
+        stream_groups = []
+        
+        for conversion_id in data.get('conversion_ids') or []:
+            try:
+                conversion_ids.append(str(uuid.UUID(str(conversion_id))))
+            except ValueError:
+                raise ValueError(f'Invalid conversion id: {conversion_id}')
+        
+        user = self.scope.get('user')
+        if not user or not user.is_authenticated:
+            user = None
+        
+        batch_id = data.get('batch_id')
+        if batch_id:
+            if not BATCH_ID_RE.match(str(batch_id)):
+                raise ValueError(f'Invalid batch id: {batch_id}')
+            # Only the uploader's own batch group can be named
+            session = self.scope.get('session')
+            group = batch_group(
+                batch_id, user.pk if user else None,
+                session_digest(session.session_key if session else None)
+            )
+            if group is None:
+                raise ValueError('Batch stream requires the session or user that uploaded the batch')
+            stream_groups.append(group)
+        
+        if data.get('user'):
+            if user is None:
+                raise ValueError('User stream requires an authenticated session')
+            stream_groups.append(f'user_{user.pk}')
+        
+        return conversion_ids, stream_groups
+    
+    @property
+    def subscriptions(self):
+        """Number of conversions and streams followed"""
+        return len(self.conversion_groups) + len(self.stream_groups)
+    
+    async def _sync_groups(self):
+        """Join the groups the subscriptions need and leave the others"""
+        needed = set(self.conversion_groups.values()) | self.stream_groups
+        for group in needed - self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        for group in self.groups_joined - needed:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.groups_joined = needed
+    
+    async def subscribe(self, conversion_ids, stream_groups):
+        """Follow conversions and streams, bounded by WEBSOCKET_MAX_SUBSCRIPTIONS"""
+        new_ids = [c for c in dict.fromkeys(conversion_ids) if c not in self.conversion_groups]
+        new_groups = [g for g in dict.fromkeys(stream_groups) if g not in self.stream_groups]
+        if self.subscriptions + len(new_ids) + len(new_groups) > self.max_subscriptions:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'error': f'Subscription limit of {self.max_subscriptions} reached'
+            }))
+            return
+        
+        if new_ids:
+            self.conversion_groups.update(await following_groups(new_ids))
+        self.stream_groups.update(new_groups)
+        await self._sync_groups()
+        
         await self.send(text_data=json.dumps({
-            'type': 'progress',
-            'conversion_id': event['conversion_id'],
-            'progress': event['progress'],
-            'status': event['status'],
-            'error': event.get('error')
+            'type': 'subscribed',
+            'subscriptions': self.subscriptions
+        }))
+        
+        # Replay current state for newly subscribed conversions on the next flush
+        if new_ids:
+            snapshots = await load_progress_snapshots(new_ids)
+            self.snapshots.update(snapshots)
+            for conversion_id, event in snapshots.items():
+                self.pending_updates.setdefault(conversion_id, progress_message(event))
+            self._schedule_flush()
+    
+    async def unsubscribe(self, conversion_ids, stream_groups):
+        """Stop following conversions and streams"""
+        for conversion_id in conversion_ids:
+            self.conversion_groups.pop(conversion_id, None)
+            self.snapshots.pop(conversion_id, None)
+        self.stream_groups.difference_update(stream_groups)
+        await self._sync_groups()
+        
+        await self.send(text_data=json.dumps({
+            'type': 'unsubscribed',
+            'subscriptions': self.subscriptions
+        }))
+    
+    async def conversion_progress(self, event):
+        """
+        Buffer progress events; only the latest event per conversion is kept
+        
+        Events of conversions that are neither followed by id nor part of
+        a followed stream are dropped.
+        """
+        followed = (
+            event['conversion_id'] in self.conversion_groups
+            or not self.stream_groups.isdisjoint(event.get('groups', ()))
+        )
+        if not followed:
+            return
+        
+        # Drop events older than the snapshot replayed on subscribe
+        snapshot = self.snapshots.get(event['conversion_id'])
+        if snapshot is not None:
+            if is_behind(event, snapshot):
+                return
+            del self.snapshots[event['conversion_id']]
+        
+        self.pending_updates[event['conversion_id']] = progress_message(event)
+        self._schedule_flush()
+    
+    def _schedule_flush(self):
+        """Flush in one interval, unless a flush is already scheduled"""
+        if self.pending_updates and self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+    
+    async def _flush_later(self):
+        """Send the buffered progress updates after one flush interval"""
+        await asyncio.sleep(self.flush_interval)
+        # Events arriving while sending schedule the next flush
+        self.flush_task = None
+        await self.flush()
+    
+    async def flush(self):
+        """Send all buffered progress updates as one message"""
+        if not self.pending_updates:
+            return
+        
+        updates = list(self.pending_updates.values())
+        self.pending_updates = {}
+        await self.send(text_data=json.dumps({
+            'type': 'progress_batch',
+            'updates': updates
         }))
-
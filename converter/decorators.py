@@ -0,0 +1,35 @@
+"""
+View decorators that work with native async views
+
+Django 4.2's ``require_http_methods`` and ``csrf_exempt`` wrap views in a
+sync function, which turns an ``async def`` view back into a sync one.
+"""
+from functools import wraps
+
+from django.http import HttpResponseNotAllowed
+
+
+def async_require_http_methods(request_method_list):
+    """Async equivalent of django.views.decorators.http.require_http_methods"""
+
+    def decorator(func):
+        @wraps(func)
+        async def inner(request, *args, **kwargs):
+            if request.method not in request_method_list:
+                return HttpResponseNotAllowed(request_method_list)
+            return await func(request, *args, **kwargs)
+
+        return inner
+
+    return decorator
+
+
+def async_csrf_exempt(view_func):
+    """Async equivalent of django.views.decorators.csrf.csrf_exempt"""
+
+    @wraps(view_func)
+    async def wrapper_view(*args, **kwargs):
+        return await view_func(*args, **kwargs)
+
+    wrapper_view.csrf_exempt = True
+    return wrapper_view
@@ -0,0 +1,91 @@
+"""
+Streaming reader for DOCX body text
+
+python-docx parses the whole main document part into its object model
+before the first paragraph can be read, which takes gigabytes for large
+exports. ``iter_paragraphs`` instead iterparses the part straight out of
+the zip and drops each body paragraph once its text has been yielded, so
+memory stays flat whatever the document length.
+
+The text matches ``Document(path).paragraphs``: one string per top-level
+paragraph (not those inside tables or text boxes), made of the runs and
+hyperlinked runs, with tabs, line breaks and non-breaking hyphens
+translated as python-docx does.
+"""
+from lxml import etree
+import posixpath
+import zipfile
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_BODY, W_P, W_R, W_HYPERLINK = f'{W}body', f'{W}p', f'{W}r', f'{W}hyperlink'
+W_T, W_BR, W_TYPE = f'{W}t', f'{W}br', f'{W}type'
+# Run children with a fixed text equivalent
+RUN_TEXT = {f'{W}tab': '\t', f'{W}ptab': '\t', f'{W}cr': '\n', f'{W}noBreakHyphen': '-'}
+
+PACKAGE_RELS = '_rels/.rels'
+OFFICE_DOCUMENT_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+DEFAULT_DOCUMENT_PART = 'word/document.xml'
+
+
+def document_part_name(archive):
+    """Zip member name of the main document part, from the package relationships"""
+    try:
+        rels = etree.fromstring(archive.read(PACKAGE_RELS))
+    except (KeyError, etree.XMLSyntaxError):
+        return DEFAULT_DOCUMENT_PART
+    for rel in rels:
+        if rel.get('Type') == OFFICE_DOCUMENT_REL:
+            return posixpath.normpath(rel.get('Target', '').lstrip('/'))
+    return DEFAULT_DOCUMENT_PART
+
+
+def run_text(run):
+    """Text of a w:r element"""
+    parts = []
+    for child in run:
+        if child.tag == W_T:
+            parts.append(child.text or '')
+        elif child.tag == W_BR:
+            # Page and column breaks have no text equivalent
+            if child.get(W_TYPE, 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        elif child.tag in RUN_TEXT:
+            parts.append(RUN_TEXT[child.tag])
+    return ''.join(parts)
+
+
+def paragraph_text(paragraph):
+    """Text of a w:p element: its runs, including those inside hyperlinks"""
+    parts = []
+    for child in paragraph:
+        if child.tag == W_R:
+            parts.append(run_text(child))
+        elif child.tag == W_HYPERLINK:
+            parts.extend(run_text(run) for run in child if run.tag == W_R)
+    return ''.join(parts)
+
+
+def iter_paragraphs(source_path):
+    """
+    Yield the text of each top-level paragraph of a DOCX file, in order
+
+    Raises:
+        zipfile.BadZipFile, KeyError, etree.XMLSyntaxError: If the file is
+        not a readable DOCX package
+    """
+    with zipfile.ZipFile(source_path) as archive:
+        with archive.open(document_part_name(archive)) as part:
+            events = etree.iterparse(
+                part, events=('end',), tag=W_P, huge_tree=True, resolve_entities=False
+            )
+            for _, paragraph in events:
+                body = paragraph.getparent()
+                if body is None or body.tag != W_BODY:
+                    # Nested paragraphs go with their top-level table or frame
+                    continue
+                yield paragraph_text(paragraph)
+
+                # Drop this paragraph and everything before it in the body
+                paragraph.clear(keep_tail=True)
+                while paragraph.getprevious() is not None:
+                    del body[0]
@@ -0,0 +1,182 @@
+"""
+Processing-time (ETA) estimation from conversion history
+
+A small linear model per format pair, seconds = a + b * size_mb + c * units,
+is fitted on recently completed conversions. "units" is the probed cost
+driver: pages for PDFs, seconds for videos, megapixels for images. The
+fitted model is published through the shared cache by a periodic task
+and kept in process memory, so estimating never touches the database.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from datetime import timedelta
+import time
+
+import numpy as np
+
+from .models import ConversionArchive, FileConversion
+
+MODEL_CACHE_KEY = 'eta_model'
+
+_model = None
+_model_loaded_at = 0
+
+
+def cost_units(media_info):
+    """Probed cost driver of a conversion: pages, seconds or megapixels"""
+    media_info = media_info or {}
+    if media_info.get('pages'):
+        return float(media_info['pages'])
+    if media_info.get('duration'):
+        return float(media_info['duration'])
+    if media_info.get('width') and media_info.get('height'):
+        return media_info['width'] * media_info['height'] / 1e6
+    return 0.0
+
+
+def _fit(rows):
+    """Least-squares fit of [intercept, per-MB, per-unit] coefficients"""
+    X = np.array([[1.0, r['file_size'] / (1024 * 1024), cost_units(r['media_info'])] for r in rows])
+    y = np.array([r['seconds'] for r in rows])
+    coefficients, *_ = np.linalg.lstsq(X, y, rcond=None)
+    return [max(0.0, float(c)) for c in coefficients]
+
+
+def fit_eta_model():
+    """
+    Fit the ETA model from completed conversions in the last ETA_TRAINING_DAYS
+
+    Returns:
+        dict: pairs -> coefficients, types -> coefficients and mean seconds
+    """
+    since = timezone.now() - timedelta(days=settings.ETA_TRAINING_DAYS)
+    rows = []
+    # Conversions older than ARCHIVE_AFTER_DAYS only exist in the archive
+    for model in [FileConversion, ConversionArchive]:
+        rows += (
+            model.objects
+            .filter(status='completed', completed_at__gte=since, started_at__isnull=False)
+            .order_by('-completed_at')
+            .values('original_format', 'target_format', 'conversion_type',
+                    'file_size', 'media_info', 'started_at', 'completed_at')
+            [:settings.ETA_TRAINING_LIMIT - len(rows)]
+        )
+
+    by_pair = {}
+    by_type = {}
+    for row in rows:
+        row['seconds'] = (row['completed_at'] - row['started_at']).total_seconds()
+        by_pair.setdefault(f"{row['original_format']}:{row['target_format']}", []).append(row)
+        by_type.setdefault(row['conversion_type'], []).append(row)
+
+    model = {'pairs': {}, 'types': {}, 'type_means': {}, 'fitted_at': time.time()}
+    for pair, pair_rows in by_pair.items():
+        if len(pair_rows) >= settings.ETA_MIN_SAMPLES:
+            model['pairs'][pair] = _fit(pair_rows)
+    for conversion_type, type_rows in by_type.items():
+        model['type_means'][conversion_type] = float(np.mean([r['seconds'] for r in type_rows]))
+        if len(type_rows) >= settings.ETA_MIN_SAMPLES:
+            model['types'][conversion_type] = _fit(type_rows)
+
+    return model
+
+
+def refresh_eta_model():
+    """Refit the model and publish it to every process through the cache"""
+    global _model, _model_loaded_at
+    model = fit_eta_model()
+    cache.set(MODEL_CACHE_KEY, model, None)
+    _model, _model_loaded_at = model, time.monotonic()
+    return model
+
+
+def _model_is_stale():
+    return _model is None or time.monotonic() - _model_loaded_at > settings.ETA_MODEL_RELOAD_SECONDS
+
+
+def get_eta_model():
+    """In-memory model, re-read from the cache every ETA_MODEL_RELOAD_SECONDS"""
+    global _model, _model_loaded_at
+    if _model_is_stale():
+        try:
+            _model = cache.get(MODEL_CACHE_KEY) or {}
+        except Exception as e:
+            print(f"Could not load ETA model: {e}")
+            _model = _model or {}
+        _model_loaded_at = time.monotonic()
+    return _model
+
+
+async def aget_eta_model():
+    """
+    get_eta_model for async views
+
+    Awaited before estimating, so the estimates that follow find the model
+    in memory instead of reading the cache on the event loop.
+    """
+    global _model, _model_loaded_at
+    if _model_is_stale():
+        try:
+            _model = await cache.aget(MODEL_CACHE_KEY) or {}
+        except Exception as e:
+            print(f"Could not load ETA model: {e}")
+            _model = _model or {}
+        _model_loaded_at = time.monotonic()
+    return _model
+
+
+def typical_seconds(conversion_type):
+    """Mean processing time of a conversion type (falls back to ADMISSION_TYPE_SECONDS)"""
+    mean = get_eta_model().get('type_means', {}).get(conversion_type)
+    if mean is not None:
+        return mean
+    return settings.ADMISSION_TYPE_SECONDS.get(conversion_type, 30)
+
+
+def estimate_seconds(original_format, target_format, conversion_type, file_size, media_info=None):
+    """Predicted processing time of a conversion, in seconds"""
+    model = get_eta_model()
+    coefficients = (
+        model.get('pairs', {}).get(f'{original_format}:{target_format}')
+        or model.get('types', {}).get(conversion_type)
+    )
+    if not coefficients:
+        return float(typical_seconds(conversion_type))
+
+    a, b, c = coefficients
+    return a + b * file_size / (1024 * 1024) + c * cost_units(media_info)
+
+
+def estimate_conversion(conversion):
+    """Predicted processing time of a FileConversion, in seconds"""
+    return estimate_seconds(
+        conversion.original_format,
+        conversion.target_format,
+        conversion.conversion_type,
+        conversion.file_size,
+        conversion.media_info
+    )
+
+
+def remaining_seconds(conversion):
+    """Predicted seconds until a pending or processing conversion finishes"""
+    if conversion.status not in ['pending', 'processing']:
+        return None
+    estimate = estimate_conversion(conversion)
+    if conversion.status == 'processing' and conversion.started_at:
+        estimate -= (timezone.now() - conversion.started_at).total_seconds()
+    return round(max(0.0, estimate), 1)
+
+
+def predicted_finish(conversion):
+    """
+    Predicted completion time of a processing conversion, or None
+
+    Unlike remaining_seconds this does not change from one call to the
+    next, so it can go into cache validators.
+    """
+    if conversion.status != 'processing' or not conversion.started_at:
+        return None
+    finish = conversion.started_at + timedelta(seconds=estimate_conversion(conversion))
+    return finish.replace(microsecond=0)
@@ -0,0 +1,521 @@
+"""
+End-to-end load-test harness (used by ``manage.py loadtest``)
+
+``LocalStack`` starts throw-away Redis and PostgreSQL servers, the ASGI
+app (daphne) and Celery workers as subprocesses. ``run_load`` drives a mix
+of virtual users against a base URL:
+
+- uploaders post generated files in a loop
+- pollers check the status of in-flight conversions (single or bulk)
+- subscribers follow progress over WebSockets (one stream socket per
+  subscriber, or one ConversionConsumer socket per conversion)
+- downloaders fetch completed conversions
+
+``Metrics`` records per-operation latencies and errors and samples the
+broker queue depth, so the report gives p50/p95/p99, throughput and error
+rates overall and over time.
+"""
+from io import BytesIO
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+
+# Conversion mixes: name -> (file name, conversion type, target format)
+WORKLOADS = {
+    'image': ('loadtest.jpg', 'image', 'png'),
+    'document': ('loadtest.txt', 'document', 'pdf'),
+    'pdf': ('loadtest.pdf', 'document', 'docx'),
+}
+
+
+# ==================== LOCAL STACK ====================
+
+def free_port():
+    """An unused TCP port on localhost"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30, process=None):
+    """Block until something listens on localhost:port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before listening on {port}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+class LocalStack:
+    """
+    Redis, PostgreSQL, daphne and Celery workers in a temporary directory
+
+    Existing Redis or PostgreSQL servers can be used instead of spawning
+    stand-ins by passing their URLs. Logs are kept in ``run_dir``.
+    """
+
+    def __init__(self, workers=1, concurrency=2, redis_url=None, database_url=None, env=None):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.redis_url = redis_url
+        self.database_url = database_url
+        self.extra_env = env or {}
+        self.run_dir = tempfile.mkdtemp(prefix='fileconverter-loadtest-')
+        self.processes = []
+        self.pg_data = None
+        self.base_url = None
+
+    def _spawn(self, name, args, env=None):
+        log = open(os.path.join(self.run_dir, f'{name}.log'), 'w')
+        process = subprocess.Popen(
+            args, stdout=log, stderr=subprocess.STDOUT, env=env,
+            cwd=settings.BASE_DIR
+        )
+        self.processes.append((name, process, log))
+        return process
+
+    def _start_redis(self):
+        binary = shutil.which('redis-server')
+        if not binary:
+            raise RuntimeError('redis-server not found; install it or pass --redis-url')
+        port = free_port()
+        process = self._spawn('redis', [binary, '--port', str(port), '--save', '', '--appendonly', 'no'])
+        wait_for_port(port, process=process)
+        return f'redis://127.0.0.1:{port}/0'
+
+    def _start_postgres(self):
+        initdb, pg_ctl = shutil.which('initdb'), shutil.which('pg_ctl')
+        if not (initdb and pg_ctl):
+            raise RuntimeError('initdb/pg_ctl not found; install PostgreSQL or pass --database-url')
+        port = free_port()
+        self.pg_data = os.path.join(self.run_dir, 'pgdata')
+        subprocess.run(
+            [initdb, '-D', self.pg_data, '-U', 'postgres', '--auth=trust'],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        subprocess.run([
+            pg_ctl, '-D', self.pg_data, '-w', '-l', os.path.join(self.run_dir, 'postgres.log'),
+            '-o', f'-p {port} -k {self.run_dir} -c listen_addresses=127.0.0.1', 'start'
+        ], check=True, stdout=subprocess.DEVNULL)
+        return f'postgresql://postgres@127.0.0.1:{port}/postgres'
+
+    def environment(self):
+        env = dict(os.environ)
+        env.update({
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'fileconverter.settings'),
+            'REDIS_URL': self.redis_url,
+            'DATABASE_URL': self.database_url,
+            'MEDIA_ROOT': os.path.join(self.run_dir, 'media'),
+            'SCRATCH_ROOT': os.path.join(self.run_dir, 'scratch'),
+            'ADMISSION_WORKER_CONCURRENCY': str(self.workers * self.concurrency),
+        })
+        env.update(self.extra_env)
+        return env
+
+    def start(self):
+        if not self.redis_url:
+            self.redis_url = self._start_redis()
+        if not self.database_url:
+            self.database_url = self._start_postgres()
+        env = self.environment()
+
+        manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py')]
+        subprocess.run(manage + ['migrate', '--noinput'], check=True, env=env,
+                       cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL)
+
+        for index in range(self.workers):
+            self._spawn(f'worker{index}', [
+                sys.executable, '-m', 'celery', '-A', 'fileconverter', 'worker',
+                '--loglevel', 'warning', '--concurrency', str(self.concurrency),
+                '-n', f'loadtest{index}@%h',
+            ], env=env)
+
+        port = free_port()
+        web = self._spawn('web', [
+            sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(port),
+            'fileconverter.asgi:application'
+        ], env=env)
+        wait_for_port(port, process=web)
+        self.base_url = f'http://127.0.0.1:{port}'
+        return self
+
+    def stop(self):
+        for _, process, log in reversed(self.processes):
+            process.terminate()
+        for _, process, log in reversed(self.processes):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+        self.processes = []
+        if self.pg_data:
+            subprocess.run([shutil.which('pg_ctl'), '-D', self.pg_data, '-m', 'fast', 'stop'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.pg_data = None
+
+    def __enter__(self):
+        try:
+            return self.start()
+        except Exception:
+            self.stop()
+            raise
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+# ==================== METRICS ====================
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values), max(1, math.ceil(fraction * len(sorted_values)))) - 1
+    return sorted_values[index]
+
+
+class Metrics:
+    """Latencies, errors and queue depth samples of a load-test run"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latencies = {}
+        self.errors = {}
+        self.rejected = {}
+        self.counters = {}
+        self.samples = []
+        self.unfinished = 0
+        self._interval_counts = {}
+
+    def count(self, event):
+        """Count an event that has no latency (e.g. a WebSocket message)"""
+        self.counters[event] = self.counters.get(event, 0) + 1
+        self._interval_counts[event] = self._interval_counts.get(event, 0) + 1
+
+    def record(self, operation, seconds):
+        self.latencies.setdefault(operation, []).append(seconds)
+        self._interval_counts[operation] = self._interval_counts.get(operation, 0) + 1
+
+    def error(self, operation, rejected=False):
+        counts = self.rejected if rejected else self.errors
+        counts[operation] = counts.get(operation, 0) + 1
+
+    def sample(self, queue_depth):
+        """Close the current interval: throughput per operation and queue depth"""
+        now = time.monotonic()
+        last = self.samples[-1]['elapsed'] if self.samples else 0
+        elapsed = now - self.started
+        sample = {
+            'elapsed': round(elapsed, 1),
+            'queue_depth': queue_depth,
+            'throughput': {
+                op: round(count / max(elapsed - last, 1e-9), 2)
+                for op, count in self._interval_counts.items()
+            },
+            'errors': sum(self.errors.values()),
+        }
+        self._interval_counts = {}
+        self.samples.append(sample)
+        return sample
+
+    def summary(self):
+        """Per-operation count, errors, rate and latency percentiles (ms)"""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        operations = {}
+        for op in sorted(set(self.latencies) | set(self.errors) | set(self.rejected)):
+            values = sorted(self.latencies.get(op, []))
+            errors = self.errors.get(op, 0)
+            total = len(values) + errors + self.rejected.get(op, 0)
+            operations[op] = {
+                'count': len(values),
+                'errors': errors,
+                'rejected': self.rejected.get(op, 0),
+                'error_rate': round(errors / total, 4) if total else 0,
+                'per_second': round(len(values) / elapsed, 2),
+                'p50_ms': _ms(percentile(values, 0.50)),
+                'p95_ms': _ms(percentile(values, 0.95)),
+                'p99_ms': _ms(percentile(values, 0.99)),
+            }
+        return {
+            'duration': round(elapsed, 1),
+            'operations': operations,
+            'counters': {
+                event: {'count': count, 'per_second': round(count / elapsed, 2)}
+                for event, count in sorted(self.counters.items())
+            },
+            'unfinished_conversions': self.unfinished,
+            'samples': self.samples,
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+# ==================== WORKLOAD ====================
+
+def make_sample_file(workload, image_size=(1024, 768)):
+    """Generate the bytes of a sample input for a workload"""
+    buffer = BytesIO()
+    if workload == 'image':
+        from PIL import Image
+        import numpy as np
+        pixels = np.random.randint(0, 255, (image_size[1], image_size[0], 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(buffer, 'JPEG', quality=85)
+    elif workload == 'document':
+        buffer.write(('Load test line of text.\n' * 2000).encode())
+    elif workload == 'pdf':
+        from reportlab.lib.pagesizes import letter
+        from reportlab.pdfgen import canvas
+        pdf = canvas.Canvas(buffer, pagesize=letter)
+        for page in range(5):
+            for line in range(40):
+                pdf.drawString(72, 720 - line * 16, f'Page {page + 1}, line {line + 1} of the load test')
+            pdf.showPage()
+        pdf.save()
+    else:
+        raise ValueError(f'Unknown workload: {workload}')
+    return buffer.getvalue()
+
+
+def parse_mix(text):
+    """'image=0.7,pdf=0.3' -> {'image': 0.7, 'pdf': 0.3}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in WORKLOADS:
+            raise ValueError(f'Unknown workload {name!r} (choose from {", ".join(WORKLOADS)})')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class LoadRun:
+    """Shared state of the virtual users"""
+
+    def __init__(self, base_url, metrics, mix, deadline):
+        self.base_url = base_url.rstrip('/')
+        self.ws_url = 'ws' + self.base_url[len('http'):]
+        self.metrics = metrics
+        self.mix = mix
+        self.deadline = deadline
+        self.batch_id = f'loadtest-{uuid.uuid4().hex[:12]}'
+        self.samples = {name: make_sample_file(name) for name in mix}
+        self.in_flight = {}  # conversion id -> upload time
+        self.completed = []
+
+    def running(self):
+        return time.monotonic() < self.deadline
+
+    def finished(self, conversion_id, status, source):
+        uploaded_at = self.in_flight.pop(conversion_id, None)
+        if uploaded_at is None:
+            return
+        if status == 'completed':
+            self.metrics.record(f'end_to_end ({source})', time.monotonic() - uploaded_at)
+            self.completed.append(conversion_id)
+        else:
+            self.metrics.error(f'end_to_end ({source})')
+
+
+async def timed(run, operation, request):
+    """Await an HTTP request, recording its latency or error"""
+    start = time.monotonic()
+    try:
+        response = await request
+    except Exception:
+        run.metrics.error(operation)
+        return None
+    if response.status_code == 429:
+        run.metrics.error(operation, rejected=True)
+    elif response.status_code >= 400:
+        run.metrics.error(operation)
+    else:
+        run.metrics.record(operation, time.monotonic() - start)
+    return response
+
+
+async def upload_one(run, client):
+    names, weights = zip(*run.mix.items())
+    workload = random.choices(names, weights)[0]
+    filename, conversion_type, target_format = WORKLOADS[workload]
+    response = await timed(run, f'upload ({workload})', client.post(
+        f'{run.base_url}/api/upload/',
+        files={'file': (filename, run.samples[workload])},
+        data={'conversion_type': conversion_type, 'target_format': target_format,
+              'batch_id': run.batch_id},
+    ))
+    if response is not None and response.status_code == 200:
+        run.in_flight[response.json()['conversion_id']] = time.monotonic()
+    elif response is not None and response.status_code == 429:
+        await asyncio.sleep(float(response.headers.get('Retry-After', 1)))
+
+
+async def uploader(run, client):
+    while run.running():
+        await upload_one(run, client)
+
+
+async def poller(run, client, interval, bulk):
+    while run.running():
+        await asyncio.sleep(interval)
+        ids = list(run.in_flight)[:settings.STATUS_BULK_MAX_IDS]
+        if not ids:
+            continue
+        if bulk:
+            response = await timed(run, 'status (bulk)', client.post(
+                f'{run.base_url}/api/status/bulk/', json={'ids': ids}
+            ))
+            statuses = response.json()['conversions'] if response is not None and response.status_code == 200 else []
+        else:
+            statuses = []
+            for conversion_id in ids:
+                response = await timed(run, 'status', client.get(f'{run.base_url}/api/status/{conversion_id}/'))
+                if response is not None and response.status_code == 200:
+                    statuses.append(response.json())
+        for status in statuses:
+            if status['status'] in ['completed', 'failed', 'cancelled']:
+                run.finished(status['id'], status['status'], 'poll')
+
+
+async def stream_subscriber(run, websockets, cookies):
+    """One multiplexed socket following the whole batch, in the uploaders' session"""
+    start = time.monotonic()
+    try:
+        async with websockets.connect(f'{run.ws_url}/ws/conversions/', additional_headers={'Cookie': cookies}) as ws:
+            await ws.send(json.dumps({'type': 'subscribe', 'batch_id': run.batch_id}))
+            run.metrics.record('ws connect', time.monotonic() - start)
+            while run.running():
+                try:
+                    message = json.loads(await asyncio.wait_for(ws.recv(), timeout=1))
+                except asyncio.TimeoutError:
+                    continue
+                run.metrics.count('ws message')
+                for update in message.get('updates', []):
+                    if update['status'] in ['completed', 'failed']:
+                        run.finished(update['conversion_id'], update['status'], 'ws')
+    except Exception:
+        run.metrics.error('ws connect')
+
+
+async def conversion_subscriber(run, websockets, cookies):
+    """One ConversionConsumer socket per conversion, like the web UI"""
+    while run.running():
+        pending = list(run.in_flight)
+        if not pending:
+            await asyncio.sleep(0.2)
+            continue
+        conversion_id = random.choice(pending)
+        start = time.monotonic()
+        try:
+            async with websockets.connect(f'{run.ws_url}/ws/conversion/{conversion_id}/') as ws:
+                run.metrics.record('ws connect', time.monotonic() - start)
+                while run.running() and conversion_id in run.in_flight:
+                    try:
+                        message = json.loads(await asyncio.wait_for(ws.recv(), timeout=1))
+                    except asyncio.TimeoutError:
+                        continue
+                    run.metrics.count('ws message')
+                    if message.get('status') in ['completed', 'failed']:
+                        run.finished(conversion_id, message['status'], 'ws')
+        except Exception:
+            run.metrics.error('ws connect')
+
+
+async def downloader(run, client):
+    while run.running():
+        if not run.completed:
+            await asyncio.sleep(0.2)
+            continue
+        conversion_id = random.choice(run.completed)
+        start = time.monotonic()
+        try:
+            async with client.stream('GET', f'{run.base_url}/api/download/{conversion_id}/') as response:
+                async for _ in response.aiter_bytes():
+                    pass
+            if response.status_code >= 400:
+                run.metrics.error('download')
+            else:
+                run.metrics.record('download', time.monotonic() - start)
+        except Exception:
+            run.metrics.error('download')
+
+
+def get_queue_depth_from(redis_url):
+    """Length of the default Celery queue in a Redis broker, over all priority lists"""
+    import redis
+    connection = redis.Redis.from_url(redis_url)
+    options = settings.CELERY_BROKER_TRANSPORT_OPTIONS
+    names = ['celery'] + [
+        f"celery{options['sep']}{priority}" for priority in options['priority_steps'] if priority
+    ]
+
+    def depth():
+        try:
+            return sum(connection.llen(name) for name in names)
+        except Exception:
+            return None
+    return depth
+
+
+async def sampler(run, interval, queue_depth, report):
+    while run.running():
+        await asyncio.sleep(interval)
+        depth = await asyncio.to_thread(queue_depth) if queue_depth else None
+        report(run.metrics.sample(depth), len(run.in_flight))
+
+
+async def run_load(base_url, duration=60, uploaders=4, pollers=2, subscribers=2, downloaders=1,
+                   mix=None, poll_interval=1.0, bulk_status=True, ws_mode='stream',
+                   report_interval=5, queue_depth=None, report=None):
+    """
+    Drive the app at ``base_url`` for ``duration`` seconds
+
+    Returns:
+        Metrics: The recorded measurements
+    """
+    import httpx
+
+    metrics = Metrics()
+    run = LoadRun(base_url, metrics, mix or {'image': 1}, time.monotonic() + duration)
+    report = report or (lambda sample, in_flight: None)
+
+    limits = httpx.Limits(max_connections=uploaders + pollers + downloaders + 10)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        # Batch streams belong to the uploading session: start it with one
+        # upload, so every later request shares its cookie
+        await upload_one(run, client)
+        cookies = '; '.join(f'{name}={value}' for name, value in client.cookies.items())
+
+        tasks = [uploader(run, client) for _ in range(uploaders)]
+        tasks += [poller(run, client, poll_interval, bulk_status) for _ in range(pollers)]
+        tasks += [downloader(run, client) for _ in range(downloaders)]
+        if subscribers:
+            try:
+                import websockets
+            except ImportError:
+                raise RuntimeError('WebSocket subscribers need the "websockets" package')
+            subscriber = stream_subscriber if ws_mode == 'stream' else conversion_subscriber
+            tasks += [subscriber(run, websockets, cookies) for _ in range(subscribers)]
+        tasks.append(sampler(run, report_interval, queue_depth, report))
+        await asyncio.gather(*tasks)
+
+    metrics.unfinished = len(run.in_flight)
+    return metrics
@@ -0,0 +1,123 @@
+"""
+Run an end-to-end load test against a local stack or a running deployment
+
+    python manage.py loadtest --duration 60 --uploaders 8 --mix image=0.7,pdf=0.3
+    python manage.py loadtest --url http://staging:8000 --redis-url redis://staging:6379/0
+"""
+from django.core.management.base import BaseCommand, CommandError
+import asyncio
+import json
+import logging
+
+from converter.loadtest import LocalStack, get_queue_depth_from, parse_mix, run_load
+
+
+class Command(BaseCommand):
+    help = 'Drive concurrent uploads, status polls, WebSocket subscribers and downloads and report latencies'
+
+    def add_arguments(self, parser):
+        target = parser.add_argument_group('target')
+        target.add_argument('--url', help='Test a running deployment instead of starting a local stack')
+        target.add_argument('--redis-url', help='Use this Redis (broker) instead of a local stand-in')
+        target.add_argument('--database-url', help='Use this database instead of a local PostgreSQL stand-in')
+        target.add_argument('--workers', type=int, default=1, help='Celery worker processes to start')
+        target.add_argument('--concurrency', type=int, default=2, help='Pool size of each worker')
+        target.add_argument('--keep-rate-limits', action='store_true',
+                            help='Keep upload rate limiting enabled on the local stack')
+
+        load = parser.add_argument_group('load')
+        load.add_argument('--duration', type=float, default=60, help='Seconds of load')
+        load.add_argument('--uploaders', type=int, default=4)
+        load.add_argument('--pollers', type=int, default=2)
+        load.add_argument('--subscribers', type=int, default=2)
+        load.add_argument('--downloaders', type=int, default=1)
+        load.add_argument('--mix', default='image=1', help='Workload weights, e.g. image=0.7,document=0.2,pdf=0.1')
+        load.add_argument('--poll-interval', type=float, default=1.0)
+        load.add_argument('--single-status', action='store_true',
+                          help='Poll /api/status/<id>/ per conversion instead of the bulk endpoint')
+        load.add_argument('--ws-mode', choices=['stream', 'conversion'], default='stream',
+                          help='One multiplexed socket per subscriber, or one socket per conversion')
+
+        output = parser.add_argument_group('output')
+        output.add_argument('--report-interval', type=float, default=5)
+        output.add_argument('--json', dest='json_path', help='Write the full report to this file')
+
+    def handle(self, *args, **options):
+        # One log line per request would drown the report
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        stack = None
+        base_url = options['url']
+        redis_url = options['redis_url']
+        try:
+            if not base_url:
+                env = {} if options['keep_rate_limits'] else {'UPLOAD_RATE_LIMIT_PER_MINUTE': '0'}
+                stack = LocalStack(
+                    workers=options['workers'],
+                    concurrency=options['concurrency'],
+                    redis_url=redis_url,
+                    database_url=options['database_url'],
+                    env=env,
+                )
+                self.stdout.write(f'Starting local stack in {stack.run_dir} ...')
+                stack.__enter__()
+                base_url, redis_url = stack.base_url, stack.redis_url
+                self.stdout.write(f'App listening on {base_url}')
+
+            metrics = asyncio.run(run_load(
+                base_url,
+                duration=options['duration'],
+                uploaders=options['uploaders'],
+                pollers=options['pollers'],
+                subscribers=options['subscribers'],
+                downloaders=options['downloaders'],
+                mix=mix,
+                poll_interval=options['poll_interval'],
+                bulk_status=not options['single_status'],
+                ws_mode=options['ws_mode'],
+                report_interval=options['report_interval'],
+                queue_depth=get_queue_depth_from(redis_url) if redis_url else None,
+                report=self.report_sample,
+            ))
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        finally:
+            if stack is not None:
+                stack.__exit__(None, None, None)
+
+        summary = metrics.summary()
+        self.print_summary(summary)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(summary, f, indent=2)
+            self.stdout.write(f"Report written to {options['json_path']}")
+
+    def report_sample(self, sample, in_flight):
+        rates = ', '.join(f'{op} {rate}/s' for op, rate in sorted(sample['throughput'].items()))
+        self.stdout.write(
+            f"[{sample['elapsed']:>6}s] queue={sample['queue_depth']} in_flight={in_flight} "
+            f"errors={sample['errors']} {rates}"
+        )
+
+    def print_summary(self, summary):
+        self.stdout.write('')
+        self.stdout.write(f"{'operation':<28}{'count':>8}{'err%':>7}{'429':>6}{'/s':>8}"
+                          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for op, stats in summary['operations'].items():
+            self.stdout.write(
+                f"{op:<28}{stats['count']:>8}{stats['error_rate'] * 100:>7.1f}{stats['rejected']:>6}"
+                f"{stats['per_second']:>8}{_fmt(stats['p50_ms']):>10}{_fmt(stats['p95_ms']):>10}"
+                f"{_fmt(stats['p99_ms']):>10}"
+            )
+        for event, stats in summary['counters'].items():
+            self.stdout.write(f"{event:<28}{stats['count']:>8}{'':>13}{stats['per_second']:>8}")
+        self.stdout.write(f"Unfinished conversions at the end: {summary['unfinished_conversions']}")
+
+
+def _fmt(value):
+    return '-' if value is None else value
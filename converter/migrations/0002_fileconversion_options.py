@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileconversion',
+            name='options',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
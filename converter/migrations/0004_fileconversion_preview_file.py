@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0003_fileconversion_batch_id_fileconversion_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileconversion',
+            name='preview_file',
+            field=models.FileField(blank=True, null=True, upload_to='previews/%Y/%m/%d/'),
+        ),
+    ]
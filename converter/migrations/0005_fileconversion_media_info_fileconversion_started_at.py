@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0004_fileconversion_preview_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileconversion',
+            name='media_info',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='fileconversion',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
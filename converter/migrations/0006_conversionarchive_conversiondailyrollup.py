@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0005_fileconversion_media_info_fileconversion_started_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversionArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('original_format', models.CharField(max_length=10)),
+                ('target_format', models.CharField(max_length=10)),
+                ('conversion_type', models.CharField(choices=[('image', 'Image Conversion'), ('document', 'Document Conversion'), ('video', 'Video Conversion')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], max_length=20)),
+                ('error_summary', models.CharField(blank=True, default='', max_length=255)),
+                ('file_size', models.BigIntegerField(default=0)),
+                ('converted_file_size', models.BigIntegerField(blank=True, default=0, null=True)),
+                ('media_info', models.JSONField(blank=True, default=dict)),
+                ('user_id', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ConversionDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('original_format', models.CharField(max_length=10)),
+                ('target_format', models.CharField(max_length=10)),
+                ('conversion_type', models.CharField(choices=[('image', 'Image Conversion'), ('document', 'Document Conversion'), ('video', 'Video Conversion')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('input_bytes', models.BigIntegerField(default=0)),
+                ('output_bytes', models.BigIntegerField(default=0)),
+                ('timed_count', models.PositiveIntegerField(default=0)),
+                ('processing_seconds', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-date', 'original_format', 'target_format', 'status'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='conversiondailyrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'original_format', 'target_format', 'conversion_type', 'status'), name='unique_conversion_daily_rollup'),
+        ),
+    ]
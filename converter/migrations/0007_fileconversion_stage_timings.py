@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0006_conversionarchive_conversiondailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileconversion',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
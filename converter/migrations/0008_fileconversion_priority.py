@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0007_fileconversion_stage_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileconversion',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
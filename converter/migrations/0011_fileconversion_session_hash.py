@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0010_cancelled_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileconversion',
+            name='session_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -1,7 +1,35 @@
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
+import hashlib
+import re
 import uuid
 
+# Client-supplied batch ids end up in channel layer group names
+BATCH_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def session_digest(session_key):
+    """Digest of a session key, stored instead of the key itself"""
+    if not session_key:
+        return ''
+    return hashlib.sha256(session_key.encode()).hexdigest()
+
+
+def batch_group(batch_id, user_id=None, session_hash=''):
+    """
+    Channel layer group of a batch, scoped to its owner
+
+    Batch ids are chosen by clients, so the group name includes the
+    uploading user, or the uploading session for anonymous clients, and
+    nobody else can join it. None if there is no owner.
+    """
+    if user_id:
+        return f'batch_u{user_id}_{batch_id}'
+    if session_hash:
+        return f'batch_s{session_hash[:24]}_{batch_id}'
+    return None
+
 
 class FileConversion(models.Model):
     """Model to track file conversions"""
@@ -11,6 +39,7 @@ class FileConversion(models.Model):
         ('processing', 'Processing'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
     ]
     
     CONVERSION_TYPES = [
@@ -22,18 +51,34 @@ class FileConversion(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     original_file = models.FileField(upload_to='uploads/%Y/%m/%d/')
     converted_file = models.FileField(upload_to='converted/%Y/%m/%d/', null=True, blank=True)
+    preview_file = models.FileField(upload_to='previews/%Y/%m/%d/', null=True, blank=True)
     original_filename = models.CharField(max_length=255)
     original_format = models.CharField(max_length=10)
     target_format = models.CharField(max_length=10)
+    options = models.JSONField(default=dict, blank=True)  # image pipeline, video and effort options
     conversion_type = models.CharField(max_length=20, choices=CONVERSION_TYPES)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     error_message = models.TextField(blank=True, null=True)
     file_size = models.BigIntegerField(default=0)  # in bytes
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)  # sha256 of the upload, see reuse.py
+    media_info = models.JSONField(default=dict, blank=True)  # probed pages/duration/pixels
+    stage_timings = models.JSONField(default=dict, blank=True)  # see converter/timing.py
     converted_file_size = models.BigIntegerField(default=0, null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     task_id = models.CharField(max_length=255, blank=True, null=True)
+    priority = models.PositiveSmallIntegerField(default=0)  # broker priority, 0 first (see scheduling.py)
+    batch_id = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='conversions'
+    )
+    session_hash = models.CharField(max_length=64, blank=True, default='')  # session_digest of an anonymous uploader
     
     class Meta:
         ordering = ['-created_at']
@@ -51,7 +96,108 @@ class FileConversion(models.Model):
             return (self.completed_at - self.created_at).total_seconds()
         return None
     
+    def get_progress_groups(self):
+        """
+        Channel layer groups that receive progress events for this conversion
+        
+        Events go to the batch and user stream groups, and sockets following
+        single conversions join one of those and filter by id. Only
+        conversions in neither get a group of their own.
+        """
+        groups = []
+        group = batch_group(self.batch_id, self.user_id, self.session_hash) if self.batch_id else None
+        if group:
+            groups.append(group)
+        if self.user_id:
+            groups.append(f'user_{self.user_id}')
+        return groups or [f'conversion_{self.id}']
+    
+    def get_preview_url(self):
+        """URL of the preview image, if one was generated"""
+        if self.preview_file:
+            return self.preview_file.url
+        return None
+    
     def get_file_size_mb(self):
         """Get file size in MB"""
         return round(self.file_size / (1024 * 1024), 2)
 
+
+
+class ConversionArchive(models.Model):
+    """Compact copy of a finished conversion, kept for analytics after cleanup"""
+    
+    id = models.UUIDField(primary_key=True, editable=False)
+    original_format = models.CharField(max_length=10)
+    target_format = models.CharField(max_length=10)
+    conversion_type = models.CharField(max_length=20, choices=FileConversion.CONVERSION_TYPES)
+    status = models.CharField(max_length=20, choices=FileConversion.STATUS_CHOICES)
+    error_summary = models.CharField(max_length=255, blank=True, default='')
+    file_size = models.BigIntegerField(default=0)
+    converted_file_size = models.BigIntegerField(default=0, null=True, blank=True)
+    media_info = models.JSONField(default=dict, blank=True)
+    user_id = models.IntegerField(null=True, blank=True)  # no FK: survives user deletion
+    created_at = models.DateTimeField(db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.original_format} -> {self.target_format} ({self.status})"
+    
+    @classmethod
+    def from_conversion(cls, conversion):
+        """Build the archive row for a FileConversion"""
+        error_lines = (conversion.error_message or '').strip().splitlines()
+        return cls(
+            id=conversion.id,
+            original_format=conversion.original_format,
+            target_format=conversion.target_format,
+            conversion_type=conversion.conversion_type,
+            status=conversion.status,
+            error_summary=error_lines[0][:255] if error_lines else '',
+            file_size=conversion.file_size,
+            converted_file_size=conversion.converted_file_size,
+            media_info=conversion.media_info,
+            user_id=conversion.user_id,
+            created_at=conversion.created_at,
+            started_at=conversion.started_at,
+            completed_at=conversion.completed_at,
+        )
+
+
+class ConversionDailyRollup(models.Model):
+    """Pre-aggregated conversion counts per day, format pair and status"""
+    
+    date = models.DateField()
+    original_format = models.CharField(max_length=10)
+    target_format = models.CharField(max_length=10)
+    conversion_type = models.CharField(max_length=20, choices=FileConversion.CONVERSION_TYPES)
+    status = models.CharField(max_length=20, choices=FileConversion.STATUS_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+    input_bytes = models.BigIntegerField(default=0)
+    output_bytes = models.BigIntegerField(default=0)
+    timed_count = models.PositiveIntegerField(default=0)  # rows with started_at and completed_at
+    processing_seconds = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-date', 'original_format', 'target_format', 'status']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'original_format', 'target_format', 'conversion_type', 'status'],
+                name='unique_conversion_daily_rollup'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.original_format} -> {self.target_format} ({self.status}): {self.count}"
+    
+    def get_average_seconds(self):
+        """Average processing time of the timed conversions"""
+        if self.timed_count:
+            return round(self.processing_seconds / self.timed_count, 2)
+        return None
@@ -0,0 +1,88 @@
+"""
+Progress events and cancellation requests for conversions
+
+Kept apart from tasks.py so that the WebSocket consumers can use them
+without importing the converters and their libraries into the ASGI server.
+"""
+from asgiref.sync import async_to_sync
+from celery import current_app
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .cancellation import request_cancellation
+from .models import FileConversion
+
+
+def progress_snapshot_key(conversion_id):
+    """Cache key holding the latest progress event for a conversion"""
+    return f'conversion_progress_{conversion_id}'
+
+
+def send_progress_update(channel_layer, conversion_id, progress, status, error=None, groups=None, eta=None):
+    """
+    Send progress update via WebSocket
+    
+    The event goes to the batch and user stream groups of the conversion
+    (see get_progress_groups) and lists them, so consumers can tell which
+    events they follow. It is also kept in the cache so late subscribers
+    can be brought up to date. ``eta`` is the predicted number of seconds
+    until completion.
+    """
+    groups = groups or [f'conversion_{conversion_id}']
+    message = {
+        'type': 'conversion_progress',
+        'conversion_id': str(conversion_id),
+        'progress': progress,
+        'status': status,
+        'error': error,
+        'eta_seconds': eta,
+        'groups': groups
+    }
+    
+    try:
+        cache.set(progress_snapshot_key(conversion_id), message, settings.PROGRESS_SNAPSHOT_TTL)
+    except Exception as e:
+        print(f"Error storing progress snapshot: {e}")
+    
+    async def _send():
+        for group in groups:
+            await channel_layer.group_send(group, message)
+    
+    try:
+        async_to_sync(_send)()
+    except Exception as e:
+        print(f"Error sending WebSocket message: {e}")
+
+
+def revoke_conversion(conversion):
+    """
+    Cancel a pending or processing conversion
+    
+    The row is marked cancelled at once and a queued task is revoked.
+    Running tasks see the cancellation within CANCEL_POLL_SECONDS, kill
+    their ffmpeg processes and stop at their next checkpoint (see
+    cancellation.py).
+    
+    Returns:
+        bool: False if the conversion had already finished
+    """
+    cancelled = FileConversion.objects.filter(
+        id=conversion.id, status__in=['pending', 'processing']
+    ).update(status='cancelled', updated_at=timezone.now())
+    if not cancelled:
+        return False
+    
+    request_cancellation(conversion.id)
+    if conversion.task_id:
+        try:
+            current_app.control.revoke(conversion.task_id)
+        except Exception as e:
+            print(f"Error revoking task {conversion.task_id}: {e}")
+    
+    send_progress_update(
+        get_channel_layer(), conversion.id, 0, 'cancelled',
+        groups=conversion.get_progress_groups()
+    )
+    return True
@@ -0,0 +1,146 @@
+"""
+Reuse of earlier conversion output for identical content
+
+Uploads store the SHA-256 of their bytes in ``content_hash``. A client
+can send the hash, size and target format to ``/api/check/`` before
+uploading; when one of the same user's completed conversions has the same
+content and options, a new completed conversion is created that points at
+the existing stored files and the upload is skipped. Only the user's own
+conversions are matched, or for anonymous clients those uploaded in the
+same session (``session_hash``), so knowing a hash never grants access to
+another client's files.
+
+An 'auto' target is replaced by the chosen format on completion, so the
+request is kept in the ``requested_format`` option and 'auto' is matched
+against that.
+
+Several rows can therefore share one stored file, so files are removed
+with ``release_files``, which only deletes a file once no other row
+refers to it. Conversions old enough for ``cleanup_old_files`` to release
+their files are never reused, and a match whose output is no longer in
+storage is skipped.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+import hashlib
+import re
+
+from .models import FileConversion
+
+CONTENT_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+FILE_FIELDS = ('original_file', 'converted_file', 'preview_file')
+
+# Option recording the target a conversion was requested with, when it differs
+REQUESTED_FORMAT = 'requested_format'
+
+
+def hash_upload(file):
+    """SHA-256 hex digest of an uploaded file, read in chunks"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def options_match(requested, existing):
+    """
+    True if a conversion with ``existing`` options serves a request for ``requested``
+
+    The effort profile only changes how hard the encoder works, so it is
+    compared only when the request names one.
+    """
+    requested = dict(requested)
+    effort = requested.pop('effort', None)
+    existing = dict(existing or {})
+    existing.pop(REQUESTED_FORMAT, None)
+    if effort and existing.get('effort') != effort:
+        return False
+    existing.pop('effort', None)
+    return requested == existing
+
+
+def find_reusable(user, session_hash, content_hash, file_size, original_format, target_format, options):
+    """
+    Newest completed conversion of the same content, formats and options, or None
+
+    Conversions by ``user`` are searched, or without a user the anonymous
+    ones of the session ``session_hash``. Only conversions newer than
+    ARCHIVE_AFTER_DAYS whose output still exists in storage are considered.
+    """
+    if user is not None:
+        owner = {'user': user}
+    elif session_hash:
+        owner = {'user__isnull': True, 'session_hash': session_hash}
+    else:
+        return None
+    if target_format != 'auto':
+        owner['target_format'] = target_format
+    cutoff = timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    candidates = (
+        FileConversion.objects
+        .filter(content_hash=content_hash, file_size=file_size, status='completed',
+                original_format=original_format, created_at__gte=cutoff, **owner)
+        .exclude(converted_file='')
+        .exclude(converted_file__isnull=True)
+        .order_by('-completed_at')
+    )
+    for conversion in candidates:
+        requested = (conversion.options or {}).get(REQUESTED_FORMAT, conversion.target_format)
+        if requested != target_format or not options_match(options, conversion.options):
+            continue
+        if default_storage.exists(conversion.converted_file.name):
+            return conversion
+    return None
+
+
+def clone_conversion(source, **fields):
+    """
+    New completed conversion sharing ``source``'s stored files
+
+    ``started_at`` stays empty so the copy is left out of the ETA model
+    and the average processing times.
+    """
+    now = timezone.now()
+    return FileConversion.objects.create(
+        original_file=source.original_file.name,
+        converted_file=source.converted_file.name,
+        preview_file=source.preview_file.name or None,
+        original_format=source.original_format,
+        target_format=source.target_format,
+        options=source.options,
+        conversion_type=source.conversion_type,
+        file_size=source.file_size,
+        content_hash=source.content_hash,
+        media_info=source.media_info,
+        converted_file_size=source.converted_file_size,
+        status='completed',
+        created_at=now,
+        completed_at=now,
+        **fields
+    )
+
+
+def release_files(conversion, referrers=None):
+    """
+    Delete the stored files of ``conversion`` that no other row refers to
+
+    ``referrers`` are the rows that may still need the files; it defaults
+    to every other conversion.
+    """
+    if referrers is None:
+        referrers = FileConversion.objects.exclude(id=conversion.id)
+    for field_name in FILE_FIELDS:
+        field = getattr(conversion, field_name)
+        if not field:
+            continue
+        name = field.name
+        in_use = referrers.filter(
+            Q(original_file=name) | Q(converted_file=name) | Q(preview_file=name)
+        ).exists()
+        if not in_use:
+            field.delete(save=False)
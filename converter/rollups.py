@@ -0,0 +1,160 @@
+"""
+Archival and daily rollups of conversion history
+
+Finished conversions older than ARCHIVE_AFTER_DAYS are moved out of the
+hot ``FileConversion`` table into the compact ``ConversionArchive`` table
+(no file fields, tracebacks reduced to their first line). Reporting reads
+``ConversionDailyRollup`` rows instead of counting raw rows; a day's
+rollups are rebuilt from both tables, so rebuilding is idempotent and
+archiving never changes the numbers.
+"""
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+
+from .models import ConversionArchive, ConversionDailyRollup, FileConversion
+
+ROLLUP_KEY = ('original_format', 'target_format', 'conversion_type', 'status')
+FINISHED_STATUSES = ['completed', 'failed', 'cancelled']
+
+
+def _aggregate_day(model, day):
+    """Per format pair/status aggregates of one model's rows created on ``day``"""
+    timed = Q(started_at__isnull=False, completed_at__isnull=False)
+    return (
+        model.objects
+        .filter(created_at__date=day)
+        .order_by()
+        .values(*ROLLUP_KEY)
+        .annotate(
+            count=Count('id'),
+            input_bytes=Sum('file_size'),
+            output_bytes=Sum('converted_file_size'),
+            timed_count=Count('id', filter=timed),
+            processing_time=Sum(
+                ExpressionWrapper(F('completed_at') - F('started_at'), output_field=DurationField()),
+                filter=timed
+            ),
+        )
+    )
+
+
+def rebuild_daily_rollups(day):
+    """
+    Recompute the rollup rows of one day from live and archived conversions
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    totals = {}
+    for model in [FileConversion, ConversionArchive]:
+        for row in _aggregate_day(model, day):
+            key = tuple(row[field] for field in ROLLUP_KEY)
+            rollup = totals.setdefault(key, ConversionDailyRollup(
+                date=day, **dict(zip(ROLLUP_KEY, key))
+            ))
+            rollup.count += row['count']
+            rollup.input_bytes += row['input_bytes'] or 0
+            rollup.output_bytes += row['output_bytes'] or 0
+            rollup.timed_count += row['timed_count']
+            if row['processing_time']:
+                rollup.processing_seconds += row['processing_time'].total_seconds()
+
+    with transaction.atomic():
+        ConversionDailyRollup.objects.filter(date=day).delete()
+        ConversionDailyRollup.objects.bulk_create(totals.values())
+    return len(totals)
+
+
+def rebuild_recent_rollups(days=2):
+    """
+    Rebuild the rollups of the last ``days`` complete days
+
+    Today is never rolled up: it is still changing and ``get_totals`` counts
+    it from the live table. Rebuilding a few past days picks up conversions
+    that finished after midnight; days missed since the latest rollup (or
+    all history, the first time) are backfilled.
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    today = timezone.localdate()
+    day = today - timedelta(days=days)
+    last_day = ConversionDailyRollup.objects.order_by('-date').values_list('date', flat=True).first()
+    if last_day is not None:
+        day = min(day, last_day + timedelta(days=1))
+    else:
+        oldest = FileConversion.objects.order_by('created_at').values_list('created_at', flat=True).first()
+        if oldest is not None:
+            day = min(day, timezone.localdate(oldest))
+
+    written = 0
+    while day < today:
+        written += rebuild_daily_rollups(day)
+        day += timedelta(days=1)
+    return written
+
+
+def start_of_day(day):
+    """Aware datetime of local midnight at the start of ``day``"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def archive_conversions(queryset, batch_size=500):
+    """
+    Move finished conversions into ConversionArchive
+
+    The rollups of every affected day are rebuilt first, then rows are
+    copied and deleted in batches. Stored files are not touched.
+
+    Returns:
+        int: Number of archived conversions
+    """
+    queryset = queryset.filter(status__in=FINISHED_STATUSES)
+    for day in queryset.dates('created_at', 'day'):
+        rebuild_daily_rollups(day)
+
+    archived = 0
+    while True:
+        batch = list(queryset.order_by('created_at')[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            ConversionArchive.objects.bulk_create(
+                [ConversionArchive.from_conversion(c) for c in batch], ignore_conflicts=True
+            )
+            FileConversion.objects.filter(id__in=[c.id for c in batch]).delete()
+        archived += len(batch)
+    return archived
+
+
+def get_totals(since=None):
+    """
+    Conversion counts by status, read from the rollups
+
+    Days not rolled up yet (normally just today) are counted from the live
+    table, which is cheap thanks to the created_at index.
+
+    Returns:
+        dict: total and one count per status
+    """
+    rollups = ConversionDailyRollup.objects.all()
+    if since is not None:
+        rollups = rollups.filter(date__gte=since)
+
+    totals = {status: 0 for status, _ in FileConversion.STATUS_CHOICES}
+    for row in rollups.order_by().values('status').annotate(count=Sum('count')):
+        totals[row['status']] = totals.get(row['status'], 0) + row['count']
+    last_day = rollups.order_by('-date').values_list('date', flat=True).first()
+
+    live = FileConversion.objects.order_by()
+    if last_day is not None:
+        live = live.filter(created_at__gte=start_of_day(last_day + timedelta(days=1)))
+    elif since is not None:
+        live = live.filter(created_at__gte=start_of_day(since))
+    for row in live.values('status').annotate(count=Count('id')):
+        totals[row['status']] = totals.get(row['status'], 0) + row['count']
+
+    totals['total'] = sum(totals.values())
+    return totals
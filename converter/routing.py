@@ -6,5 +6,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/conversion/(?P<conversion_id>[0-9a-f-]+)/$', consumers.ConversionConsumer.as_asgi()),
+    re_path(r'ws/conversions/$', consumers.ConversionStreamConsumer.as_asgi()),
 ]
-
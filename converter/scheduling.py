@@ -0,0 +1,70 @@
+"""
+Size-aware task priorities with aging
+
+Conversions are queued at a broker priority derived from their predicted
+processing time (file size and probed pages/pixels/duration, see
+estimator.py), so a 20 KB image is not stuck behind a 95 MB video that
+arrived a moment earlier. With the Redis transport 0 is served first.
+
+A message's priority cannot change once it is queued, so aging works by
+re-queueing: every PRIORITY_AGING_SECONDS a conversion still waiting is
+sent again one level higher under a new task id, and the old message is
+dropped when a worker picks it up (``claim_conversion``).
+"""
+from bisect import bisect_right
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
+import uuid
+
+from .estimator import estimate_conversion
+from .models import FileConversion
+
+
+def base_priority(conversion):
+    """Priority of a new conversion: one level per PRIORITY_STEP_SECONDS threshold it exceeds"""
+    return bisect_right(settings.PRIORITY_STEP_SECONDS, estimate_conversion(conversion))
+
+
+def claim_conversion(conversion_id, task_id):
+    """
+    Mark a conversion as picked up by the task with ``task_id``
+
+    Returns:
+        bool: False if the message was superseded by an aged copy or the
+        conversion was cancelled
+    """
+    return FileConversion.objects.filter(
+        Q(task_id=task_id) | Q(task_id__isnull=True), id=conversion_id
+    ).exclude(status='cancelled').update(started_at=timezone.now()) > 0
+
+
+def aging_candidates(now=None):
+    """Waiting conversions due for promotion: (conversion, new priority) pairs"""
+    now = now or timezone.now()
+    waiting = (
+        FileConversion.objects
+        .filter(status='pending', started_at__isnull=True, priority__gt=0,
+                updated_at__lte=now - timedelta(seconds=settings.PRIORITY_AGING_SECONDS))
+        .only('id', 'priority', 'task_id', 'updated_at')
+    )
+    for conversion in waiting.iterator():
+        steps = int((now - conversion.updated_at).total_seconds() // settings.PRIORITY_AGING_SECONDS)
+        yield conversion, max(0, conversion.priority - steps)
+
+
+def promote(conversion, priority):
+    """
+    Hand a waiting conversion to a new task id at a better priority
+
+    The update only succeeds while no worker has claimed the old message.
+
+    Returns:
+        str: New task id, or None if the conversion was claimed meanwhile
+    """
+    task_id = str(uuid.uuid4())
+    updated = FileConversion.objects.filter(
+        id=conversion.id, task_id=conversion.task_id, status='pending', started_at__isnull=True
+    ).update(task_id=task_id, priority=priority, updated_at=timezone.now())
+    return task_id if updated else None
@@ -0,0 +1,234 @@
+"""
+Scratch space for conversion intermediates
+
+Converted outputs, previews, video segments and DOCX parts are written
+under SCRATCH_ROOT (point it at a tmpfs such as /dev/shm for speed), never
+next to durable media. Each worker process owns a ``proc-<pid>-*``
+directory, locked with flock for its lifetime, and every task gets its
+own directory inside it which is removed when the task ends, whether it
+succeeded or failed. Directories left behind by processes that crashed
+are removed when a worker starts.
+
+Usage is bounded by SCRATCH_QUOTA_BYTES: a task reserves the space it
+expects to need up front and is refused if the reservation does not fit.
+Reservations are serialized across processes by a flock on a lock file in
+SCRATCH_ROOT, so concurrent tasks cannot both fit into the same space.
+"""
+from celery.signals import worker_process_init, worker_ready
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from functools import wraps
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no stale-directory detection or reservation lock
+    fcntl = None
+
+LOCK_NAME = '.lock'
+RESERVED_NAME = '.reserved'
+RESERVE_LOCK_NAME = '.reserve.lock'
+# A process directory younger than this may not have taken its lock yet
+STALE_GRACE_SECONDS = 60
+
+_current_dir = ContextVar('scratch_dir', default=None)
+_process_dir = None
+_process_pid = None
+_process_lock = None
+
+
+class ScratchQuotaExceeded(Exception):
+    """Raised when a task's scratch reservation does not fit the quota"""
+
+
+def get_scratch_root():
+    return settings.SCRATCH_ROOT
+
+
+def get_process_dir():
+    """This process's scratch directory, created (and locked) on first use"""
+    global _process_dir, _process_pid, _process_lock
+    if _process_dir is None or _process_pid != os.getpid():
+        root = get_scratch_root()
+        os.makedirs(root, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=f'proc-{os.getpid()}-', dir=root)
+        lock = open(os.path.join(path, LOCK_NAME), 'w')
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        _process_dir, _process_pid, _process_lock = path, os.getpid(), lock
+    return _process_dir
+
+
+def current_scratch_dir():
+    """Scratch directory of the running task, or None outside of one"""
+    return _current_dir.get()
+
+
+@contextmanager
+def task_scratch(prefix='task'):
+    """
+    Give the enclosed code a private scratch directory
+
+    ``get_temp_path`` places files there while the context is active; the
+    directory and everything in it is removed on exit.
+    """
+    path = tempfile.mkdtemp(prefix=f'{prefix}-', dir=get_process_dir())
+    token = _current_dir.set(path)
+    try:
+        yield path
+    finally:
+        _current_dir.reset(token)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def uses_scratch_space(func):
+    """Run a (Celery task) function inside its own task_scratch directory"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with task_scratch(prefix=func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _tree_size(path):
+    """Bytes used by the files under a directory"""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += _tree_size(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            pass
+    return total
+
+
+def _reserved_bytes(task_dir):
+    try:
+        with open(os.path.join(task_dir, RESERVED_NAME)) as f:
+            return int(f.read() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def scratch_usage():
+    """
+    Bytes used or reserved under SCRATCH_ROOT
+
+    Each task directory counts for the larger of what it holds and what it
+    reserved, so concurrent tasks see each other's reservations.
+    """
+    root = get_scratch_root()
+    total = 0
+    try:
+        process_dirs = [e.path for e in os.scandir(root) if e.is_dir(follow_symlinks=False)]
+    except OSError:
+        return 0
+    for process_dir in process_dirs:
+        try:
+            task_dirs = [e.path for e in os.scandir(process_dir) if e.is_dir(follow_symlinks=False)]
+        except OSError:
+            continue
+        for task_dir in task_dirs:
+            total += max(_tree_size(task_dir), _reserved_bytes(task_dir))
+    return total
+
+
+@contextmanager
+def _reservation_lock():
+    """Hold the scratch root's reservation lock, shared by every worker process"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(get_scratch_root(), RESERVE_LOCK_NAME), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def reserve_scratch(nbytes):
+    """
+    Reserve scratch space for the running task
+
+    Checking the usage and recording the reservation happen under one
+    lock, so two tasks cannot both be granted the last free space.
+
+    Raises:
+        ScratchQuotaExceeded: If the reservation exceeds SCRATCH_QUOTA_BYTES
+            or the free space of the scratch volume
+    """
+    task_dir = current_scratch_dir()
+    if task_dir is None:
+        return
+    nbytes = int(nbytes)
+
+    with _reservation_lock():
+        quota = settings.SCRATCH_QUOTA_BYTES
+        if quota:
+            used = scratch_usage() - _tree_size(task_dir)
+            if used + nbytes > quota:
+                raise ScratchQuotaExceeded(
+                    f'Scratch quota exceeded: {used + nbytes} of {quota} bytes needed'
+                )
+        free = shutil.disk_usage(task_dir).free
+        if nbytes > free:
+            raise ScratchQuotaExceeded(f'Not enough scratch space: {nbytes} bytes needed, {free} free')
+
+        with open(os.path.join(task_dir, RESERVED_NAME), 'w') as f:
+            f.write(str(nbytes))
+
+
+def cleanup_stale_scratch():
+    """
+    Remove process directories whose owner is gone
+
+    A directory whose lock can be taken belongs to a dead process.
+
+    Returns:
+        int: Number of directories removed
+    """
+    if fcntl is None:
+        return 0
+    root = get_scratch_root()
+    try:
+        entries = [e for e in os.scandir(root) if e.is_dir(follow_symlinks=False)]
+    except OSError:
+        return 0
+
+    removed = 0
+    for entry in entries:
+        if entry.path == _process_dir or not entry.name.startswith('proc-'):
+            continue
+        try:
+            if time.time() - entry.stat().st_mtime < STALE_GRACE_SECONDS:
+                continue
+            with open(os.path.join(entry.path, LOCK_NAME), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            # Locked by a live process, or already removed
+            continue
+    return removed
+
+
+@worker_process_init.connect
+@worker_ready.connect
+def clean_scratch_on_start(**kwargs):
+    """Reclaim scratch space left behind by crashed workers"""
+    try:
+        removed = cleanup_stale_scratch()
+        if removed:
+            print(f"Removed {removed} stale scratch directories")
+    except Exception as e:
+        print(f"Scratch cleanup failed: {e}")
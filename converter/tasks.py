@@ -1,19 +1,87 @@
 """
 Celery tasks for asynchronous file conversion
 """
-from celery import shared_task
+from celery import chord, shared_task
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.utils import timezone
+from io import BytesIO
 import os
 import traceback
+import uuid
 
+from .cancellation import (
+    ConversionCancelled, cancellable_task, checkpoint, is_cancellation_requested
+)
+from .estimator import refresh_eta_model, remaining_seconds
 from .models import FileConversion
-from .utils import get_converter
+from .progress import send_progress_update
+from .scratch import ScratchQuotaExceeded, reserve_scratch, uses_scratch_space
+from .timing import attach_timings, records_stages, stage
+from .rollups import FINISHED_STATUSES, archive_conversions, rebuild_recent_rollups
+from .reuse import REQUESTED_FORMAT, release_files
+from .scheduling import aging_candidates, base_priority, claim_conversion, promote
+from .utils import (
+    default_effort,
+    generate_preview,
+    generate_preview_buffer,
+    get_buffer_converter,
+    get_converter,
+    get_pdf_page_count,
+    get_temp_path,
+    merge_docx_files,
+    output_format,
+    pdf_pages_to_docx,
+    pdf_to_docx,
+    plan_page_shards,
+    probe_media_info,
+)
+from . import warmup  # noqa: F401 - connects worker warm-up signals
+
+
+def enqueue_conversion(conversion):
+    """Queue a conversion at its size-aware priority (see scheduling.py)"""
+    conversion.priority = base_priority(conversion)
+    conversion.task_id = str(uuid.uuid4())
+    conversion.save(update_fields=['priority', 'task_id', 'updated_at'])
+    convert_file_task.apply_async(
+        args=[str(conversion.id)], task_id=conversion.task_id, priority=conversion.priority
+    )
+
+
+def save_unless_cancelled(conversion, fields):
+    """
+    Write ``fields`` of a conversion, unless it was cancelled or deleted meanwhile
+    
+    A conditional update, so a cancellation is never overwritten by a
+    full-row save from the task.
+    
+    Raises:
+        ConversionCancelled: If nothing was written
+    """
+    values = {field: getattr(conversion, field) for field in fields}
+    values['updated_at'] = conversion.updated_at = timezone.now()
+    updated = FileConversion.objects.filter(id=conversion.id).exclude(status='cancelled').update(**values)
+    if not updated:
+        raise ConversionCancelled(f"Conversion {conversion.id} was cancelled")
+
+
+def stop_cancelled_conversion(conversion_id):
+    """Leave a conversion whose task stopped at a checkpoint in the cancelled state"""
+    FileConversion.objects.filter(id=conversion_id).exclude(status='cancelled').update(
+        status='cancelled', updated_at=timezone.now()
+    )
+    return {'status': 'cancelled', 'conversion_id': str(conversion_id)}
 
 
 @shared_task(bind=True, max_retries=3)
+@uses_scratch_space
+@records_stages
+@cancellable_task
 def convert_file_task(self, conversion_id):
     """
     Celery task to convert a file from one format to another
@@ -23,17 +91,43 @@ def convert_file_task(self, conversion_id):
     try:
         # Get conversion record
         conversion = FileConversion.objects.get(id=conversion_id)
-        conversion.status = 'processing'
-        conversion.save()
         
-        # Send initial progress via WebSocket
-        send_progress_update(channel_layer, conversion_id, 10, 'processing')
+        # Messages of cancelled conversions, or superseded by priority aging, are dropped
+        if conversion.status == 'cancelled':
+            return {'status': 'cancelled', 'conversion_id': str(conversion_id)}
+        if not claim_conversion(conversion_id, self.request.id):
+            return {'status': 'superseded', 'conversion_id': str(conversion_id)}
+        
+        reserve_scratch(conversion.file_size * settings.SCRATCH_RESERVE_FACTOR)
+        conversion.status = 'processing'
+        conversion.started_at = timezone.now()
+        conversion.stage_timings = {}
         
         # Get source file path
         source_path = conversion.original_file.path
         source_format = conversion.original_format.lower()
         target_format = conversion.target_format.lower()
         
+        # Jobs without an effort profile get their queue's default
+        if not conversion.options.get('effort'):
+            queue = (self.request.delivery_info or {}).get('routing_key')
+            conversion.options = {**conversion.options, 'effort': default_effort(queue)}
+        
+        if not conversion.media_info:
+            with stage('probe'):
+                conversion.media_info = probe_media_info(source_path, source_format)
+        checkpoint()
+        save_unless_cancelled(
+            conversion, ['status', 'started_at', 'stage_timings', 'options', 'media_info']
+        )
+        groups = conversion.get_progress_groups()
+        
+        # Send initial progress via WebSocket
+        send_progress_update(
+            channel_layer, conversion_id, 10, 'processing',
+            groups=groups, eta=remaining_seconds(conversion)
+        )
+        
         # Get appropriate converter function
         converter = get_converter(source_format, target_format)
         
@@ -42,43 +136,47 @@ def convert_file_task(self, conversion_id):
                 f"Conversion from {source_format} to {target_format} is not supported"
             )
         
+        # Large PDFs are split into page ranges and converted across the cluster
+        if converter is pdf_to_docx:
+            with stage('plan_shards'):
+                shards = plan_pdf_docx_shards(source_path)
+            if len(shards) > 1:
+                start_pdf_docx_shards(conversion, shards)
+                return {
+                    'status': 'sharded',
+                    'conversion_id': str(conversion_id),
+                    'shards': len(shards)
+                }
+        
         # Update progress
-        send_progress_update(channel_layer, conversion_id, 30, 'processing')
+        checkpoint()
+        send_progress_update(
+            channel_layer, conversion_id, 30, 'processing',
+            groups=groups, eta=remaining_seconds(conversion)
+        )
         
-        # Perform conversion
-        output_path = converter(source_path, target_format)
+        # Small inputs are converted in memory, without temp files, unless
+        # they decode to a huge raster (those go through tiling.py)
+        buffer_converter = get_buffer_converter(source_format, target_format)
+        pixels = conversion.media_info.get('width', 0) * conversion.media_info.get('height', 0)
+        if (buffer_converter and conversion.file_size <= settings.IN_MEMORY_MAX_BYTES
+                and pixels < settings.TILED_MIN_PIXELS):
+            with stage('read_source'), conversion.original_file.open('rb') as f:
+                source = BytesIO(f.read())
+            with stage('convert'):
+                output = buffer_converter(source, target_format, options=conversion.options)
+        else:
+            # Perform conversion
+            with stage('convert'):
+                output = converter(source_path, target_format, options=conversion.options)
         
         # Update progress
-        send_progress_update(channel_layer, conversion_id, 70, 'processing')
-        
-        # Save converted file
-        if output_path and os.path.exists(output_path):
-            base_name = os.path.splitext(conversion.original_filename)[0]
-            converted_filename = f"{base_name}_converted.{target_format}"
-            
-            with open(output_path, 'rb') as f:
-                conversion.converted_file.save(
-                    converted_filename,
-                    File(f),
-                    save=False
-                )
-            
-            # Get converted file size
-            conversion.converted_file_size = os.path.getsize(output_path)
-            
-            # Clean up temporary file
-            try:
-                os.remove(output_path)
-            except:
-                pass
-        
-        # Update status
-        conversion.status = 'completed'
-        conversion.completed_at = timezone.now()
-        conversion.save()
+        send_progress_update(
+            channel_layer, conversion_id, 70, 'processing',
+            groups=groups, eta=remaining_seconds(conversion)
+        )
         
-        # Send completion notification
-        send_progress_update(channel_layer, conversion_id, 100, 'completed')
+        complete_conversion(conversion, output, channel_layer)
         
         return {
             'status': 'success',
@@ -90,26 +188,310 @@ def convert_file_task(self, conversion_id):
         error_msg = f"Conversion record not found: {conversion_id}"
         return {'status': 'error', 'message': error_msg}
         
+    except ConversionCancelled:
+        return stop_cancelled_conversion(conversion_id)
+        
+    except ScratchQuotaExceeded as e:
+        # Not the file's fault: wait for other conversions to free space
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=settings.SCRATCH_RETRY_SECONDS)
+        fail_conversion(conversion_id, str(e), traceback.format_exc(), channel_layer)
+        return {
+            'status': 'error',
+            'conversion_id': str(conversion_id),
+            'message': str(e)
+        }
+        
     except Exception as e:
         # Handle errors
         error_message = str(e)
-        error_trace = traceback.format_exc()
+        fail_conversion(conversion_id, error_message, traceback.format_exc(), channel_layer)
+        
+        # Retry if possible
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=60)
+        
+        return {
+            'status': 'error',
+            'conversion_id': str(conversion_id),
+            'message': error_message
+        }
+
+
+def complete_conversion(conversion, output, channel_layer):
+    """
+    Store the converted output, mark the conversion completed and notify clients
+    
+    ``output`` is the path of a temporary file, or a BytesIO from an
+    in-memory converter which goes to storage directly. An 'auto' target
+    is replaced by the format the converter chose.
+    """
+    checkpoint()
+    if conversion.target_format == 'auto':
+        # Kept for find_reusable, which matches 'auto' requests on it
+        conversion.options = {**conversion.options, REQUESTED_FORMAT: 'auto'}
+        conversion.target_format = output_format(output)
+    target_format = conversion.target_format.lower()
+    base_name = os.path.splitext(conversion.original_filename)[0]
+    converted_filename = f"{base_name}_converted.{target_format}"
+    
+    if isinstance(output, BytesIO):
+        with stage('store'):
+            conversion.converted_file.save(
+                converted_filename,
+                ContentFile(output.getvalue()),
+                save=False
+            )
+        conversion.converted_file_size = output.getbuffer().nbytes
+        save_preview(conversion, output)
+    
+    # Save converted file
+    elif output and os.path.exists(output):
+        with stage('store'), open(output, 'rb') as f:
+            conversion.converted_file.save(
+                converted_filename,
+                File(f),
+                save=False
+            )
         
+        # Get converted file size
+        conversion.converted_file_size = os.path.getsize(output)
+        
+        save_preview(conversion, output)
+        
+        # Clean up temporary file
         try:
-            conversion = FileConversion.objects.get(id=conversion_id)
-            conversion.status = 'failed'
-            conversion.error_message = f"{error_message}\n\n{error_trace}"
-            conversion.save()
-            
-            # Send error notification
-            send_progress_update(channel_layer, conversion_id, 0, 'failed', error_message)
+            os.remove(output)
         except:
             pass
+    
+    # Update status
+    conversion.status = 'completed'
+    conversion.completed_at = timezone.now()
+    attach_timings(conversion)
+    try:
+        save_unless_cancelled(conversion, [
+            'status', 'completed_at', 'target_format', 'options', 'converted_file',
+            'converted_file_size', 'preview_file', 'stage_timings',
+        ])
+    except ConversionCancelled:
+        # Cancelled while storing: the stored output belongs to nobody
+        conversion.converted_file.delete(save=False)
+        conversion.preview_file.delete(save=False)
+        raise
+    
+    # Send completion notification
+    send_progress_update(
+        channel_layer, conversion.id, 100, 'completed',
+        groups=conversion.get_progress_groups()
+    )
+
+
+def save_preview(conversion, output):
+    """
+    Render and store a small preview next to the converted file
+    
+    Previews are best-effort: a failure here never fails the conversion.
+    """
+    base_name = os.path.splitext(conversion.original_filename)[0]
+    preview_path = None
+    try:
+        with stage('preview'):
+            if isinstance(output, BytesIO):
+                preview = generate_preview_buffer(output, conversion.target_format)
+                if preview:
+                    conversion.preview_file.save(
+                        f"{base_name}_preview.jpg", ContentFile(preview.getvalue()), save=False
+                    )
+                return
+            
+            output_path = output
+            preview_path = generate_preview(
+                conversion.original_file.path,
+                output_path,
+                conversion.original_format,
+                conversion.target_format
+            )
+            if preview_path:
+                with open(preview_path, 'rb') as f:
+                    conversion.preview_file.save(f"{base_name}_preview.jpg", File(f), save=False)
+    except Exception as e:
+        print(f"Error generating preview for {conversion.id}: {e}")
+    finally:
+        if preview_path and os.path.exists(preview_path):
+            os.remove(preview_path)
+
+
+def fail_conversion(conversion_id, error_message, error_trace, channel_layer):
+    """
+    Mark a conversion failed and notify clients
+    """
+    try:
+        conversion = FileConversion.objects.get(id=conversion_id)
+        if conversion.status == 'cancelled':
+            return
+        conversion.status = 'failed'
+        conversion.error_message = f"{error_message}\n\n{error_trace}"
+        attach_timings(conversion)
+        conversion.save()
         
-        # Retry if possible
+        # Send error notification
+        send_progress_update(
+            channel_layer, conversion_id, 0, 'failed', error_message,
+            groups=conversion.get_progress_groups()
+        )
+    except:
+        pass
+
+
+# ==================== PDF -> DOCX SHARDING ====================
+
+def shard_storage_dir(conversion_id):
+    """Storage directory holding the DOCX parts of a sharded conversion"""
+    return f'shards/{conversion_id}'
+
+
+def shard_counter_key(conversion_id):
+    """Cache key counting finished shards of a conversion"""
+    return f'conversion_shards_done_{conversion_id}'
+
+
+def plan_pdf_docx_shards(source_path):
+    """
+    Page ranges for a sharded PDF -> DOCX conversion
+    
+    Returns a single range for documents below PDF_SHARD_MIN_PAGES.
+    """
+    page_count = get_pdf_page_count(source_path)
+    if page_count < settings.PDF_SHARD_MIN_PAGES:
+        return [(0, page_count)]
+    return plan_page_shards(page_count, settings.PDF_SHARD_PAGES)
+
+
+def start_pdf_docx_shards(conversion, shards):
+    """
+    Fan page ranges out to convert_pdf_pages_task and merge them with a chord
+    
+    The stages recorded so far are saved first: the merge task appends its
+    own to them and may finish before this function returns.
+    """
+    attach_timings(conversion)
+    conversion.save(update_fields=['stage_timings'])
+    
+    conversion_id = str(conversion.id)
+    cache.set(shard_counter_key(conversion_id), 0, settings.CELERY_TASK_TIME_LIMIT * 2)
+    
+    header = [
+        convert_pdf_pages_task.s(conversion_id, index, start, end, len(shards)).set(
+            priority=conversion.priority
+        )
+        for index, (start, end) in enumerate(shards)
+    ]
+    callback = merge_docx_parts_task.s(conversion_id).set(priority=conversion.priority).on_error(
+        pdf_docx_shards_failed.s(conversion_id)
+    )
+    chord(header)(callback)
+
+
+@shared_task(bind=True, max_retries=2)
+@uses_scratch_space
+@cancellable_task
+def convert_pdf_pages_task(self, conversion_id, index, start, end, total):
+    """
+    Convert one page range of a PDF to DOCX and store the part
+    
+    Returns:
+        str: Storage name of the DOCX part, or None if the conversion was cancelled
+    """
+    channel_layer = get_channel_layer()
+    
+    try:
+        checkpoint()
+        conversion = FileConversion.objects.get(id=conversion_id)
+        source_path = conversion.original_file.path
+        part_path = get_temp_path(source_path, f'part{index:04d}.docx')
+        
+        pdf_pages_to_docx(source_path, part_path, start, end)
+        
+        # Parts go through storage so any worker can run the merge
+        with open(part_path, 'rb') as f:
+            part_name = default_storage.save(
+                f'{shard_storage_dir(conversion_id)}/{index:04d}.docx', File(f)
+            )
+        os.remove(part_path)
+        
+        try:
+            done = cache.incr(shard_counter_key(conversion_id))
+            send_progress_update(
+                channel_layer, conversion_id, 30 + int(40 * done / total), 'processing',
+                groups=conversion.get_progress_groups(), eta=remaining_seconds(conversion)
+            )
+        except ValueError:
+            pass
+        
+        return part_name
+        
+    except ConversionCancelled:
+        # The merge callback cleans up
+        return None
+        
+    except Exception as e:
         if self.request.retries < self.max_retries:
-            raise self.retry(exc=e, countdown=60)
+            raise self.retry(exc=e, countdown=30)
+        raise
+
+
+@shared_task
+@uses_scratch_space
+@records_stages
+@cancellable_task
+def merge_docx_parts_task(part_names, conversion_id):
+    """
+    Chord callback: merge DOCX parts in page order and complete the conversion
+    """
+    channel_layer = get_channel_layer()
+    
+    try:
+        conversion = FileConversion.objects.get(id=conversion_id)
+        output_path = get_temp_path(conversion.original_file.path, 'docx')
         
+        # A cache outage must not fail a merge whose shards all succeeded
+        try:
+            cancelled = is_cancellation_requested(conversion_id)
+        except Exception as e:
+            print(f"Error checking cancellation of {conversion_id}: {e}")
+            cancelled = False
+        if None in part_names or cancelled:
+            delete_shard_parts(conversion_id)
+            return stop_cancelled_conversion(conversion_id)
+        
+        part_files = [default_storage.open(name, 'rb') for name in part_names]
+        try:
+            with stage('merge'):
+                merge_docx_files(part_files, output_path)
+        finally:
+            for part_file in part_files:
+                part_file.close()
+            delete_shard_parts(conversion_id)
+        
+        complete_conversion(conversion, output_path, channel_layer)
+        
+        return {
+            'status': 'success',
+            'conversion_id': str(conversion_id),
+            'message': 'Conversion completed successfully'
+        }
+        
+    except FileConversion.DoesNotExist:
+        error_msg = f"Conversion record not found: {conversion_id}"
+        return {'status': 'error', 'message': error_msg}
+        
+    except ConversionCancelled:
+        return stop_cancelled_conversion(conversion_id)
+        
+    except Exception as e:
+        error_message = str(e)
+        fail_conversion(conversion_id, error_message, traceback.format_exc(), channel_layer)
         return {
             'status': 'error',
             'conversion_id': str(conversion_id),
@@ -117,53 +499,110 @@ def convert_file_task(self, conversion_id):
         }
 
 
-def send_progress_update(channel_layer, conversion_id, progress, status, error=None):
+@shared_task
+def pdf_docx_shards_failed(request, exc, tb, conversion_id):
     """
-    Send progress update via WebSocket
+    Chord error callback: a shard failed after its retries
     """
+    delete_shard_parts(conversion_id)
+    fail_conversion(conversion_id, str(exc), str(tb), get_channel_layer())
+
+
+def delete_shard_parts(conversion_id):
+    """Remove stored DOCX parts of a sharded conversion"""
+    directory = shard_storage_dir(conversion_id)
     try:
-        async_to_sync(channel_layer.group_send)(
-            f'conversion_{conversion_id}',
-            {
-                'type': 'conversion_progress',
-                'conversion_id': str(conversion_id),
-                'progress': progress,
-                'status': status,
-                'error': error
-            }
-        )
+        _, files = default_storage.listdir(directory)
+        for name in files:
+            default_storage.delete(f'{directory}/{name}')
     except Exception as e:
-        print(f"Error sending WebSocket message: {e}")
+        print(f"Error deleting shard parts for {conversion_id}: {e}")
+    cache.delete(shard_counter_key(conversion_id))
 
 
 @shared_task
-def cleanup_old_files(days=7):
+def cleanup_old_files(days=None):
     """
     Cleanup old conversion files
+    
+    Finished conversions are kept for reporting as compact ConversionArchive
+    rows; stale unfinished ones are deleted.
     """
     from datetime import timedelta
     
+    if days is None:
+        days = settings.ARCHIVE_AFTER_DAYS
     cutoff_date = timezone.now() - timedelta(days=days)
     old_conversions = FileConversion.objects.filter(created_at__lt=cutoff_date)
+    recent = FileConversion.objects.filter(created_at__gte=cutoff_date)
     
     deleted_count = 0
-    for conversion in old_conversions:
+    failed_ids = []
+    for conversion in old_conversions.defer('error_message', 'media_info', 'options'):
         try:
-            # Delete files
-            if conversion.original_file:
-                conversion.original_file.delete()
-            if conversion.converted_file:
-                conversion.converted_file.delete()
+            # Delete files no newer conversion reuses
+            release_files(conversion, referrers=recent)
             
-            # Delete record
-            conversion.delete()
+            # Delete record (finished ones are archived below)
+            if conversion.status not in FINISHED_STATUSES:
+                conversion.delete()
             deleted_count += 1
         except Exception as e:
+            failed_ids.append(conversion.id)
             print(f"Error deleting conversion {conversion.id}: {e}")
     
+    archived_count = archive_conversions(
+        old_conversions.exclude(id__in=failed_ids), batch_size=settings.ARCHIVE_BATCH_SIZE
+    )
+    
     return {
         'status': 'success',
         'deleted_count': deleted_count,
-        'message': f'Cleaned up {deleted_count} old conversions'
+        'archived_count': archived_count,
+        'message': f'Cleaned up {deleted_count} old conversions ({archived_count} archived)'
     }
 
+
+@shared_task
+def rollup_conversions_task(days=2):
+    """
+    Rebuild the daily conversion rollups (scheduled by celery beat)
+    """
+    return {
+        'status': 'success',
+        'rows': rebuild_recent_rollups(days)
+    }
+
+
+@shared_task
+def refresh_eta_model_task():
+    """
+    Refit the ETA model from conversion history (scheduled by celery beat)
+    """
+    model = refresh_eta_model()
+    return {
+        'status': 'success',
+        'pairs': len(model['pairs']),
+        'types': len(model['types'])
+    }
+
+
+@shared_task
+def age_queued_conversions_task():
+    """
+    Periodic task: re-queue long-waiting conversions one priority level up
+    
+    Returns:
+        int: Number of conversions promoted
+    """
+    promoted = 0
+    for conversion, priority in aging_candidates():
+        if priority >= conversion.priority:
+            continue
+        task_id = promote(conversion, priority)
+        if task_id:
+            convert_file_task.apply_async(
+                args=[str(conversion.id)], task_id=task_id, priority=priority
+            )
+            promoted += 1
+    return promoted
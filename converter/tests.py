@@ -1,7 +1,57 @@
-from django.test import TestCase, Client
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, Client, override_settings
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import FileConversion
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+from .admission import AdmissionRejected, check_capacity, consume_upload_token
+from .cancellation import ConversionCancelled, cancellable, checkpoint, request_cancellation
+from .consumers import ConversionStreamConsumer
+from . import estimator
+from .routing import websocket_urlpatterns
+from .scheduling import claim_conversion, promote
+from .tasks import (
+    age_queued_conversions_task,
+    convert_file_task,
+    enqueue_conversion,
+)
+from .models import FileConversion, session_digest
+from .progress import send_progress_update
+from .utils import (
+    convert_image_auto,
+    convert_image_format,
+    default_effort,
+    docx_to_pdf,
+    docx_to_txt,
+    encode_image,
+    convert_video_segmented,
+    generate_preview,
+    get_ffmpeg_binary,
+    image_to_pdf,
+    load_image,
+    merge_docx_files,
+    parse_effort_option,
+    parse_image_options,
+    plan_page_shards,
+    probe_video_duration,
+    render_pdf_page,
+    run_ffmpeg,
+    structural_similarity,
+    video_codec_args,
+)
 import io
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+import numpy as np
 from PIL import Image
 
 
@@ -47,6 +97,1293 @@ class FileConversionTestCase(TestCase):
         """Test convert page loads"""
         response = self.client.get('/convert/image/')
         self.assertEqual(response.status_code, 200)
+    
+    def test_status_and_download_views(self):
+        """Test async status and download views"""
+        conversion = FileConversion.objects.create(
+            original_file=SimpleUploadedFile("test.txt", b"hello"),
+            original_filename="test.txt",
+            original_format="txt",
+            target_format="pdf",
+            conversion_type="document",
+            file_size=5
+        )
+        
+        response = self.client.get(f'/api/status/{conversion.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'pending')
+        
+        response = self.client.get(f'/api/download/{conversion.id}/')
+        self.assertEqual(response.status_code, 400)
+        
+        conversion.converted_file.save('test_converted.pdf', ContentFile(b'%PDF-1.4'), save=False)
+        conversion.converted_file_size = 8
+        conversion.status = 'completed'
+        conversion.completed_at = conversion.created_at
+        conversion.save()
+        
+        response = self.client.get(f'/api/download/{conversion.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('test_converted.pdf', response['Content-Disposition'])
+        self.assertEqual(b''.join(async_to_sync(self._collect)(response)), b'%PDF-1.4')
+        
+        response = self.client.get('/api/history/?format=json')
+        self.assertEqual(response.json()['conversions'][0]['id'], str(conversion.id))
+        self.assertEqual(self.client.get('/api/history/').status_code, 200)
+    
+    async def _collect(self, response):
+        return [chunk async for chunk in response.streaming_content]
+    
+    def test_bulk_status(self):
+        """Test many statuses are returned at once and support If-None-Match"""
+        conversions = [
+            FileConversion.objects.create(
+                original_file=SimpleUploadedFile("test.txt", b"hello"),
+                original_filename="test.txt",
+                original_format="txt",
+                target_format="pdf",
+                conversion_type="document",
+                file_size=5
+            )
+            for _ in range(3)
+        ]
+        missing = uuid.uuid4()
+        ids = [str(c.id) for c in conversions] + [str(missing)]
+        
+        response = self.client.post(
+            '/api/status/bulk/', {'ids': ids}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([c['id'] for c in data['conversions']], ids[:3])
+        self.assertEqual(data['missing'], [str(missing)])
+        etag = response['ETag']
+        
+        response = self.client.get(f"/api/status/bulk/?ids={','.join(ids)}", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        # A new ETA changes the response even though no row changed
+        with mock.patch('converter.views.remaining_seconds', return_value=1.0):
+            response = self.client.get(f"/api/status/bulk/?ids={','.join(ids)}", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        
+        # A running conversion's countdown alone is not a change
+        conversions[0].status = 'processing'
+        conversions[0].started_at = timezone.now() - timedelta(seconds=1)
+        conversions[0].save()
+        response = self.client.get(f"/api/status/bulk/?ids={','.join(ids)}")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.json()['conversions'][0]['eta_at'])
+        etag = response['ETag']
+        response = self.client.get(f"/api/status/bulk/?ids={','.join(ids)}", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        conversions[1].status = 'failed'
+        conversions[1].save()
+        response = self.client.get(f"/api/status/bulk/?ids={','.join(ids)}", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['conversions'][1]['status'], 'failed')
+        
+        self.assertEqual(self.client.get('/api/status/bulk/?ids=nope').status_code, 400)
 
+
+class ImagePipelineTestCase(TestCase):
+    """Test cases for the single-pass image transform pipeline"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+    
+    def _make_jpeg(self, size=(2000, 1000)):
+        path = os.path.join(self.tmpdir.name, 'source.jpg')
+        Image.new('RGB', size, color='blue').save(path, 'JPEG')
+        return path
+    
+    def test_parse_image_options(self):
+        """Test option parsing and validation"""
+        options = parse_image_options({'width': '200', 'crop': '0,0,100,50', 'quality': '80'})
+        self.assertEqual(options, {'width': 200, 'crop': [0, 0, 100, 50], 'quality': 80})
+        
+        with self.assertRaises(ValueError):
+            parse_image_options({'crop': '10,10,5,5'})
+        with self.assertRaises(ValueError):
+            parse_image_options({'quality': '0'})
+    
+    def test_resize_uses_reduced_decoding(self):
+        """Test downscaling a JPEG decodes at reduced scale and fits the box"""
+        source_path = self._make_jpeg()
+        
+        img, _ = load_image(source_path, {'width': 200})
+        with img:
+            self.assertEqual(img.size, (200, 100))
+        
+        output_path = convert_image_format(source_path, 'png', {'width': 200, 'rotate': 90})
+        with Image.open(output_path) as result:
+            self.assertEqual(result.size, (200, 400))
+    
+    def test_generate_preview(self):
+        """Test previews are small JPEGs rendered from the output"""
+        source_path = self._make_jpeg()
+        output_path = convert_image_format(source_path, 'png')
+        
+        with override_settings(PREVIEW_MAX_SIZE=100):
+            preview_path = generate_preview(source_path, output_path, 'jpg', 'png')
+        with Image.open(preview_path) as preview:
+            self.assertEqual(preview.format, 'JPEG')
+            self.assertEqual(preview.size, (100, 50))
+    
+    def test_crop_then_resize(self):
+        """Test crop boxes are applied in source coordinates"""
+        source_path = self._make_jpeg()
+        
+        img, _ = load_image(source_path, {'crop': [0, 0, 1000, 1000], 'width': 100})
+        with img:
+            self.assertEqual(img.size, (100, 100))
+    
+    @override_settings(
+        CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )
+    def test_small_images_convert_in_memory(self):
+        """Test small inputs never touch a temp file"""
+        img_io = io.BytesIO()
+        Image.new('RGBA', (64, 32), color='red').save(img_io, 'PNG')
+        conversion = FileConversion.objects.create(
+            original_file=SimpleUploadedFile("small.png", img_io.getvalue()),
+            original_filename="small.png",
+            original_format="png",
+            target_format="jpg",
+            conversion_type="image",
+            file_size=len(img_io.getvalue()),
+            media_info={'width': 64, 'height': 32},
+        )
+        
+        with mock.patch('converter.utils.get_temp_path', side_effect=AssertionError('temp file used')):
+            convert_file_task.apply(args=[str(conversion.id)])
+        
+        conversion.refresh_from_db()
+        self.assertEqual(conversion.status, 'completed')
+        with conversion.converted_file.open('rb') as f, Image.open(f) as result:
+            self.assertEqual((result.format, result.size), ('JPEG', (64, 32)))
+        self.assertTrue(conversion.preview_file)
+
+    def test_effort_profiles(self):
+        """Test effort profiles are validated and trade encode effort for bytes"""
+        self.assertEqual(parse_effort_option({'effort': 'max'}), {'effort': 'max'})
+        self.assertEqual(parse_effort_option({}), {})
+        with self.assertRaises(ValueError):
+            parse_effort_option({'effort': 'turbo'})
+        
+        x, y = np.meshgrid(np.linspace(0, 255, 400), np.linspace(0, 255, 300))
+        img = Image.fromarray(np.dstack([x, y, (x + y) / 2]).astype(np.uint8))
+        sizes = {}
+        for effort in ['fast', 'max']:
+            output = io.BytesIO()
+            encode_image(img, output, 'png', {'effort': effort})
+            sizes[effort] = output.getbuffer().nbytes
+        self.assertLess(sizes['max'], sizes['fast'])
+        
+        self.assertIn('veryfast', video_codec_args('mp4', {'effort': 'fast'})[0])
+        with override_settings(EFFORT_DEFAULT='max', EFFORT_QUEUE_DEFAULTS={'interactive': 'fast'}):
+            self.assertIn('slower', video_codec_args('mp4')[0])
+            self.assertEqual(default_effort('interactive'), 'fast')
+            self.assertEqual(default_effort('celery'), 'max')
+    
+    def test_large_tiff_is_converted_in_bands(self):
+        """Test huge TIFFs are streamed in bands to TIFF, PNG and PDF without a full decode"""
+        x, y = np.meshgrid(np.linspace(0, 255, 300), np.linspace(0, 255, 200))
+        pixels = np.dstack([x, y, (x + y) / 2]).astype(np.uint8)
+        source_path = os.path.join(self.tmpdir.name, 'scan.tiff')
+        Image.fromarray(pixels).save(source_path, compression='tiff_lzw')
+        
+        with override_settings(TILED_MIN_PIXELS=10000, TILED_BAND_BYTES=20000, PREVIEW_MAX_SIZE=100), \
+                mock.patch('converter.utils.load_image', side_effect=AssertionError('full decode')):
+            for target_format in ['tiff', 'png']:
+                output_path = convert_image_format(source_path, target_format)
+                with Image.open(output_path) as result:
+                    self.assertEqual(result.format, target_format.upper())
+                    self.assertTrue(np.array_equal(np.asarray(result), pixels))
+            
+            output_path = image_to_pdf(source_path)
+            self.assertEqual(render_pdf_page(output_path, 150).size, (150, 100))
+            
+            preview_path = generate_preview(source_path, output_path, 'tiff', 'pdf')
+            with Image.open(preview_path) as preview:
+                self.assertEqual(preview.size, (100, 67))
+            
+            # Targets that need the whole raster are refused before decoding
+            with self.assertRaisesRegex(ValueError, 'TIFF, PNG or PDF'):
+                convert_image_format(source_path, 'jpg')
+            with self.assertRaisesRegex(ValueError, 'TIFF, PNG or PDF'):
+                convert_image_auto(source_path)
+    
+    @override_settings(
+        CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        TILED_MIN_PIXELS=10000,
+        TILED_BAND_BYTES=20000,
+    )
+    def test_large_tiff_upload_to_tiff(self):
+        """Test a TIFF -> TIFF conversion task streams a large source in bands"""
+        x, y = np.meshgrid(np.linspace(0, 255, 300), np.linspace(0, 255, 200))
+        pixels = np.dstack([x, y, (x + y) / 2]).astype(np.uint8)
+        tiff_io = io.BytesIO()
+        Image.fromarray(pixels).save(tiff_io, 'TIFF', compression='tiff_lzw')
+        conversion = FileConversion.objects.create(
+            original_file=SimpleUploadedFile("scan.tiff", tiff_io.getvalue()),
+            original_filename="scan.tiff",
+            original_format="tiff",
+            target_format="tiff",
+            conversion_type="image",
+            file_size=len(tiff_io.getvalue()),
+            media_info={'width': 300, 'height': 200},
+        )
+        
+        with mock.patch('converter.utils.load_image', side_effect=AssertionError('full decode')):
+            convert_file_task.apply(args=[str(conversion.id)])
+        
+        conversion.refresh_from_db()
+        self.assertEqual(conversion.status, 'completed')
+        self.assertIn('tiled', [name for name, *_ in conversion.stage_timings['stages']])
+        with conversion.converted_file.open('rb') as f, Image.open(f) as result:
+            self.assertEqual(result.format, 'TIFF')
+            self.assertTrue(np.array_equal(np.asarray(result), pixels))
+    
+    def test_structural_similarity(self):
+        """Test SSIM is 1 for identical images and drops with distortion"""
+        rng = np.random.default_rng(0)
+        a = rng.integers(0, 256, (64, 48)).astype(np.uint8)
+        noisy = np.clip(a + rng.normal(0, 40, a.shape), 0, 255).astype(np.uint8)
+        self.assertAlmostEqual(structural_similarity(a, a), 1.0)
+        self.assertLess(structural_similarity(a, noisy), 0.9)
+    
+    @override_settings(AUTO_FORMAT_SSIM_SIZE=64)
+    def test_auto_format_scores_chroma_and_full_resolution(self):
+        """Test candidates are compared on chroma and on a centre crop at 1:1"""
+        from .utils import _comparison_planes
+        
+        img = Image.new('RGB', (200, 100), 'white')
+        img.putpixel((100, 50), (255, 0, 0))
+        y, cb, cr, crop = _comparison_planes(img)
+        self.assertEqual([p.size for p in (y, cb, cr)], [(64, 32)] * 3)
+        self.assertEqual(crop.size, (64, 64))
+        # The crop is cut from the middle without scaling, so the red pixel survives
+        self.assertEqual(crop.getextrema()[0], img.convert('YCbCr').getpixel((100, 50))[0])
+    
+    @override_settings(
+        CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )
+    def test_auto_format_picks_smallest_acceptable(self):
+        """Test the 'auto' target keeps the smallest candidate meeting the SSIM threshold"""
+        x, y = np.meshgrid(np.linspace(0, 255, 320), np.linspace(0, 255, 240))
+        photo = np.dstack([x, y, (x + y) / 2]).astype(np.uint8)
+        img_io = io.BytesIO()
+        Image.fromarray(photo).save(img_io, 'PNG')
+        conversion = FileConversion.objects.create(
+            original_file=SimpleUploadedFile("photo.png", img_io.getvalue()),
+            original_filename="photo.png",
+            original_format="png",
+            target_format="auto",
+            conversion_type="image",
+            file_size=len(img_io.getvalue()),
+        )
+        
+        convert_file_task.apply(args=[str(conversion.id)])
+        
+        conversion.refresh_from_db()
+        self.assertEqual(conversion.status, 'completed')
+        self.assertIn(conversion.target_format, ['webp', 'jpg'])
+        self.assertLess(conversion.converted_file_size, len(img_io.getvalue()))
+        self.assertTrue(conversion.converted_file.name.endswith(f'.{conversion.target_format}'))
+        with conversion.converted_file.open('rb') as f, Image.open(f) as result:
+            similarity = structural_similarity(photo.mean(axis=2), np.asarray(result.convert('L')))
+        self.assertGreater(similarity, 0.9)
+        
+        # Transparent images never lose their alpha channel to JPEG
+        source_path = os.path.join(self.tmpdir.name, 'logo.png')
+        Image.new('RGBA', (64, 64), (255, 0, 0, 0)).save(source_path)
+        output_path = convert_image_auto(source_path)
+        with Image.open(output_path) as result:
+            self.assertIn(result.format, ['WEBP', 'PNG'])
+            self.assertTrue(result.has_transparency_data)
+    
+    @override_settings(
+        CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )
+    def test_stage_timings_recorded(self):
+        """Test each conversion stores its stage breakdown and exposes it in the status API"""
+        img_io = io.BytesIO()
+        Image.new('RGB', (64, 32), color='blue').save(img_io, 'PNG')
+        conversion = FileConversion.objects.create(
+            original_file=SimpleUploadedFile("timed.png", img_io.getvalue()),
+            original_filename="timed.png",
+            original_format="png",
+            target_format="webp",
+            conversion_type="image",
+            file_size=len(img_io.getvalue()),
+        )
+        
+        convert_file_task.apply(args=[str(conversion.id)])
+        
+        conversion.refresh_from_db()
+        timings = conversion.stage_timings
+        names = [name for name, _, _ in timings['stages']]
+        for name in ['probe', 'read_source', 'decode', 'encode', 'convert', 'store', 'preview']:
+            self.assertIn(name, names)
+        self.assertGreaterEqual(timings['queue'], 0)
+        for _, start, duration in timings['stages']:
+            self.assertGreaterEqual(start, 0)
+            self.assertGreaterEqual(duration, 0)
+        
+        self.assertEqual(conversion.options['effort'], 'balanced')
+        
+        response = Client().get(f'/api/status/{conversion.id}/')
+        self.assertEqual(response.json()['stage_timings'], timings)
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    WEBSOCKET_FLUSH_INTERVAL=0.05,
+)
+class ConversionStreamTestCase(TestCase):
+    """Test cases for the multiplexed progress WebSocket"""
+    
+    def test_subscribe_and_batch_updates(self):
+        """Test one socket receives coalesced updates for many conversions"""
+        async_to_sync(self._subscribe_and_batch_updates)()
+    
+    async def _subscribe_and_batch_updates(self):
+        ids = [str(uuid.uuid4()) for _ in range(3)]
+        communicator = WebsocketCommunicator(ConversionStreamConsumer.as_asgi(), '/ws/conversions/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        
+        await communicator.send_json_to({'type': 'subscribe', 'conversion_ids': ids})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['subscriptions'], 3)
+        
+        channel_layer = get_channel_layer()
+        for progress in [10, 30]:
+            for conversion_id in ids:
+                await channel_layer.group_send(f'conversion_{conversion_id}', {
+                    'type': 'conversion_progress',
+                    'conversion_id': conversion_id,
+                    'progress': progress,
+                    'status': 'processing',
+                })
+        
+        response = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(response['type'], 'progress_batch')
+        self.assertEqual(sorted(u['conversion_id'] for u in response['updates']), sorted(ids))
+        self.assertTrue(all(u['progress'] == 30 for u in response['updates']))
+        
+        await communicator.disconnect()
+    
+    def test_conversions_followed_through_batch_group(self):
+        """Test conversions of one batch share a group and unfollowed ones are filtered out"""
+        conversions = [
+            FileConversion.objects.create(
+                original_file=SimpleUploadedFile("test.png", b"0"),
+                original_filename="test.png",
+                original_format="png",
+                target_format="jpg",
+                conversion_type="image",
+                batch_id="batch-1",
+                session_hash=session_digest('owner-session'),
+            )
+            for _ in range(3)
+        ]
+        async_to_sync(self._conversions_followed_through_batch_group)(conversions)
+    
+    async def _conversions_followed_through_batch_group(self, conversions):
+        followed = [str(c.id) for c in conversions[:2]]
+        communicator = WebsocketCommunicator(ConversionStreamConsumer.as_asgi(), '/ws/conversions/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        
+        await communicator.send_json_to({'type': 'subscribe', 'conversion_ids': followed})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['subscriptions'], 2)
+        
+        channel_layer = get_channel_layer()
+        self.assertEqual(list(channel_layer.groups), conversions[0].get_progress_groups())
+        
+        response = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(sorted(u['conversion_id'] for u in response['updates']), sorted(followed))
+        
+        for conversion in conversions:
+            await sync_to_async(send_progress_update)(
+                channel_layer, conversion.id, 30, 'processing', groups=conversion.get_progress_groups()
+            )
+        response = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(sorted(u['conversion_id'] for u in response['updates']), sorted(followed))
+        
+        await communicator.disconnect()
+        self.assertEqual(list(channel_layer.groups), [])
+    
+    def test_batch_stream_is_scoped_to_its_session(self):
+        """Test only the uploading session can follow a batch by its id"""
+        conversion = FileConversion.objects.create(
+            original_file=SimpleUploadedFile("test.png", b"0"),
+            original_filename="test.png",
+            original_format="png",
+            target_format="jpg",
+            conversion_type="image",
+            batch_id="batch-1",
+            session_hash=session_digest('owner-session'),
+        )
+        async_to_sync(self._batch_stream_is_scoped_to_its_session)(conversion)
+    
+    async def _batch_stream_is_scoped_to_its_session(self, conversion):
+        sockets = {}
+        for session_key in [None, 'other-session', 'owner-session']:
+            communicator = WebsocketCommunicator(ConversionStreamConsumer.as_asgi(), '/ws/conversions/')
+            if session_key:
+                communicator.scope['session'] = mock.Mock(session_key=session_key)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'type': 'subscribe', 'batch_id': 'batch-1'})
+            sockets[session_key] = (communicator, await communicator.receive_json_from())
+        
+        self.assertEqual(sockets[None][1]['type'], 'error')
+        self.assertEqual(sockets['other-session'][1]['type'], 'subscribed')
+        
+        await sync_to_async(send_progress_update)(
+            get_channel_layer(), conversion.id, 30, 'processing', groups=conversion.get_progress_groups()
+        )
+        response = await sockets['owner-session'][0].receive_json_from(timeout=2)
+        self.assertEqual([u['conversion_id'] for u in response['updates']], [str(conversion.id)])
+        self.assertTrue(await sockets['other-session'][0].receive_nothing(timeout=0.2))
+        
+        for communicator, _ in sockets.values():
+            await communicator.disconnect()
+    
+    def test_late_subscriber_receives_snapshot(self):
+        """Test a socket opened after an event still gets the latest state"""
+        conversion_id = str(uuid.uuid4())
+        send_progress_update(get_channel_layer(), conversion_id, 70, 'processing')
+        async_to_sync(self._late_subscriber_receives_snapshot)(conversion_id)
+    
+    async def _late_subscriber_receives_snapshot(self, conversion_id):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/conversion/{conversion_id}/'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['progress'], 70)
+        self.assertEqual(response['status'], 'processing')
+        
+        # Events older than the snapshot are dropped
+        channel_layer = get_channel_layer()
+        for progress, status in [(30, 'processing'), (100, 'completed')]:
+            await channel_layer.group_send(f'conversion_{conversion_id}', {
+                'type': 'conversion_progress',
+                'conversion_id': conversion_id,
+                'progress': progress,
+                'status': status,
+            })
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['status'], 'completed')
+        
+        await communicator.disconnect()
+
+
+class WorkerWarmUpTestCase(TestCase):
+    """Test cases for worker warm-up"""
+    
+    def test_warm_up_marks_process_ready(self):
+        """Test warm-up builds the cached PDF stylesheet and reports readiness"""
+        from .utils import get_pdf_styles
+        from .warmup import is_ready, warm_up
+        
+        warm_up()
+        self.assertTrue(is_ready())
+        self.assertIs(get_pdf_styles(), get_pdf_styles())
+
+
+class PdfShardingTestCase(TestCase):
+    """Test cases for page-range sharding of PDF -> DOCX conversions"""
+    
+    def test_plan_page_shards(self):
+        """Test page ranges cover the document without gaps"""
+        self.assertEqual(plan_page_shards(60, 25), [(0, 25), (25, 50), (50, 60)])
+        self.assertEqual(plan_page_shards(10, 25), [(0, 10)])
+    
+    def test_merge_docx_parts(self):
+        """Test DOCX parts are merged in order with their images"""
+        from docx import Document
+        
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        
+        image_io = io.BytesIO()
+        Image.new('RGB', (10, 10), color='green').save(image_io, 'PNG')
+        
+        part_paths = []
+        for index in range(3):
+            doc = Document()
+            doc.add_paragraph(f'page {index}')
+            if index == 2:
+                image_io.seek(0)
+                doc.add_picture(image_io)
+            path = os.path.join(tmpdir.name, f'part{index}.docx')
+            doc.save(path)
+            part_paths.append(path)
+        
+        output_path = os.path.join(tmpdir.name, 'merged.docx')
+        merge_docx_files(part_paths, output_path)
+        
+        merged = Document(output_path)
+        texts = [p.text for p in merged.paragraphs if p.text]
+        self.assertEqual(texts, ['page 0', 'page 1', 'page 2'])
+        self.assertEqual(len(merged.inline_shapes), 1)
+        self.assertEqual(len(merged.sections), 3)
+    
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_merge_survives_cache_outage(self):
+        """Test the merge callback completes when the cancellation check fails"""
+        from docx import Document
+        from django.core.files.storage import default_storage
+        from .tasks import merge_docx_parts_task, shard_storage_dir
+        
+        conversion = FileConversion.objects.create(
+            original_file=SimpleUploadedFile("test.pdf", b"%PDF-1.4"),
+            original_filename="test.pdf",
+            original_format="pdf",
+            target_format="docx",
+            conversion_type="document",
+            status='processing',
+            started_at=timezone.now(),
+        )
+        part_names = []
+        for index in range(2):
+            part = io.BytesIO()
+            doc = Document()
+            doc.add_paragraph(f'page {index}')
+            doc.save(part)
+            part_names.append(default_storage.save(
+                f'{shard_storage_dir(conversion.id)}/part{index}.docx', ContentFile(part.getvalue())
+            ))
+        
+        with mock.patch('converter.tasks.is_cancellation_requested', side_effect=ConnectionError('down')):
+            result = merge_docx_parts_task(part_names, str(conversion.id))
+        
+        self.assertEqual(result['status'], 'success')
+        conversion.refresh_from_db()
+        self.assertEqual(conversion.status, 'completed')
+
+
+class DocxStreamingTestCase(TestCase):
+    """Test cases for streaming DOCX text extraction"""
+    
+    def test_streamed_text_matches_python_docx(self):
+        """Test DOCX -> TXT/PDF read the same paragraphs as python-docx"""
+        from docx import Document
+        from docx.enum.text import WD_BREAK
+        import fitz
+        
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        
+        doc = Document()
+        doc.add_paragraph('Fish & <chips>')
+        run = doc.add_paragraph('tab\there').add_run('line')
+        run.add_break()
+        run.add_text('two')
+        run.add_break(WD_BREAK.PAGE)
+        doc.add_table(rows=1, cols=1).cell(0, 0).text = 'in a table'
+        doc.add_paragraph('')
+        doc.add_paragraph('last')
+        source_path = os.path.join(tmpdir.name, 'source.docx')
+        doc.save(source_path)
+        
+        expected = '\n'.join(p.text for p in Document(source_path).paragraphs)
+        with open(docx_to_txt(source_path), encoding='utf-8') as f:
+            self.assertEqual(f.read(), expected)
+        
+        with fitz.open(docx_to_pdf(source_path)) as pdf:
+            text = pdf[0].get_text()
+        self.assertIn('Fish & <chips>', text)
+        self.assertIn('last', text)
+        self.assertNotIn('in a table', text)
+
+
+@override_settings(VIDEO_SEGMENT_SECONDS=2, VIDEO_SEGMENT_WORKERS=2)
+class SegmentedVideoTestCase(TestCase):
+    """Test cases for segment-parallel video transcoding"""
+    
+    def test_segmented_transcode_keeps_duration(self):
+        """Test segments are encoded and concatenated back to the full video"""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        source_path = os.path.join(tmpdir.name, 'source.mkv')
+        subprocess.run([
+            get_ffmpeg_binary(), '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', 'testsrc=duration=6:size=160x120:rate=25',
+            '-f', 'lavfi', '-i', 'sine=duration=6',
+            '-g', '25', '-c:v', 'libx264', '-c:a', 'aac', source_path,
+        ], check=True)
+        
+        output_path = convert_video_segmented(
+            source_path, 'mp4', os.path.join(tmpdir.name, 'output.mp4')
+        )
+        
+        self.assertAlmostEqual(probe_video_duration(output_path), 6, delta=0.5)
+        self.assertFalse(os.path.exists(os.path.join(tmpdir.name, 'source_converted.segments')))
+    
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    @mock.patch('converter.views.check_capacity')
+    @mock.patch('converter.views.enqueue_conversion')
+    def test_small_video_upload_is_probed(self, enqueue, _):
+        """Test a video held in memory is probed once stored, before it is enqueued"""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        source_path = os.path.join(tmpdir.name, 'clip.mp4')
+        subprocess.run([
+            get_ffmpeg_binary(), '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', 'testsrc=duration=3:size=64x48:rate=10',
+            '-c:v', 'libx264', source_path,
+        ], check=True)
+        with open(source_path, 'rb') as f:
+            upload = SimpleUploadedFile('clip.mp4', f.read())
+        
+        response = self.client.post('/api/upload/', {
+            'file': upload,
+            'target_format': 'webm',
+            'conversion_type': 'video',
+        })
+        self.assertEqual(response.status_code, 200)
+        
+        conversion = enqueue.call_args[0][0]
+        self.assertAlmostEqual(conversion.media_info['duration'], 3, delta=0.5)
+        conversion.refresh_from_db()
+        self.assertAlmostEqual(conversion.media_info['duration'], 3, delta=0.5)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CANCEL_POLL_SECONDS=0.05,
+)
+class CancellationTestCase(TestCase):
+    """Test cases for cancelling conversions"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+    
+    @mock.patch('converter.progress.current_app')
+    def test_cancel_queued_conversion(self, app):
+        """Test a cancelled conversion is revoked and its task does nothing"""
+        conversion = FileConversion.objects.create(
+            original_file=SimpleUploadedFile("test.txt", b"hello"),
+            original_filename="test.txt",
+            original_format="txt",
+            target_format="pdf",
+            conversion_type="document",
+            task_id=str(uuid.uuid4()),
+        )
+        
+        response = self.client.post(f'/api/cancel/{conversion.id}/')
+        self.assertEqual(response.status_code, 200)
+        app.control.revoke.assert_called_once_with(conversion.task_id)
+        self.assertEqual(self.client.get(f'/api/status/{conversion.id}/').json()['status'], 'cancelled')
+        
+        # A message that was already delivered is dropped
+        result = convert_file_task.apply(args=[str(conversion.id)], task_id=conversion.task_id).get()
+        self.assertEqual(result['status'], 'cancelled')
+        conversion.refresh_from_db()
+        self.assertIsNone(conversion.started_at)
+        
+        # Finished conversions can't be cancelled
+        self.assertEqual(self.client.post(f'/api/cancel/{conversion.id}/').status_code, 409)
+    
+    def test_cancel_while_storing_wins(self):
+        """Test a conversion cancelled before completion is saved stays cancelled"""
+        from .tasks import complete_conversion
+        
+        conversion = FileConversion.objects.create(
+            original_file=SimpleUploadedFile("test.txt", b"hello"),
+            original_filename="test.txt",
+            original_format="txt",
+            target_format="pdf",
+            conversion_type="document",
+            status='processing',
+        )
+        FileConversion.objects.filter(id=conversion.id).update(status='cancelled')
+        
+        with self.assertRaises(ConversionCancelled):
+            complete_conversion(conversion, io.BytesIO(b'%PDF-1.4'), get_channel_layer())
+        # The stored output was deleted again
+        self.assertFalse(conversion.converted_file)
+        conversion.refresh_from_db()
+        self.assertEqual(conversion.status, 'cancelled')
+        self.assertFalse(conversion.converted_file)
+    
+    def test_cancel_kills_ffmpeg(self):
+        """Test a cancellation stops a running ffmpeg process at once"""
+        conversion_id = uuid.uuid4()
+        timer = threading.Timer(0.3, request_cancellation, [conversion_id])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        
+        started = time.monotonic()
+        with cancellable(conversion_id), self.assertRaises(ConversionCancelled):
+            run_ffmpeg(['-re', '-f', 'lavfi', '-i', 'testsrc=duration=30', '-f', 'null', '-'])
+        self.assertLess(time.monotonic() - started, 5)
+        
+        # Checkpoints outside a cancellable block do nothing
+        checkpoint()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    UPLOAD_RATE_LIMIT_PER_MINUTE=60,
+    UPLOAD_RATE_LIMIT_BURST=2,
+    ADMISSION_MAX_QUEUE_DEPTH=100,
+    ADMISSION_MAX_BACKLOG_SECONDS=10,
+    ADMISSION_WORKER_CONCURRENCY=1,
+    ADMISSION_TYPE_SECONDS={'video': 5},
+)
+class AdmissionControlTestCase(TestCase):
+    """Test cases for upload admission control and rate limiting"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        estimator._model = None
+    
+    @mock.patch('converter.admission.time.time', return_value=1001.0)
+    def test_token_bucket(self, _):
+        """Test a client is limited to its burst, then told when to retry"""
+        consume_upload_token('ip:1.2.3.4')
+        consume_upload_token('ip:1.2.3.4')
+        with self.assertRaises(AdmissionRejected) as ctx:
+            consume_upload_token('ip:1.2.3.4')
+        self.assertEqual(ctx.exception.retry_after, 1)
+        
+        # Other clients have their own bucket
+        consume_upload_token('ip:5.6.7.8')
+    
+    def test_token_bucket_refills_smoothly(self):
+        """Test a drained bucket gives back one token per interval, never a second burst"""
+        with mock.patch('converter.admission.time.time', return_value=1001.5):
+            consume_upload_token('ip:1.2.3.4')
+            consume_upload_token('ip:1.2.3.4')
+        with mock.patch('converter.admission.time.time', return_value=1002.6):
+            consume_upload_token('ip:1.2.3.4')
+            with self.assertRaises(AdmissionRejected):
+                consume_upload_token('ip:1.2.3.4')
+        with mock.patch('converter.admission.time.time', return_value=1004.6):
+            consume_upload_token('ip:1.2.3.4')
+            consume_upload_token('ip:1.2.3.4')
+            with self.assertRaises(AdmissionRejected):
+                consume_upload_token('ip:1.2.3.4')
+    
+    @mock.patch('converter.admission.get_queue_depth', return_value=0)
+    def test_backlog_limit(self, _):
+        """Test uploads are refused once the estimated backlog is too long"""
+        check_capacity('video')
+        
+        for _ in range(2):
+            FileConversion.objects.create(
+                original_file=SimpleUploadedFile("test.mp4", b"0"),
+                original_filename="test.mp4",
+                original_format="mp4",
+                target_format="avi",
+                conversion_type="video",
+            )
+        from django.core.cache import cache
+        cache.clear()
+        
+        with self.assertRaises(AdmissionRejected) as ctx:
+            check_capacity('video')
+        self.assertEqual(ctx.exception.retry_after, 5)
+    
+    @mock.patch('converter.admission.time.time', return_value=1001.0)
+    def test_upload_returns_429(self, _):
+        """Test the upload endpoint answers 429 with Retry-After"""
+        for _ in range(2):
+            consume_upload_token('ip:127.0.0.1')
+        
+        response = self.client.post('/api/upload/')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class ContentReuseTestCase(TestCase):
+    """Test cases for the check-before-upload endpoint"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+    
+    def check(self, content, **fields):
+        import hashlib
+        import json
+        body = {
+            'sha256': hashlib.sha256(content).hexdigest(),
+            'size': len(content),
+            'filename': 'again.png',
+            'target_format': 'jpg',
+            'conversion_type': 'image',
+            **fields
+        }
+        return self.client.post('/api/check/', json.dumps(body), content_type='application/json')
+    
+    @mock.patch('converter.views.check_capacity')
+    @mock.patch('converter.views.enqueue_conversion')
+    def test_repeat_content_skips_upload(self, enqueue, _):
+        """Test a known hash gets a completed conversion sharing the stored output"""
+        from django.contrib.auth import get_user_model
+        owner = get_user_model().objects.create_user('owner')
+        self.client.force_login(owner)
+        
+        content = b'\x89PNG same bytes'
+        response = self.client.post('/api/upload/', {
+            'file': SimpleUploadedFile('first.png', content),
+            'target_format': 'jpg',
+            'conversion_type': 'image',
+        })
+        self.assertEqual(response.status_code, 200)
+        source = FileConversion.objects.get(id=response.json()['conversion_id'])
+        
+        # Nothing to reuse until the first conversion has completed
+        self.assertFalse(self.check(content).json()['found'])
+        source.converted_file.save('first_converted.jpg', ContentFile(b'jpeg'), save=False)
+        source.status = 'completed'
+        source.completed_at = timezone.now()
+        source.save()
+        
+        # Different content or options still need an upload
+        self.assertFalse(self.check(content + b'!').json()['found'])
+        self.assertFalse(self.check(content, options={'width': '10'}).json()['found'])
+        
+        data = self.check(content, options={'effort': 'fast'}).json()
+        self.assertFalse(data['found'])
+        
+        # Other users and anonymous clients can't reach the owner's files by hash
+        self.client.force_login(get_user_model().objects.create_user('other'))
+        self.assertFalse(self.check(content).json()['found'])
+        self.client.logout()
+        self.assertFalse(self.check(content).json()['found'])
+        self.client.force_login(owner)
+        
+        # Output that cleanup may already be releasing, or has lost, is not reused
+        created_at = source.created_at
+        old = timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS + 1)
+        FileConversion.objects.filter(id=source.id).update(created_at=old)
+        self.assertFalse(self.check(content).json()['found'])
+        FileConversion.objects.filter(id=source.id).update(created_at=created_at)
+        with mock.patch('converter.reuse.default_storage.exists', return_value=False):
+            self.assertFalse(self.check(content).json()['found'])
+        
+        data = self.check(content).json()
+        self.assertTrue(data['found'])
+        self.assertEqual(data['conversion']['status'], 'completed')
+        self.assertEqual(enqueue.call_count, 1)
+        
+        copy = FileConversion.objects.get(id=data['conversion_id'])
+        self.assertEqual(copy.original_filename, 'again.png')
+        self.assertEqual(copy.converted_file.name, source.converted_file.name)
+        self.assertIsNone(copy.started_at)
+        
+        # Shared files survive until the last conversion using them is deleted
+        path = source.converted_file.path
+        self.client.post(f'/api/delete/{source.id}/')
+        self.assertTrue(os.path.exists(path))
+        self.client.post(f'/api/delete/{copy.id}/')
+        self.assertFalse(os.path.exists(path))
+    
+    @mock.patch('converter.views.check_capacity')
+    @mock.patch('converter.views.enqueue_conversion')
+    def test_anonymous_reuse_is_scoped_to_the_session(self, enqueue, _):
+        """Test anonymous clients reuse their own session's conversions, including 'auto' ones"""
+        from .tasks import complete_conversion
+        
+        png = io.BytesIO()
+        Image.new('RGB', (16, 16), 'red').save(png, 'PNG')
+        content = png.getvalue()
+        response = self.client.post('/api/upload/', {
+            'file': SimpleUploadedFile('first.png', content),
+            'target_format': 'auto',
+            'conversion_type': 'image',
+        })
+        source = FileConversion.objects.get(id=response.json()['conversion_id'])
+        self.assertTrue(source.session_hash)
+        
+        output = io.BytesIO()
+        Image.new('RGB', (16, 16), 'red').save(output, 'WEBP')
+        output.name = 'first.webp'
+        complete_conversion(source, output, get_channel_layer())
+        source.refresh_from_db()
+        self.assertEqual(source.target_format, 'webp')
+        
+        # 'auto' matches the request, not the format it turned into
+        self.assertFalse(self.check(content, target_format='webp').json()['found'])
+        data = self.check(content, target_format='auto').json()
+        self.assertTrue(data['found'])
+        copy = FileConversion.objects.get(id=data['conversion_id'])
+        self.assertEqual(copy.session_hash, source.session_hash)
+        self.assertEqual(copy.converted_file.name, source.converted_file.name)
+        
+        # Another anonymous session can't reach the files by hash
+        self.client = Client()
+        self.assertFalse(self.check(content, target_format='auto').json()['found'])
+    
+    def test_invalid_check_request(self):
+        """Test malformed hashes are refused"""
+        response = self.client.post(
+            '/api/check/', '{"sha256": "abc", "size": 1}', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class PrioritySchedulingTestCase(TestCase):
+    """Test cases for size-aware task priorities with aging"""
+    
+    def setUp(self):
+        estimator._model = {'pairs': {}, 'types': {'image': [0.2, 2.0, 0]}}
+        estimator._model_loaded_at = time.monotonic()
+    
+    def tearDown(self):
+        estimator._model = None
+    
+    def _create(self, file_size):
+        return FileConversion.objects.create(
+            original_file=SimpleUploadedFile("test.png", b"0"),
+            original_filename="test.png",
+            original_format="png",
+            target_format="jpg",
+            conversion_type="image",
+            file_size=file_size,
+        )
+    
+    def test_small_jobs_first_and_aging(self):
+        """Test priorities follow predicted cost and waiting jobs are promoted"""
+        small, large = self._create(20 * 1024), self._create(95 * 1024 * 1024)
+        with mock.patch.object(convert_file_task, 'apply_async') as apply_async:
+            enqueue_conversion(small)
+            enqueue_conversion(large)
+        self.assertEqual((small.priority, large.priority), (0, 6))
+        apply_async.assert_called_with(
+            args=[str(large.id)], task_id=large.task_id, priority=6
+        )
+        
+        # Two aging periods later the large job is re-queued two levels up
+        old_task_id = large.task_id
+        FileConversion.objects.filter(id=large.id).update(
+            updated_at=timezone.now() - timedelta(seconds=2 * settings.PRIORITY_AGING_SECONDS + 5)
+        )
+        with mock.patch.object(convert_file_task, 'apply_async') as apply_async:
+            self.assertEqual(age_queued_conversions_task(), 1)
+        large.refresh_from_db()
+        self.assertEqual(large.priority, 4)
+        apply_async.assert_called_once_with(args=[str(large.id)], task_id=large.task_id, priority=4)
+        
+        # The superseded message is dropped when it reaches a worker
+        result = convert_file_task.apply(args=[str(large.id)], task_id=old_task_id).get()
+        self.assertEqual(result['status'], 'superseded')
+        large.refresh_from_db()
+        self.assertEqual(large.status, 'pending')
+        
+        # Claimed conversions are no longer promoted
+        self.assertTrue(claim_conversion(large.id, large.task_id))
+        self.assertIsNone(promote(large, 0))
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    ETA_MIN_SAMPLES=3,
+)
+class EtaEstimatorTestCase(TestCase):
+    """Test cases for history based ETA estimation"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        estimator._model = None
+    
+    def tearDown(self):
+        estimator._model = None
+    
+    def test_fit_and_estimate(self):
+        """Test processing time is learnt from pages of completed PDF conversions"""
+        from datetime import timedelta
+        from django.utils import timezone
+        
+        now = timezone.now()
+        for pages in [1, 2, 4, 8]:
+            FileConversion.objects.create(
+                original_file=SimpleUploadedFile("test.pdf", b"0"),
+                original_filename="test.pdf",
+                original_format="pdf",
+                target_format="docx",
+                conversion_type="document",
+                status="completed",
+                media_info={'pages': pages},
+                started_at=now - timedelta(seconds=2 + 3 * pages),
+                completed_at=now,
+            )
+        
+        model = estimator.refresh_eta_model()
+        self.assertIn('pdf:docx', model['pairs'])
+        
+        eta = estimator.estimate_seconds('pdf', 'docx', 'document', 0, {'pages': 10})
+        self.assertAlmostEqual(eta, 32, delta=0.5)
+        self.assertAlmostEqual(estimator.typical_seconds('document'), 13.25, delta=0.5)
+        
+        # Unknown pairs fall back to the conversion type model
+        eta = estimator.estimate_seconds('pdf', 'txt', 'document', 0, {'pages': 10})
+        self.assertAlmostEqual(eta, 32, delta=0.5)
+    
+    def test_status_view_loads_model_without_blocking(self):
+        """Test the async status view reads the ETA model with cache.aget only"""
+        conversion = FileConversion.objects.create(
+            original_file=SimpleUploadedFile("test.pdf", b"0"),
+            original_filename="test.pdf",
+            original_format="pdf",
+            target_format="docx",
+            conversion_type="document",
+            media_info={'pages': 2},
+        )
+        model = {'types': {'document': [1.0, 0, 2.0]}}
+        
+        with mock.patch('converter.estimator.cache') as cache:
+            cache.aget = mock.AsyncMock(return_value=model)
+            cache.get.side_effect = AssertionError('blocking cache read')
+            response = self.client.get(f'/api/status/{conversion.id}/')
+        cache.get.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['eta_seconds'], 5.0)
+
+
+class ArchivalRollupTestCase(TestCase):
+    """Test cases for conversion archival and daily rollups"""
+    
+    def create_conversion(self, days_ago, status='completed'):
+        from datetime import timedelta
+        from django.utils import timezone
+        
+        created_at = timezone.now() - timedelta(days=days_ago)
+        return FileConversion.objects.create(
+            original_file=SimpleUploadedFile("test.jpg", b"0"),
+            original_filename="test.jpg",
+            original_format="jpg",
+            target_format="png",
+            conversion_type="image",
+            status=status,
+            file_size=100,
+            error_message="Conversion failed\n\nTraceback ..." if status == 'failed' else None,
+            created_at=created_at,
+            started_at=created_at,
+            completed_at=created_at + timedelta(seconds=4),
+        )
+    
+    def test_archive_keeps_rollups(self):
+        """Test old finished rows are archived without changing the totals"""
+        from .models import ConversionArchive, ConversionDailyRollup
+        from .rollups import get_totals, rebuild_recent_rollups
+        from .tasks import cleanup_old_files
+        
+        self.create_conversion(10)
+        failed = self.create_conversion(10, status='failed')
+        self.create_conversion(10, status='processing')
+        self.create_conversion(0)
+        
+        rebuild_recent_rollups()
+        totals = get_totals()
+        self.assertEqual(totals['total'], 4)
+        self.assertEqual(totals['completed'], 2)
+        
+        result = cleanup_old_files(days=7)
+        self.assertEqual(result['archived_count'], 2)
+        self.assertEqual(FileConversion.objects.count(), 1)
+        self.assertEqual(
+            ConversionArchive.objects.get(id=failed.id).error_summary, 'Conversion failed'
+        )
+        
+        rollup = ConversionDailyRollup.objects.get(status='completed')
+        self.assertEqual(rollup.count, 1)
+        self.assertEqual(rollup.get_average_seconds(), 4)
+        
+        # Archived rows still count
+        self.assertEqual(get_totals()['completed'], 2)
+        self.assertEqual(get_totals()['failed'], 1)
+
+
+class ScratchSpaceTestCase(TestCase):
+    """Test cases for managed scratch space"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.settings_override = override_settings(
+            SCRATCH_ROOT=self.tmpdir.name, SCRATCH_QUOTA_BYTES=1000
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        
+        from . import scratch
+        self.addCleanup(setattr, scratch, '_process_dir', None)
+        scratch._process_dir = None
+    
+    def test_task_scratch_is_removed(self):
+        """Test temp paths live in a per-task directory removed on failure"""
+        from .scratch import task_scratch
+        from .utils import get_temp_path
+        
+        with self.assertRaises(RuntimeError):
+            with task_scratch() as task_dir:
+                path = get_temp_path('/media/uploads/photo.jpg', 'png')
+                self.assertEqual(path, os.path.join(task_dir, 'photo_converted.png'))
+                open(path, 'w').close()
+                raise RuntimeError('conversion failed')
+        
+        self.assertFalse(os.path.exists(task_dir))
+        self.assertEqual(get_temp_path('/media/uploads/photo.jpg', 'png'), '/media/uploads/photo_converted.png')
+    
+    def test_quota_counts_reservations(self):
+        """Test concurrent reservations are refused beyond the quota"""
+        from .scratch import ScratchQuotaExceeded, reserve_scratch, scratch_usage, task_scratch
+        
+        with task_scratch():
+            reserve_scratch(600)
+            with task_scratch():
+                self.assertEqual(scratch_usage(), 600)
+                with self.assertRaises(ScratchQuotaExceeded):
+                    reserve_scratch(600)
+                reserve_scratch(300)
+    
+    def test_stale_directories_are_removed(self):
+        """Test directories of dead processes are reclaimed, live ones kept"""
+        from .scratch import cleanup_stale_scratch, get_process_dir
+        
+        live = get_process_dir()
+        stale = os.path.join(self.tmpdir.name, 'proc-99999-dead')
+        os.makedirs(os.path.join(stale, 'task-x'))
+        os.utime(stale, (0, 0))
+        
+        self.assertEqual(cleanup_stale_scratch(), 1)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(live))
+
+
+@override_settings(
+    SUPABASE_URL='https://example.supabase.co',
+    SUPABASE_KEY='key',
+    SUPABASE_BUCKET_NAME='bucket',
+    SUPABASE_RESUMABLE_THRESHOLD=8,
+    SUPABASE_CHUNK_SIZE=4,
+)
+class SupabaseResumableUploadTestCase(TestCase):
+    """Test cases for chunked uploads to Supabase Storage"""
+    
+    def test_large_files_upload_in_retried_chunks(self):
+        """Test parts are streamed and a failed part resumes from the server offset"""
+        import httpx
+        from fileconverter.storage_backends import SupabaseStorage
+        
+        received = bytearray()
+        failures = {'patch': 1}
+        
+        def handler(request):
+            if request.method == 'POST':
+                self.assertEqual(request.headers['Upload-Length'], '10')
+                return httpx.Response(201, headers={'Location': '/storage/v1/upload/resumable/abc'})
+            if request.method == 'HEAD':
+                return httpx.Response(200, headers={'Upload-Offset': str(len(received))})
+            self.assertEqual(int(request.headers['Upload-Offset']), len(received))
+            if len(received) == 4 and failures['patch']:
+                failures['patch'] -= 1
+                return httpx.Response(500)
+            received.extend(request.content)
+            return httpx.Response(204, headers={'Upload-Offset': str(len(received))})
+        
+        with mock.patch('fileconverter.storage_backends.create_client'):
+            storage = SupabaseStorage()
+        storage._http_client = lambda: httpx.Client(transport=httpx.MockTransport(handler))
+        
+        with mock.patch('fileconverter.storage_backends.time.sleep'):
+            name = storage._save('converted/video.mp4', ContentFile(b'0123456789'))
+        
+        self.assertEqual(name, 'converted/video.mp4')
+        self.assertEqual(bytes(received), b'0123456789')
+        self.assertEqual(failures['patch'], 0)
+        storage.client.storage.from_.return_value.upload.assert_not_called()
+    
+    @override_settings(
+        SUPABASE_READ_BLOCK_SIZE=1024,
+        SUPABASE_READ_CACHE_BLOCKS=8,
+        SUPABASE_READ_AHEAD_BLOCKS=4,
+    )
+    def test_open_reads_lazily_with_ranges(self):
+        """Test opened files fetch only the blocks that are read"""
+        import httpx
+        from fileconverter.storage_backends import SupabaseStorage
+        
+        data = os.urandom(100 * 1024)
+        sent = []
+        
+        def handler(request):
+            start, end = map(int, request.headers['Range'][len('bytes='):].split('-'))
+            body = data[start:end + 1]
+            sent.append(len(body))
+            return httpx.Response(206, content=body, headers={
+                'Content-Range': f'bytes {start}-{start + len(body) - 1}/{len(data)}'
+            })
+        
+        with mock.patch('fileconverter.storage_backends.create_client'):
+            storage = SupabaseStorage()
+        storage._http_client = lambda: httpx.Client(transport=httpx.MockTransport(handler))
+        
+        with storage.open('uploads/doc.pdf') as f:
+            self.assertEqual(f.size, len(data))
+            f.seek(-100, os.SEEK_END)
+            self.assertEqual(f.read(), data[-100:])
+            self.assertLessEqual(sum(sent), 2 * 1024)
+            
+            # Sequential reads are served with read-ahead
+            sent.clear()
+            f.seek(0)
+            self.assertEqual(b''.join(iter(lambda: f.read(1000), b'')), data)
+            self.assertLess(len(sent), 100 / 4 + 2)
+
+
+class LoadTestMetricsTestCase(TestCase):
+    """Test cases for the load-test report"""
+    
+    def test_percentiles_and_error_rates(self):
+        """Test latency percentiles, rejections and interval throughput"""
+        from .loadtest import Metrics, parse_mix, percentile
+        
+        self.assertEqual(percentile(list(range(1, 101)), 0.95), 95)
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertIsNone(percentile([], 0.5))
+        
+        metrics = Metrics()
+        for ms in range(1, 101):
+            metrics.record('upload (image)', ms / 1000)
+        metrics.error('upload (image)')
+        metrics.error('upload (image)', rejected=True)
+        metrics.count('ws message')
+        sample = metrics.sample(queue_depth=3)
+        
+        self.assertEqual(sample['queue_depth'], 3)
+        self.assertIn('upload (image)', sample['throughput'])
+        stats = metrics.summary()['operations']['upload (image)']
+        self.assertEqual((stats['count'], stats['errors'], stats['rejected']), (100, 1, 1))
+        self.assertEqual((stats['p50_ms'], stats['p99_ms']), (50, 99))
+        self.assertEqual(metrics.summary()['counters']['ws message']['count'], 1)
         
+        self.assertEqual(parse_mix('image=0.7,pdf=0.3'), {'image': 0.7, 'pdf': 0.3})
+        with self.assertRaises(ValueError):
+            parse_mix('video=1')
 
@@ -0,0 +1,385 @@
+"""
+Strip-wise processing of very large images
+
+TIFF inputs of TILED_MIN_PIXELS or more are never decoded whole. Their
+strips (or rows of tiles) are grouped into bands of about TILED_BAND_BYTES
+of pixels, each band is copied into a small in-memory TIFF that Pillow
+decodes on its own, and the writers below stream the bands out as striped
+TIFF, PNG or PDF. Peak memory is a few bands, whatever the image area.
+"""
+from django.conf import settings
+from io import BytesIO
+from PIL import Image, TiffImagePlugin
+import math
+import struct
+import zlib
+
+import numpy as np
+
+from .cancellation import checkpoint
+
+TILED_FORMATS = ['tiff', 'png', 'pdf']
+
+IMAGE_LENGTH = 257
+ORIENTATION = 274
+STRIP_OFFSETS, ROWS_PER_STRIP, STRIP_BYTE_COUNTS = 273, 278, 279
+PLANAR_CONFIGURATION = 284
+TILE_WIDTH, TILE_LENGTH, TILE_OFFSETS, TILE_BYTE_COUNTS = 322, 323, 324, 325
+# Tags needed to decode pixel data; metadata (EXIF, XMP, ...) is not copied
+DECODE_TAGS = [256, 258, 259, 262, 266, 277, 278, 284, 317, 320, 322, 323,
+               338, 339, 347, 529, 530, 531, 532]
+SHORT, LONG = 3, 4
+# Uncompressed size of one strip in TIFF output
+OUTPUT_STRIP_BYTES = 1024 * 1024
+# Largest PDF page side in points (Acrobat's limit)
+PDF_MAX_PAGE_POINTS = 14400
+
+
+def open_tiff(source):
+    """Open a TIFF without Pillow's decompression-bomb check; nothing is decoded"""
+    return TiffImagePlugin.TiffImageFile(source)
+
+
+def is_large_tiff(source):
+    """
+    Whether an image should go through the strip-wise path
+
+    True for TIFFs of at least TILED_MIN_PIXELS whose pixel data is stored
+    interleaved and needs no EXIF rotation.
+    """
+    try:
+        img = open_tiff(source)
+    except Exception:
+        return False
+    with img:
+        tags = img.tag_v2
+        return (
+            img.size[0] * img.size[1] >= settings.TILED_MIN_PIXELS
+            and tags.get(PLANAR_CONFIGURATION, 1) == 1
+            and tags.get(ORIENTATION, 1) == 1
+            and (STRIP_OFFSETS in tags or TILE_OFFSETS in tags)
+        )
+
+
+class TiffBandReader:
+    """Decode a TIFF band by band"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.prefix = f.read(2)
+        self.endian = '>' if self.prefix == b'MM' else '<'
+        with open_tiff(path) as img:
+            self.size = img.size
+            self.mode = img.mode
+            self.tags = {tag: img.tag_v2[tag] for tag in DECODE_TAGS if tag in img.tag_v2}
+            self.tagtypes = {tag: img.tag_v2.tagtype[tag] for tag in self.tags}
+            self.units = self._units(img.tag_v2)
+
+    def _units(self, tags):
+        """(first row, end row, [(offset, byte count), ...]) of each strip or tile row"""
+        width, height = self.size
+        if TILE_OFFSETS in tags:
+            tile_width, tile_length = tags[TILE_WIDTH], tags[TILE_LENGTH]
+            chunks = list(zip(tags[TILE_OFFSETS], tags[TILE_BYTE_COUNTS]))
+            across = math.ceil(width / tile_width)
+            return [
+                (y, min(height, y + tile_length), chunks[i * across:(i + 1) * across])
+                for i, y in enumerate(range(0, height, tile_length))
+            ]
+        rows = min(tags.get(ROWS_PER_STRIP, height), height)
+        chunks = list(zip(tags[STRIP_OFFSETS], tags[STRIP_BYTE_COUNTS]))
+        return [
+            (y, min(height, y + rows), [chunks[i]])
+            for i, y in enumerate(range(0, height, rows))
+        ]
+
+    def bands(self, band_bytes=None):
+        """Yield (first row, image) for consecutive bands of about ``band_bytes`` pixels"""
+        band_bytes = band_bytes or settings.TILED_BAND_BYTES
+        row_bytes = self.size[0] * Image.getmodebands(self.mode)
+        band_rows = max(1, band_bytes // row_bytes)
+
+        with open(self.path, 'rb') as f:
+            group = []
+            for unit in self.units:
+                group.append(unit)
+                if group[-1][1] - group[0][0] >= band_rows:
+                    yield group[0][0], self._decode(f, group)
+                    group = []
+            if group:
+                yield group[0][0], self._decode(f, group)
+
+    def _decode(self, f, group):
+        """Decode strips or tile rows as a standalone TIFF: header, IFD, then the data"""
+        y0, y1 = group[0][0], group[-1][1]
+        data = []
+        offsets, counts = [], []
+        position = 0
+        for _, _, chunks in group:
+            for offset, count in chunks:
+                f.seek(offset)
+                data.append(f.read(count))
+                offsets.append(position)
+                counts.append(count)
+                position += count
+
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=self.prefix)
+        for tag, value in self.tags.items():
+            ifd.tagtype[tag] = self.tagtypes[tag]
+            ifd[tag] = value
+        tiled = TILE_WIDTH in self.tags
+        values = {
+            IMAGE_LENGTH: y1 - y0,
+            TILE_OFFSETS if tiled else STRIP_OFFSETS: tuple(offsets),
+            TILE_BYTE_COUNTS if tiled else STRIP_BYTE_COUNTS: tuple(counts),
+        }
+        if not tiled:
+            values[ROWS_PER_STRIP] = group[0][1] - group[0][0]
+        for tag, value in values.items():
+            ifd.tagtype[tag] = LONG
+            ifd[tag] = value
+
+        # Pillow rebases strip offsets past the IFD itself; tile offsets
+        # need a second pass once the IFD size is known
+        directory = ifd.tobytes(8)
+        if tiled:
+            ifd[TILE_OFFSETS] = tuple(8 + len(directory) + offset for offset in offsets)
+            directory = ifd.tobytes(8)
+
+        header = self.prefix + struct.pack(self.endian + 'HL', 42, 8)
+        band = open_tiff(BytesIO(header + directory + b''.join(data)))
+        band.load()
+        return band
+
+
+def normalize_band(band, alpha=True):
+    """Convert a decoded band to L, RGB or (if ``alpha``) RGBA"""
+    if band.mode.startswith('I;16'):
+        return Image.fromarray((np.asarray(band) >> 8).astype(np.uint8))
+    if band.mode in ['1', 'I', 'F']:
+        return band.convert('L')
+    if band.mode in ['L', 'RGB'] or (alpha and band.mode == 'RGBA'):
+        return band
+    if band.mode in ['RGBA', 'LA', 'PA'] or 'transparency' in band.info:
+        band = band.convert('RGBA')
+        if alpha:
+            return band
+        background = Image.new('RGB', band.size, (255, 255, 255))
+        background.paste(band, mask=band.getchannel('A'))
+        return background
+    return band.convert('RGB')
+
+
+def horizontal_difference(pixels):
+    """Per-sample difference from the pixel to the left (TIFF predictor 2, PNG Sub)"""
+    diff = pixels.copy()
+    diff[:, 1:] -= pixels[:, :-1]
+    return diff
+
+
+def ifd_bytes(entries, offset):
+    """Little-endian IFD of (tag, SHORT or LONG, values) entries, stored at ``offset``"""
+    head = struct.pack('<H', len(entries))
+    aux = b''
+    aux_offset = offset + 2 + 12 * len(entries) + 4
+    for tag, tagtype, values in sorted(entries):
+        data = struct.pack(f"<{len(values)}{'H' if tagtype == SHORT else 'L'}", *values)
+        if len(data) <= 4:
+            value = data.ljust(4, b'\0')
+        else:
+            value = struct.pack('<L', aux_offset + len(aux))
+            aux += data + b'\0' * (len(data) % 2)
+        head += struct.pack('<HHL', tag, tagtype, len(values)) + value
+    return head + struct.pack('<L', 0) + aux
+
+
+class TiffStripWriter:
+    """Deflate-compressed striped TIFF, written band by band"""
+
+    PHOTOMETRIC = {'L': 1, 'RGB': 2, 'RGBA': 2}
+
+    def __init__(self, path, size, mode, level=6):
+        self.f = open(path, 'wb')
+        self.f.write(b'II*\0\0\0\0\0')
+        self.size, self.mode, self.level = size, mode, level
+        self.samples = len(mode)
+        self.rows_per_strip = max(1, OUTPUT_STRIP_BYTES // (size[0] * self.samples))
+        self.pending = None
+        self.offsets, self.counts = [], []
+
+    def write(self, band):
+        pixels = np.asarray(band)
+        if self.pending is not None:
+            pixels = np.concatenate([self.pending, pixels])
+        whole = len(pixels) - len(pixels) % self.rows_per_strip
+        for start in range(0, whole, self.rows_per_strip):
+            self._write_strip(pixels[start:start + self.rows_per_strip])
+        self.pending = pixels[whole:] if whole < len(pixels) else None
+
+    def _write_strip(self, pixels):
+        data = zlib.compress(horizontal_difference(pixels).tobytes(), self.level)
+        self.offsets.append(self.f.tell())
+        self.counts.append(len(data))
+        self.f.write(data)
+
+    def close(self):
+        if self.pending is not None:
+            self._write_strip(self.pending)
+        if self.f.tell() % 2:
+            self.f.write(b'\0')
+        position = self.f.tell()
+        if position > 0xFFFFFFFF:
+            self.f.close()
+            raise ValueError("TIFF output is larger than 4 GB")
+
+        entries = [
+            (256, LONG, [self.size[0]]), (257, LONG, [self.size[1]]),
+            (258, SHORT, [8] * self.samples), (259, SHORT, [8]),
+            (262, SHORT, [self.PHOTOMETRIC[self.mode]]), (273, LONG, self.offsets),
+            (277, SHORT, [self.samples]), (278, LONG, [self.rows_per_strip]),
+            (279, LONG, self.counts), (284, SHORT, [1]), (317, SHORT, [2]),
+        ]
+        if self.mode == 'RGBA':
+            entries.append((338, SHORT, [2]))  # unassociated alpha
+        self.f.write(ifd_bytes(entries, position))
+        self.f.seek(4)
+        self.f.write(struct.pack('<L', position))
+        self.f.close()
+
+
+class PngStripWriter:
+    """PNG written band by band through a single zlib stream"""
+
+    COLOR_TYPES = {'L': 0, 'RGB': 2, 'RGBA': 6}
+
+    def __init__(self, path, size, mode, level=6):
+        self.f = open(path, 'wb')
+        self.f.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, self.COLOR_TYPES[mode], 0, 0, 0))
+        self.compressor = zlib.compressobj(level)
+
+    def _chunk(self, kind, data):
+        self.f.write(struct.pack('>I', len(data)) + kind + data)
+        self.f.write(struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    def write(self, band):
+        pixels = np.asarray(band)
+        rows = horizontal_difference(pixels).reshape(len(pixels), -1)
+        # Every row starts with its filter type: 1 = Sub
+        filtered = np.hstack([np.ones((len(rows), 1), dtype=np.uint8), rows])
+        data = self.compressor.compress(filtered.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.f.close()
+
+
+class PdfStripWriter:
+    """
+    Single-page PDF with one JPEG image per band, written band by band
+
+    The page is sized like image_to_pdf's (100 dpi), scaled down to fit
+    PDF_MAX_PAGE_POINTS.
+    """
+
+    def __init__(self, path, size, mode, quality=90, jpeg_options=None):
+        self.f = open(path, 'wb')
+        self.f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self.size = size
+        self.quality = quality
+        self.jpeg_options = jpeg_options or {}
+        self.scale = min(72 / 100, PDF_MAX_PAGE_POINTS / max(size))
+        self.object_offsets = []
+        self.images = []
+        self.y = 0
+
+    def _object(self, body, stream=None):
+        self.object_offsets.append(self.f.tell())
+        number = len(self.object_offsets)
+        self.f.write(f'{number} 0 obj\n'.encode() + body)
+        if stream is not None:
+            self.f.write(b'\nstream\n' + stream + b'\nendstream')
+        self.f.write(b'\nendobj\n')
+        return number
+
+    def write(self, band):
+        data = BytesIO()
+        band.save(data, 'JPEG', quality=self.quality, **self.jpeg_options)
+        color_space = '/DeviceGray' if band.mode == 'L' else '/DeviceRGB'
+        number = self._object(
+            f'<< /Type /XObject /Subtype /Image /Width {band.size[0]} /Height {band.size[1]} '
+            f'/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode '
+            f'/Length {data.getbuffer().nbytes} >>'.encode(),
+            data.getvalue()
+        )
+        self.images.append((number, self.y, band.size[1]))
+        self.y += band.size[1]
+
+    def close(self):
+        width, height = (round(v * self.scale, 3) for v in self.size)
+        content = ''.join(
+            f'q {width} 0 0 {round(rows * self.scale, 3)} 0 '
+            f'{round((self.size[1] - y - rows) * self.scale, 3)} cm /Im{number} Do Q\n'
+            for number, y, rows in self.images
+        ).encode()
+        content_number = self._object(f'<< /Length {len(content)} >>'.encode(), content)
+        xobjects = ' '.join(f'/Im{number} {number} 0 R' for number, _, _ in self.images)
+        page = len(self.object_offsets) + 1
+        self._object(
+            f'<< /Type /Page /Parent {page + 1} 0 R /MediaBox [0 0 {width} {height}] '
+            f'/Resources << /XObject << {xobjects} >> >> /Contents {content_number} 0 R >>'.encode()
+        )
+        self._object(f'<< /Type /Pages /Kids [{page} 0 R] /Count 1 >>'.encode())
+        catalog = self._object(f'<< /Type /Catalog /Pages {page + 1} 0 R >>'.encode())
+
+        xref = self.f.tell()
+        self.f.write(f'xref\n0 {len(self.object_offsets) + 1}\n0000000000 65535 f \n'.encode())
+        for offset in self.object_offsets:
+            self.f.write(f'{offset:010d} 00000 n \n'.encode())
+        self.f.write(
+            f'trailer\n<< /Size {len(self.object_offsets) + 1} /Root {catalog} 0 R >>\n'
+            f'startxref\n{xref}\n%%EOF\n'.encode()
+        )
+        self.f.close()
+
+
+def convert_tiled(source_path, output_path, target_format, zlib_level=6, jpeg_quality=90, jpeg_options=None):
+    """Convert a large TIFF to TIFF, PNG or PDF one band at a time"""
+    reader = TiffBandReader(source_path)
+    writer = None
+    try:
+        for _, band in reader.bands():
+            checkpoint()
+            with band:
+                band = normalize_band(band, alpha=target_format != 'pdf')
+                if writer is None:
+                    if target_format == 'pdf':
+                        writer = PdfStripWriter(output_path, reader.size, band.mode, jpeg_quality, jpeg_options)
+                    elif target_format == 'png':
+                        writer = PngStripWriter(output_path, reader.size, band.mode, zlib_level)
+                    else:
+                        writer = TiffStripWriter(output_path, reader.size, band.mode, zlib_level)
+                writer.write(band)
+    finally:
+        if writer is not None:
+            writer.close()
+    return output_path
+
+
+def tiled_thumbnail(source_path, max_size):
+    """Thumbnail of a large TIFF, fitted into max_size, built band by band"""
+    reader = TiffBandReader(source_path)
+    scale = min(1.0, max_size / max(reader.size))
+    width = max(1, round(reader.size[0] * scale))
+    thumbnail = Image.new('RGB', (width, max(1, round(reader.size[1] * scale))), (255, 255, 255))
+    for y, band in reader.bands():
+        with band:
+            top, bottom = round(y * scale), round((y + band.size[1]) * scale)
+            if bottom > top:
+                small = normalize_band(band, alpha=False).resize((width, bottom - top), Image.BILINEAR)
+                thumbnail.paste(small.convert('RGB'), (0, top))
+    return thumbnail
@@ -0,0 +1,89 @@
+"""
+Per-conversion stage timings
+
+Tasks run inside ``recording()``; ``stage(name)`` blocks in the task and
+in the converters add spans to the active recorder and are no-ops
+outside of one. ``attach_timings`` stores the spans on the conversion as
+
+    {"queue": 1.52, "stages": [["probe", 0.001, 0.004], ["decode", 0.02, 0.31], ...]}
+
+i.e. seconds spent queued, then ``[name, start, duration]`` in seconds
+relative to ``started_at``. Spans nest (``convert`` contains ``decode``
+and ``encode``) and tasks on other workers (sharded merges) append to the
+same list.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import time
+
+_recorder = ContextVar('stage_recorder', default=None)
+
+
+class StageRecorder:
+    """Collects [name, start, duration] spans, with starts in epoch seconds"""
+
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def stage(self, name):
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append([name, started, time.perf_counter() - start])
+
+
+@contextmanager
+def recording():
+    """Record stage spans of the enclosed code"""
+    recorder = StageRecorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+def records_stages(func):
+    """Run a (Celery task) function inside ``recording()``"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with recording():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as a stage of the current conversion"""
+    recorder = _recorder.get()
+    if recorder is None:
+        yield
+        return
+    with recorder.stage(name):
+        yield
+
+
+def attach_timings(conversion):
+    """
+    Store the recorded spans on ``conversion.stage_timings`` (not saved)
+
+    Spans already stored by another task for the same run are kept.
+    """
+    recorder = _recorder.get()
+    if recorder is None or not conversion.started_at:
+        return
+    base = conversion.started_at.timestamp()
+    timings = dict(conversion.stage_timings or {})
+    timings['queue'] = round((conversion.started_at - conversion.created_at).total_seconds(), 3)
+    timings['stages'] = list(timings.get('stages', [])) + [
+        [name, round(started - base, 3), round(duration, 3)]
+        for name, started, duration in recorder.spans
+    ]
+    recorder.spans = []
+    conversion.stage_timings = timings
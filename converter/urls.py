@@ -10,9 +10,13 @@ urlpatterns = [
     
     # API endpoints
     path('api/upload/', views.upload_file, name='upload_file'),
+    path('api/check/', views.check_existing_conversion, name='check_existing_conversion'),
+    path('api/status/bulk/', views.bulk_conversion_status, name='bulk_conversion_status'),
     path('api/status/<uuid:conversion_id>/', views.conversion_status, name='conversion_status'),
     path('api/download/<uuid:conversion_id>/', views.download_file, name='download_file'),
     path('api/history/', views.conversion_history, name='conversion_history'),
+    path('api/stats/', views.conversion_stats, name='conversion_stats'),
+    path('api/cancel/<uuid:conversion_id>/', views.cancel_conversion, name='cancel_conversion'),
     path('api/delete/<uuid:conversion_id>/', views.delete_conversion, name='delete_conversion'),
 ]
 
@@ -1,8 +1,16 @@
 """
 Conversion utility functions for different file formats
 """
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from functools import lru_cache
+from io import BytesIO
+import math
 import os
-from PIL import Image
+import shutil
+from xml.sax.saxutils import escape
+from django.conf import settings
+from PIL import Image, ImageOps
 import PyPDF2
 from pdf2docx import Converter as PDFToDocxConverter
 from docx import Document
@@ -17,75 +25,603 @@ except ImportError:
     except ImportError:
         VideoFileClip = None
 
+from .cancellation import ConversionCancelled, checkpoint, in_context, run_process
+from .docxstream import iter_paragraphs
+from .scratch import current_scratch_dir
+from .tiling import TILED_FORMATS, convert_tiled, is_large_tiff, open_tiff, tiled_thumbnail
+from .timing import stage
+
 
 def get_temp_path(source_path, target_format):
-    """Generate temporary output path"""
+    """
+    Generate temporary output path
+    
+    Inside a task this is in the task's scratch directory (see scratch.py),
+    otherwise next to the source.
+    """
     base = os.path.splitext(source_path)[0]
+    scratch_dir = current_scratch_dir()
+    if scratch_dir:
+        base = os.path.join(scratch_dir, os.path.basename(base))
     return f"{base}_converted.{target_format}"
 
 
+@lru_cache(maxsize=None)
+def get_pdf_styles():
+    """reportlab sample stylesheet, built once per process"""
+    from reportlab.lib.styles import getSampleStyleSheet
+    return getSampleStyleSheet()
+
+
+@lru_cache(maxsize=None)
+def get_ffmpeg_binary():
+    """Path of the ffmpeg executable, resolved once per process"""
+    try:
+        from moviepy.config import FFMPEG_BINARY
+        if FFMPEG_BINARY:
+            return FFMPEG_BINARY
+    except ImportError:
+        pass
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return 'ffmpeg'
+
+
+# ==================== EFFORT PROFILES ====================
+# How much CPU encoders spend to make outputs smaller. Quality settings are
+# the same in every profile: ``max`` gives the smallest files, ``fast`` the
+# quickest encodes.
+
+EFFORT_PROFILES = {
+    'fast': {
+        'jpeg': {'optimize': False},
+        'png': {'compress_level': 1},
+        'webp': {'method': 2},
+        'x264_preset': 'veryfast',
+        'pdf_compression': 0,
+    },
+    'balanced': {
+        'jpeg': {'optimize': True},
+        'png': {'compress_level': 6},
+        'webp': {'method': 4},
+        'x264_preset': 'medium',
+        'pdf_compression': 1,
+    },
+    'max': {
+        'jpeg': {'optimize': True, 'progressive': True},
+        'png': {'optimize': True},
+        'webp': {'method': 6},
+        'x264_preset': 'slower',
+        'pdf_compression': 1,
+    },
+}
+
+
+def parse_effort_option(data):
+    """
+    Parse the ``effort`` option shared by every conversion type
+    
+    Returns:
+        dict: {'effort': name} if one was provided, else {}
+    
+    Raises:
+        ValueError: If the profile does not exist
+    """
+    effort = data.get('effort')
+    if effort in (None, ''):
+        return {}
+    if effort not in EFFORT_PROFILES:
+        raise ValueError(f"effort must be one of {', '.join(EFFORT_PROFILES)}")
+    return {'effort': effort}
+
+
+def default_effort(queue=None):
+    """Effort profile for jobs that did not choose one: per queue, else EFFORT_DEFAULT"""
+    return settings.EFFORT_QUEUE_DEFAULTS.get(queue) or settings.EFFORT_DEFAULT
+
+
+def get_effort_profile(options=None):
+    """Encoder parameters of the profile selected in ``options``"""
+    return EFFORT_PROFILES[(options or {}).get('effort') or default_effort()]
+
+
 # ==================== IMAGE CONVERSIONS ====================
 
-def convert_image_format(source_path, target_format):
+def parse_image_options(data):
+    """
+    Parse image pipeline options from request data
+
+    Args:
+        data: Mapping such as request.POST
+
+    Returns:
+        dict: Validated options (only the keys that were provided)
+
+    Raises:
+        ValueError: If an option has an invalid value
+    """
+    options = {}
+
+    for key in ['width', 'height']:
+        value = data.get(key)
+        if value not in (None, ''):
+            try:
+                options[key] = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid {key}: {value}")
+            if options[key] <= 0:
+                raise ValueError(f"{key} must be a positive integer")
+
+    crop = data.get('crop')
+    if crop not in (None, ''):
+        try:
+            box = [int(v) for v in (crop.split(',') if isinstance(crop, str) else crop)]
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid crop box: {crop}")
+        if len(box) != 4 or box[0] < 0 or box[1] < 0 or box[0] >= box[2] or box[1] >= box[3]:
+            raise ValueError("crop must be 'left,top,right,bottom' with left < right and top < bottom")
+        options['crop'] = box
+
+    rotate = data.get('rotate')
+    if rotate not in (None, ''):
+        try:
+            options['rotate'] = float(rotate) % 360
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid rotate: {rotate}")
+
+    quality = data.get('quality')
+    if quality not in (None, ''):
+        try:
+            options['quality'] = int(quality)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid quality: {quality}")
+        if not 1 <= options['quality'] <= 100:
+            raise ValueError("quality must be between 1 and 100")
+
+    for key in ['auto_orient', 'strip_metadata']:
+        value = data.get(key)
+        if value not in (None, ''):
+            options[key] = value if isinstance(value, bool) else str(value).lower() in ['1', 'true', 'yes', 'on']
+
+    return options
+
+
+def _oriented_size(img):
+    """Image size after EXIF orientation is applied"""
+    orientation = img.getexif().get(0x0112, 1)
+    if orientation in [5, 6, 7, 8]:
+        return img.size[1], img.size[0]
+    return img.size
+
+
+def _rotated_size(size, degrees):
+    """Bounding box of an image rotated by the given number of degrees"""
+    radians = math.radians(degrees)
+    cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+    return (size[0] * cos + size[1] * sin, size[0] * sin + size[1] * cos)
+
+
+def _target_scale(size, options):
+    """Scale factor needed to fit an image of ``size`` into the requested box (never > 1)"""
+    scales = []
+    if options.get('width'):
+        scales.append(options['width'] / size[0])
+    if options.get('height'):
+        scales.append(options['height'] / size[1])
+    return min(scales + [1.0])
+
+
+def load_image(source, options=None):
+    """
+    Decode an image and apply the transform pipeline in a single pass
+
+    Operations run in this order: EXIF orientation, crop, resize, rotate.
+    When the result is smaller than the source, JPEG inputs are decoded at a
+    reduced DCT scale (draft mode) and the remaining downscale starts with
+    ``reduce()``, so the full-resolution raster is never materialised.
+
+    Args:
+        source: File path or file-like object
+        options: Pipeline options (see ``parse_image_options``)
+
+    Returns:
+        tuple: (image, save_kwargs) where save_kwargs carries preserved metadata
+    """
+    options = options or {}
+    img = source_image = Image.open(source)
+    auto_orient = options.get('auto_orient', True)
+
+    # Work out how big the decoded raster actually needs to be
+    full_size = _oriented_size(img) if auto_orient else img.size
+    crop = options.get('crop')
+    region = (crop[2] - crop[0], crop[3] - crop[1]) if crop else full_size
+    scale = _target_scale(_rotated_size(region, options.get('rotate', 0)), options)
+
+    raw_width = img.size[0]
+    if scale < 1 and img.format == 'JPEG':
+        img.draft(None, (max(1, math.ceil(img.size[0] * scale)),
+                         max(1, math.ceil(img.size[1] * scale))))
+    # Draft mode shrinks the raster uniformly; crop boxes must follow
+    decoded_ratio = img.size[0] / raw_width
+
+    if auto_orient:
+        img = ImageOps.exif_transpose(img)
+
+    # Capture metadata before any operation replaces the image object
+    save_kwargs = {}
+    if not options.get('strip_metadata', True):
+        for key in ['exif', 'icc_profile']:
+            if img.info.get(key):
+                save_kwargs[key] = img.info[key]
+
+    if crop:
+        box = [round(v * decoded_ratio) for v in crop]
+        box = [min(box[0], img.size[0]), min(box[1], img.size[1]),
+               min(box[2], img.size[0]), min(box[3], img.size[1])]
+        if box[0] >= box[2] or box[1] >= box[3]:
+            raise ValueError("crop box lies outside the image")
+        img = img.crop(box)
+
+    if scale < 1:
+        target = (max(1, round(img.size[0] / decoded_ratio * scale)),
+                  max(1, round(img.size[1] / decoded_ratio * scale)))
+        factor = min(img.size[0] // target[0], img.size[1] // target[1])
+        if factor >= 2:
+            img = img.reduce(factor)
+        if img.size != target:
+            img = img.resize(target, Image.LANCZOS)
+
+    rotate = options.get('rotate', 0)
+    if rotate:
+        transposes = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+        if rotate in transposes:
+            img = img.transpose(transposes[rotate])
+        else:
+            img = img.rotate(rotate, resample=Image.BICUBIC, expand=True)
+
+    if img is not source_image:
+        source_image.close()
+
+    # Decode now rather than lazily inside save(), so decode and encode time
+    # are measured separately
+    img.load()
+
+    return img, save_kwargs
+
+
+def encode_image(img, output, target_format, options=None, save_kwargs=None):
+    """Encode an image to a path or file-like object in the target format"""
+    options = options or {}
+    save_kwargs = save_kwargs or {}
+    profile = get_effort_profile(options)
+    
+    # Handle transparency for formats that don't support it
+    if target_format.lower() in ['jpg', 'jpeg'] and img.mode in ['RGBA', 'LA', 'P']:
+        # Create white background
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+        img = background
+    elif img.mode not in ['RGB', 'RGBA']:
+        img = img.convert('RGB')
+    
+    # Save with optimization
+    if target_format.lower() in ['jpg', 'jpeg']:
+        img.save(output, 'JPEG', quality=options.get('quality', 95), **profile['jpeg'], **save_kwargs)
+    elif target_format.lower() == 'png':
+        img.save(output, 'PNG', **profile['png'], **save_kwargs)
+    elif target_format.lower() == 'webp':
+        img.save(output, 'WEBP', quality=options.get('quality', 90), **profile['webp'], **save_kwargs)
+    else:
+        img.save(output, target_format.upper(), **save_kwargs)
+
+
+def encode_image_pdf(img, output):
+    """Encode an image as a single-page PDF to a path or file-like object"""
+    # Convert to RGB if necessary
+    if img.mode == 'RGBA':
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    img.save(output, 'PDF', resolution=100.0)
+
+
+def use_tiled_path(source_path, target_format, options=None):
+    """Whether a conversion should stream the image in bands (see tiling.py)"""
+    options = options or {}
+    return (
+        target_format.lower() in TILED_FORMATS
+        and not any(options.get(key) for key in ['width', 'height', 'crop', 'rotate'])
+        and is_large_tiff(source_path)
+    )
+
+
+def refuse_large_tiff(source_path):
+    """
+    Stop a conversion that would decode a large TIFF whole
+    
+    Called once use_tiled_path has said no: JPEG, WebP and 'auto' output,
+    and resizing, cropping or rotating, need the whole raster in memory.
+    
+    Raises:
+        ValueError: If the source is a TIFF of TILED_MIN_PIXELS or more
+    """
+    if is_large_tiff(source_path):
+        raise ValueError(
+            f"Images of {settings.TILED_MIN_PIXELS} pixels or more can only be converted "
+            "to TIFF, PNG or PDF, without resizing, cropping or rotating"
+        )
+
+
+def convert_image_tiled(source_path, target_format, options=None):
+    """Convert a gigapixel TIFF band by band; memory is bounded by TILED_BAND_BYTES"""
+    options = options or {}
+    profile = get_effort_profile(options)
+    output_path = get_temp_path(source_path, target_format)
+    
+    with stage('tiled'):
+        convert_tiled(
+            source_path, output_path, target_format.lower(),
+            zlib_level=profile['png'].get('compress_level', 9),
+            jpeg_quality=options.get('quality', 90),
+            jpeg_options=profile['jpeg'],
+        )
+    return output_path
+
+
+def convert_image_format(source_path, target_format, options=None):
     """Convert image from one format to another"""
+    if use_tiled_path(source_path, target_format, options):
+        return convert_image_tiled(source_path, target_format, options)
+    refuse_large_tiff(source_path)
+    
     output_path = get_temp_path(source_path, target_format)
     
-    with Image.open(source_path) as img:
-        # Handle transparency for formats that don't support it
-        if target_format.lower() in ['jpg', 'jpeg'] and img.mode in ['RGBA', 'LA', 'P']:
-            # Create white background
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = background
-        elif img.mode not in ['RGB', 'RGBA']:
-            img = img.convert('RGB')
-        
-        # Save with optimization
-        if target_format.lower() in ['jpg', 'jpeg']:
-            img.save(output_path, 'JPEG', quality=95, optimize=True)
-        elif target_format.lower() == 'png':
-            img.save(output_path, 'PNG', optimize=True)
-        elif target_format.lower() == 'webp':
-            img.save(output_path, 'WEBP', quality=90)
-        else:
-            img.save(output_path, target_format.upper())
+    with stage('decode'):
+        img, save_kwargs = load_image(source_path, options)
+    with img, stage('encode'):
+        encode_image(img, output_path, target_format, options, save_kwargs)
     
     return output_path
 
 
-def image_to_pdf(source_path, target_format='pdf'):
+def image_to_pdf(source_path, target_format='pdf', options=None):
     """Convert image to PDF"""
+    if use_tiled_path(source_path, 'pdf', options):
+        return convert_image_tiled(source_path, 'pdf', options)
+    refuse_large_tiff(source_path)
+    
     output_path = get_temp_path(source_path, 'pdf')
     
-    with Image.open(source_path) as img:
-        # Convert to RGB if necessary
-        if img.mode == 'RGBA':
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[-1])
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        img.save(output_path, 'PDF', resolution=100.0)
+    with stage('decode'):
+        img, _ = load_image(source_path, options)
+    with img, stage('encode'):
+        encode_image_pdf(img, output_path)
     
     return output_path
 
 
-def pdf_to_image(source_path, target_format='jpg', page_number=1):
+# ==================== AUTO FORMAT ====================
+# target 'auto': encode AUTO_FORMAT_CANDIDATES in parallel from one decode
+# and keep the smallest whose SSIM against the source is good enough.
+
+def _box_mean(x, window):
+    """Mean over every window x window block (valid positions only), via an integral image"""
+    s = np.pad(x, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return (s[window:, window:] - s[:-window, window:]
+            - s[window:, :-window] + s[:-window, :-window]) / (window * window)
+
+
+def structural_similarity(a, b, window=8):
+    """
+    Mean SSIM of two equally sized 8-bit grayscale images
+
+    Uses uniform (box) windows instead of the Gaussian of the original
+    paper, so every local statistic is a vectorised integral-image lookup.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    window = max(1, min(window, *a.shape))
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+
+    mu_a, mu_b = _box_mean(a, window), _box_mean(b, window)
+    var_a = _box_mean(a * a, window) - mu_a * mu_a
+    var_b = _box_mean(b * b, window) - mu_b * mu_b
+    cov = _box_mean(a * b, window) - mu_a * mu_b
+
+    ssim = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / (
+        (mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2)
+    )
+    return float(ssim.mean())
+
+
+def _has_alpha(img):
+    """Whether any pixel of the image is not fully opaque"""
+    if img.mode in ['RGBA', 'LA'] or 'transparency' in img.info:
+        return img.convert('RGBA').getchannel('A').getextrema()[0] < 255
+    return False
+
+
+def _comparison_planes(img):
+    """
+    Planes an auto-format candidate is scored on, for an image flattened on white
+    
+    Y, Cb and Cr fitted into AUTO_FORMAT_SSIM_SIZE, so chroma damage counts,
+    plus a centre crop of Y of that size at full resolution, where
+    artifacts the downscale would smooth away are still visible.
+    """
+    flat = _flatten_for_jpeg(img)
+    side = settings.AUTO_FORMAT_SSIM_SIZE
+    left = max(0, (flat.width - side) // 2)
+    top = max(0, (flat.height - side) // 2)
+    # Crop and shrink before converting, so no full-size YCbCr copy is made
+    crop = flat.crop((left, top, left + min(side, flat.width), top + min(side, flat.height))).convert('L')
+    scale = min(1, side / max(flat.size))
+    size = (max(1, round(flat.width * scale)), max(1, round(flat.height * scale)))
+    small = flat.resize(size, Image.BILINEAR) if scale < 1 else flat
+    return [*small.convert('YCbCr').split(), crop]
+
+
+def _shared_view(img):
+    """
+    A new Image object over the same pixels as ``img``, without copying them
+    
+    save() keeps its encoder settings on the Image object, so threads
+    encoding one image each save their own view instead.
+    """
+    return img._new(img.im)
+
+
+def encode_candidate(img, candidate, save_kwargs=None, effort=None):
+    """
+    Encode one auto-format candidate such as 'webp:80', 'jpg:65', 'png8' or 'png'
+
+    Returns:
+        tuple: (file extension, BytesIO)
+    """
+    save_kwargs = save_kwargs or {}
+    name, _, quality = candidate.partition(':')
+    options = {'effort': effort} if effort else {}
+    output = BytesIO()
+    if name == 'png8':
+        # 256-colour palette, alpha kept in the PNG tRNS chunk
+        mode = 'RGBA' if img.mode in ['RGBA', 'LA', 'P'] else 'RGB'
+        (img if img.mode == mode else img.convert(mode)).quantize(256, method=Image.Quantize.FASTOCTREE).save(
+            output, 'PNG', **get_effort_profile(options)['png'], **save_kwargs
+        )
+        return 'png', output
+    if quality:
+        options['quality'] = int(quality)
+    encode_image(_shared_view(img), output, name, options, save_kwargs)
+    return name, output
+
+
+def choose_auto_format(img, save_kwargs=None, effort=None):
+    """
+    Smallest candidate encoding that meets AUTO_FORMAT_MIN_SSIM
+
+    Candidates are encoded and scored AUTO_FORMAT_WORKERS at a time (Pillow's
+    codecs release the GIL), all from one RGB/RGBA image converted up front.
+    A candidate's score is its lowest SSIM over the planes of
+    _comparison_planes. If none meets the threshold, the most similar one
+    wins.
+
+    Returns:
+        tuple: (file extension, BytesIO)
+    """
+    candidates = settings.AUTO_FORMAT_CANDIDATES
+    if _has_alpha(img):
+        candidates = [c for c in candidates if c.partition(':')[0] not in ['jpg', 'jpeg']]
+    if img.mode not in ['RGB', 'RGBA']:
+        # Convert once here rather than in every encode_image call
+        img = img.convert('RGBA' if _has_alpha(img) else 'RGB')
+    img.load()
+    reference = _comparison_planes(img)
+
+    def score(candidate):
+        ext, output = encode_candidate(img, candidate, save_kwargs, effort)
+        with Image.open(output) as encoded:
+            planes = _comparison_planes(encoded)
+        output.seek(0)
+        ssim = min(structural_similarity(a, b) for a, b in zip(reference, planes))
+        return ssim, ext, output
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(candidates), settings.AUTO_FORMAT_WORKERS))) as executor:
+        results = list(executor.map(score, candidates))
+
+    passing = [r for r in results if r[0] >= settings.AUTO_FORMAT_MIN_SSIM]
+    if passing:
+        _, ext, output = min(passing, key=lambda r: r[2].getbuffer().nbytes)
+    else:
+        _, ext, output = max(results, key=lambda r: (r[0], -r[2].getbuffer().nbytes))
+    return ext, output
+
+
+def convert_image_auto(source_path, target_format='auto', options=None):
+    """Convert an image to the smallest acceptable web format (see choose_auto_format)"""
+    refuse_large_tiff(source_path)
+    with stage('decode'):
+        img, save_kwargs = load_image(source_path, options)
+    with img, stage('encode'):
+        ext, output = choose_auto_format(img, save_kwargs, (options or {}).get('effort'))
+    
+    output_path = get_temp_path(source_path, ext)
+    with open(output_path, 'wb') as f:
+        f.write(output.getbuffer())
+    return output_path
+
+
+def output_format(output):
+    """File extension of a converter's output: a path, or a BytesIO carrying a ``name``"""
+    return os.path.splitext(getattr(output, 'name', output))[1][1:].lower()
+
+
+# ==================== IN-MEMORY CONVERSIONS ====================
+# Buffer counterparts of the converters above, used for small inputs:
+# they decode from and encode into memory, so no temp file is written.
+
+def convert_image_buffer(source, target_format, options=None):
+    """In-memory convert_image_format: file-like in, BytesIO out"""
+    output = BytesIO()
+    with stage('decode'):
+        img, save_kwargs = load_image(source, options)
+    with img, stage('encode'):
+        encode_image(img, output, target_format, options, save_kwargs)
+    output.seek(0)
+    return output
+
+
+def image_to_pdf_buffer(source, target_format='pdf', options=None):
+    """In-memory image_to_pdf: file-like in, BytesIO out"""
+    output = BytesIO()
+    with stage('decode'):
+        img, _ = load_image(source, options)
+    with img, stage('encode'):
+        encode_image_pdf(img, output)
+    output.seek(0)
+    return output
+
+
+def convert_image_auto_buffer(source, target_format='auto', options=None):
+    """In-memory convert_image_auto; the chosen format is in the result's ``name``"""
+    with stage('decode'):
+        img, save_kwargs = load_image(source, options)
+    with img, stage('encode'):
+        ext, output = choose_auto_format(img, save_kwargs, (options or {}).get('effort'))
+    output.name = f'converted.{ext}'
+    return output
+
+
+BUFFER_CONVERTERS = {
+    convert_image_format: convert_image_buffer,
+    image_to_pdf: image_to_pdf_buffer,
+    convert_image_auto: convert_image_auto_buffer,
+}
+
+
+def get_buffer_converter(source_format, target_format):
+    """In-memory converter for a format pair, or None if it needs the file path"""
+    return BUFFER_CONVERTERS.get(get_converter(source_format, target_format))
+
+
+def pdf_to_image(source_path, target_format='jpg', page_number=1, options=None):
     """Convert PDF page to image using OpenCV and PyPDF2"""
     output_path = get_temp_path(source_path, target_format)
     
     try:
         # Try using pdf2image if available
         from pdf2image import convert_from_path
-        images = convert_from_path(source_path, first_page=page_number, last_page=page_number, dpi=200)
+        with stage('render'):
+            images = convert_from_path(source_path, first_page=page_number, last_page=page_number, dpi=200)
         if images:
-            if target_format.lower() in ['jpg', 'jpeg']:
-                images[0].save(output_path, 'JPEG', quality=95)
-            else:
-                images[0].save(output_path, target_format.upper())
+            with images[0] as img, stage('encode'):
+                encode_image(img, output_path, target_format, options)
             return output_path
     except ImportError:
         pass
@@ -113,46 +649,160 @@ def pdf_to_image(source_path, target_format='jpg', page_number=1):
 
 # ==================== DOCUMENT CONVERSIONS ====================
 
-def pdf_to_docx(source_path, target_format='docx'):
+def pdf_to_docx(source_path, target_format='docx', options=None):
     """Convert PDF to DOCX"""
     output_path = get_temp_path(source_path, 'docx')
     
+    return pdf_pages_to_docx(source_path, output_path)
+
+
+def pdf_pages_to_docx(source_path, output_path, start=0, end=None):
+    """Convert the page range [start, end) of a PDF to DOCX"""
     cv = PDFToDocxConverter(source_path)
-    cv.convert(output_path, start=0, end=None)
-    cv.close()
+    try:
+        with stage('pdf2docx'):
+            cv.convert(output_path, start=start, end=end)
+    finally:
+        cv.close()
+    
+    return output_path
+
+
+def get_pdf_page_count(source_path):
+    """Number of pages in a PDF"""
+    with open(source_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def plan_page_shards(page_count, pages_per_shard):
+    """Split [0, page_count) into consecutive (start, end) page ranges"""
+    return [
+        (start, min(start + pages_per_shard, page_count))
+        for start in range(0, page_count, pages_per_shard)
+    ]
+
+
+def merge_docx_files(part_files, output_path):
+    """
+    Concatenate DOCX documents in order
+    
+    Each part keeps its own section properties (page size, margins) and
+    starts on a new page. Embedded images and external hyperlinks are
+    re-related to the merged document.
+    
+    Args:
+        part_files: Paths or file-like objects, in document order
+        output_path: Where to write the merged DOCX
+    """
+    from docx.opc.constants import RELATIONSHIP_TYPE as RT
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    
+    merged = Document(part_files[0])
+    body = merged.element.body
+    
+    for part_file in part_files[1:]:
+        part = Document(part_file)
+        final_sect_pr = body.find(qn('w:sectPr'))
+        
+        # Close the current last section with a paragraph-level sectPr
+        paragraph = OxmlElement('w:p')
+        paragraph_pr = OxmlElement('w:pPr')
+        paragraph_pr.append(deepcopy(final_sect_pr))
+        paragraph.append(paragraph_pr)
+        final_sect_pr.addprevious(paragraph)
+        
+        for element in part.element.body.iterchildren():
+            if element.tag == qn('w:sectPr'):
+                continue
+            element = deepcopy(element)
+            
+            for node in element.iter():
+                for attr in [qn('r:embed'), qn('r:id'), qn('r:link')]:
+                    rel_id = node.get(attr)
+                    if not rel_id or rel_id not in part.part.rels:
+                        continue
+                    rel = part.part.rels[rel_id]
+                    if rel.is_external:
+                        node.set(attr, merged.part.relate_to(rel.target_ref, rel.reltype, is_external=True))
+                    elif rel.reltype == RT.IMAGE:
+                        new_rel_id, _ = merged.part.get_or_add_image(BytesIO(rel.target_part.blob))
+                        node.set(attr, new_rel_id)
+            
+            final_sect_pr.addprevious(element)
+        
+        # The part's own final section becomes the document's final section
+        part_sect_pr = part.element.body.find(qn('w:sectPr'))
+        if part_sect_pr is not None:
+            body.replace(final_sect_pr, deepcopy(part_sect_pr))
     
+    merged.save(output_path)
     return output_path
 
 
-def docx_to_pdf(source_path, target_format='pdf'):
-    """Convert DOCX to PDF using reportlab"""
+class LazyFlowables(list):
+    """
+    Flowable list that reportlab's build() fills from an iterator as it goes
+    
+    build() only looks at the head of the list, so a few dozen flowables
+    are held at a time instead of the whole story.
+    """
+    
+    def __init__(self, flowables, lookahead=64):
+        super().__init__()
+        self._source = iter(flowables)
+        self._lookahead = lookahead
+    
+    def _fill(self):
+        while self._source is not None and super().__len__() < self._lookahead:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+    
+    def __len__(self):
+        self._fill()
+        return super().__len__()
+    
+    def __getitem__(self, index):
+        self._fill()
+        return super().__getitem__(index)
+
+
+def docx_to_pdf(source_path, target_format='pdf', options=None):
+    """
+    Convert DOCX to PDF using reportlab
+    
+    Paragraphs are streamed from the document XML (see docxstream.py) and
+    laid out as they are read.
+    """
     output_path = get_temp_path(source_path, 'pdf')
     
     from reportlab.lib.pagesizes import letter
-    from reportlab.lib.styles import getSampleStyleSheet
     from reportlab.lib.units import inch
     from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
     
-    # Read DOCX
-    doc = Document(source_path)
-    
     # Create PDF
-    pdf = SimpleDocTemplate(output_path, pagesize=letter)
-    styles = getSampleStyleSheet()
-    story = []
+    pdf = SimpleDocTemplate(
+        output_path, pagesize=letter,
+        pageCompression=get_effort_profile(options)['pdf_compression']
+    )
+    styles = get_pdf_styles()
     
-    for paragraph in doc.paragraphs:
-        if paragraph.text.strip():
-            p = Paragraph(paragraph.text, styles['Normal'])
-            story.append(p)
-            story.append(Spacer(1, 0.2 * inch))
+    def story():
+        for text in iter_paragraphs(source_path):
+            checkpoint()
+            if text.strip():
+                yield Paragraph(escape(text), styles['Normal'])
+                yield Spacer(1, 0.2 * inch)
     
-    pdf.build(story)
+    with stage('render'):
+        pdf.build(LazyFlowables(story()))
     
     return output_path
 
 
-def pdf_to_txt(source_path, target_format='txt'):
+def pdf_to_txt(source_path, target_format='txt', options=None):
     """Convert PDF to TXT"""
     output_path = get_temp_path(source_path, 'txt')
     
@@ -169,33 +819,36 @@ def pdf_to_txt(source_path, target_format='txt'):
     return output_path
 
 
-def docx_to_txt(source_path, target_format='txt'):
-    """Convert DOCX to TXT"""
+def docx_to_txt(source_path, target_format='txt', options=None):
+    """Convert DOCX to TXT, streaming paragraphs from the document XML"""
     output_path = get_temp_path(source_path, 'txt')
     
-    doc = Document(source_path)
-    text_content = [paragraph.text for paragraph in doc.paragraphs]
-    
-    with open(output_path, 'w', encoding='utf-8') as file:
-        file.write('\n'.join(text_content))
+    with stage('parse'), open(output_path, 'w', encoding='utf-8') as file:
+        for index, text in enumerate(iter_paragraphs(source_path)):
+            checkpoint()
+            if index:
+                file.write('\n')
+            file.write(text)
     
     return output_path
 
 
-def txt_to_pdf(source_path, target_format='pdf'):
+def txt_to_pdf(source_path, target_format='pdf', options=None):
     """Convert TXT to PDF"""
     output_path = get_temp_path(source_path, 'pdf')
     
     from reportlab.lib.pagesizes import letter
-    from reportlab.lib.styles import getSampleStyleSheet
     from reportlab.lib.units import inch
     from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
     
     with open(source_path, 'r', encoding='utf-8') as file:
         lines = file.readlines()
     
-    pdf = SimpleDocTemplate(output_path, pagesize=letter)
-    styles = getSampleStyleSheet()
+    pdf = SimpleDocTemplate(
+        output_path, pagesize=letter,
+        pageCompression=get_effort_profile(options)['pdf_compression']
+    )
+    styles = get_pdf_styles()
     story = []
     
     for line in lines:
@@ -203,14 +856,26 @@ def txt_to_pdf(source_path, target_format='pdf'):
             p = Paragraph(line.strip(), styles['Normal'])
             story.append(p)
     
-    pdf.build(story)
+    with stage('render'):
+        pdf.build(story)
     
     return output_path
 
 
 # ==================== VIDEO CONVERSIONS ====================
 
-def video_to_gif(source_path, target_format='gif', max_duration=10, max_width=480):
+def cancellable_bar_logger():
+    """MoviePy's default progress bar logger, with a cancellation checkpoint per frame"""
+    from proglog import TqdmProgressBarLogger  # installed with moviepy
+    
+    class CancellableBarLogger(TqdmProgressBarLogger):
+        def callback(self, **changes):
+            checkpoint()
+    
+    return CancellableBarLogger()
+
+
+def video_to_gif(source_path, target_format='gif', max_duration=10, max_width=480, options=None):
     """Convert video to GIF"""
     if VideoFileClip is None:
         raise ImportError("moviepy is required for video conversion. Please install it: pip install moviepy")
@@ -228,34 +893,317 @@ def video_to_gif(source_path, target_format='gif', max_duration=10, max_width=48
         clip = clip.resize(width=max_width)
     
     # Write GIF with optimized settings
-    clip.write_gif(output_path, fps=10, program='ffmpeg', opt='nq')
+    clip.write_gif(output_path, fps=10, program='ffmpeg', opt='nq', logger=cancellable_bar_logger())
     clip.close()
     
     return output_path
 
 
-def convert_video_format(source_path, target_format):
+# ffmpeg encoder arguments per target container, matching the MoviePy path
+VIDEO_CODEC_ARGS = {
+    'mp4': (['-c:v', 'libx264', '-pix_fmt', 'yuv420p'], ['-c:a', 'aac']),
+    'avi': (['-c:v', 'png'], []),
+}
+
+
+def video_codec_args(target_format, options=None):
+    """VIDEO_CODEC_ARGS of a container, with the x264 preset of the effort profile"""
+    video_args, audio_args = VIDEO_CODEC_ARGS[target_format]
+    if 'libx264' in video_args:
+        video_args = video_args + ['-preset', get_effort_profile(options)['x264_preset']]
+    return video_args, audio_args
+
+
+def parse_video_options(data):
+    """
+    Parse video options from request data
+    
+    Returns:
+        dict: Validated options (only the keys that were provided)
+    """
+    options = {}
+    value = data.get('segment_parallel')
+    if value not in (None, ''):
+        options['segment_parallel'] = value if isinstance(value, bool) else str(value).lower() in ['1', 'true', 'yes', 'on']
+    return options
+
+
+def run_ffmpeg(args):
+    """Run ffmpeg with the given arguments, raising on failure; cancelling the conversion kills it"""
+    result = run_process(
+        [get_ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error'] + list(args)
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+
+
+def probe_video_duration(source_path):
+    """Duration of a video in seconds, read from the container header"""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    return ffmpeg_parse_infos(source_path).get('duration') or 0
+
+
+def convert_video_segmented(source_path, target_format, output_path, options=None):
+    """
+    Transcode a video by splitting it at keyframes and encoding segments in parallel
+    
+    The video stream is cut into VIDEO_SEGMENT_SECONDS pieces without
+    re-encoding. Each piece runs through its own ffmpeg process, and the
+    pieces are joined with the concat demuxer (stream copy). Audio is
+    encoded once over the whole file and muxed in at the end, so segment
+    boundaries cannot cause audio gaps.
+    
+    Raises:
+        RuntimeError: If the input cannot be segmented safely
+    """
+    video_args, audio_args = video_codec_args(target_format, options)
+    segment_dir = get_temp_path(source_path, 'segments')
+    os.makedirs(segment_dir, exist_ok=True)
+    
+    try:
+        with stage('split'):
+            run_ffmpeg([
+                '-i', source_path, '-map', '0:v:0', '-c', 'copy',
+                '-f', 'segment', '-segment_time', str(settings.VIDEO_SEGMENT_SECONDS),
+                '-reset_timestamps', '1', os.path.join(segment_dir, 'in_%04d.mkv'),
+            ])
+        segments = sorted(f for f in os.listdir(segment_dir) if f.startswith('in_'))
+        if len(segments) < 2:
+            raise RuntimeError("input could not be split at keyframes")
+        
+        workers = settings.VIDEO_SEGMENT_WORKERS or os.cpu_count() or 1
+        threads = str(max(1, (os.cpu_count() or 1) // workers))
+        
+        def encode(segment):
+            encoded = os.path.join(segment_dir, segment.replace('in_', 'out_').replace('.mkv', f'.{target_format}'))
+            run_ffmpeg(['-i', os.path.join(segment_dir, segment), '-an', '-threads', threads] + video_args + [encoded])
+            return encoded
+        
+        with stage('encode_segments'), ThreadPoolExecutor(max_workers=workers) as executor:
+            encoded_segments = list(executor.map(in_context(encode), segments))
+        
+        list_path = os.path.join(segment_dir, 'segments.txt')
+        with open(list_path, 'w') as f:
+            for encoded in encoded_segments:
+                f.write(f"file '{encoded}'\n")
+        
+        video_path = os.path.join(segment_dir, f'video.{target_format}')
+        with stage('concat'):
+            run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', video_path])
+        
+        # Mux the concatenated video with audio encoded in a single pass
+        with stage('mux_audio'):
+            run_ffmpeg([
+                '-i', video_path, '-i', source_path,
+                '-map', '0:v:0', '-map', '1:a?', '-c:v', 'copy',
+            ] + audio_args + [output_path])
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+    
+    return output_path
+
+
+def convert_video_format(source_path, target_format, options=None):
     """Convert video from one format to another"""
+    options = options or {}
+    output_path = get_temp_path(source_path, target_format)
+    
+    # Long videos are transcoded segment-parallel unless the client opted out
+    segment_parallel = options.get('segment_parallel')
+    if segment_parallel is not False and target_format in VIDEO_CODEC_ARGS:
+        try:
+            if segment_parallel or probe_video_duration(source_path) >= settings.VIDEO_SEGMENT_MIN_DURATION:
+                return convert_video_segmented(source_path, target_format, output_path, options)
+        except ConversionCancelled:
+            raise
+        except Exception as e:
+            # Fall back to a single-pass encode
+            print(f"Segmented transcoding unavailable for {source_path}: {e}")
+    
     if VideoFileClip is None:
         raise ImportError("moviepy is required for video conversion. Please install it: pip install moviepy")
     
-    output_path = get_temp_path(source_path, target_format)
-    
     clip = VideoFileClip(source_path)
     
     # Write with appropriate codec
-    if target_format == 'mp4':
-        clip.write_videofile(output_path, codec='libx264', audio_codec='aac')
-    elif target_format == 'avi':
-        clip.write_videofile(output_path, codec='png')
-    else:
-        clip.write_videofile(output_path)
+    with stage('transcode'):
+        if target_format == 'mp4':
+            clip.write_videofile(
+                output_path, codec='libx264', audio_codec='aac',
+                preset=get_effort_profile(options)['x264_preset'], logger=cancellable_bar_logger()
+            )
+        elif target_format == 'avi':
+            clip.write_videofile(output_path, codec='png', logger=cancellable_bar_logger())
+        else:
+            clip.write_videofile(output_path, logger=cancellable_bar_logger())
     
     clip.close()
     
     return output_path
 
 
+# ==================== PROBING ====================
+
+def probe_media_info(source, source_format):
+    """
+    Cheap, header-only probe of the properties that drive conversion cost
+    
+    Args:
+        source: File path or file-like object (videos need a path)
+        source_format: Source file extension
+    
+    Returns:
+        dict: Any of width/height (images), pages (PDF), duration (video)
+    """
+    source_format = source_format.lower()
+    try:
+        if source_format in settings.SUPPORTED_IMAGE_FORMATS:
+            # TIFFs may be gigapixel: skip the decompression-bomb check
+            with (open_tiff(source) if source_format == 'tiff' else Image.open(source)) as img:
+                return {'width': img.size[0], 'height': img.size[1]}
+        if source_format == 'pdf':
+            return {'pages': len(PyPDF2.PdfReader(source).pages)}
+        if source_format in settings.SUPPORTED_VIDEO_FORMATS and isinstance(source, str):
+            return {'duration': probe_video_duration(source)}
+    except Exception as e:
+        print(f"Could not probe {source_format} file: {e}")
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+    return {}
+
+
+# ==================== PREVIEWS ====================
+
+def _flatten_for_jpeg(img):
+    """Convert an image to RGB on a white background"""
+    if img.mode in ['RGBA', 'LA', 'P']:
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    return img.convert('RGB') if img.mode != 'RGB' else img
+
+
+def render_pdf_page(source, max_size, page_number=0):
+    """Render one PDF page (path or file-like) so that it fits within max_size x max_size"""
+    import fitz
+    
+    if hasattr(source, 'read'):
+        source.seek(0)
+        doc = fitz.open(stream=source.read(), filetype='pdf')
+    else:
+        doc = fitz.open(source)
+    with doc:
+        page = doc[page_number]
+        zoom = max_size / max(page.rect.width, page.rect.height)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+
+def video_contact_sheet(source_path, max_size, frames=4):
+    """
+    Contact sheet of frames sampled across a video
+    
+    Frames are fetched by seeking, so only the GOPs around each sample
+    point are decoded.
+    """
+    capture = cv2.VideoCapture(source_path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25
+        duration_ms = capture.get(cv2.CAP_PROP_FRAME_COUNT) / fps * 1000
+        thumbnails = []
+        
+        for index in range(frames):
+            capture.set(cv2.CAP_PROP_POS_MSEC, duration_ms * (index + 0.5) / frames)
+            ok, frame = capture.read()
+            if not ok:
+                continue
+            thumb = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            thumb.thumbnail((max_size // 2, max_size // 2))
+            thumbnails.append(thumb)
+    finally:
+        capture.release()
+    
+    if not thumbnails:
+        return None
+    if len(thumbnails) == 1:
+        return thumbnails[0]
+    
+    # 2-column grid
+    cell_w = max(t.size[0] for t in thumbnails)
+    cell_h = max(t.size[1] for t in thumbnails)
+    rows = (len(thumbnails) + 1) // 2
+    sheet = Image.new('RGB', (cell_w * 2, cell_h * rows), (0, 0, 0))
+    for index, thumb in enumerate(thumbnails):
+        sheet.paste(thumb, ((index % 2) * cell_w, (index // 2) * cell_h))
+    return sheet
+
+
+def generate_preview(source_path, output_path, source_format, target_format):
+    """
+    Render a small JPEG preview of a conversion
+    
+    Uses the cheapest renderable input: the converted image, the first
+    page of a PDF (output or source), a seek-sampled contact sheet for
+    videos, or the source image.
+    
+    Returns:
+        str: Path of the preview, or None if nothing can be previewed
+    """
+    max_size = settings.PREVIEW_MAX_SIZE
+    source_format = source_format.lower()
+    target_format = target_format.lower()
+    img = None
+    
+    if source_format == 'tiff' and is_large_tiff(source_path):
+        img = tiled_thumbnail(source_path, max_size)
+    elif output_path and target_format in settings.SUPPORTED_IMAGE_FORMATS:
+        img, _ = load_image(output_path, {'width': max_size, 'height': max_size})
+    elif output_path and target_format == 'pdf':
+        img = render_pdf_page(output_path, max_size)
+    elif source_format == 'pdf':
+        img = render_pdf_page(source_path, max_size)
+    elif source_format in settings.SUPPORTED_VIDEO_FORMATS:
+        img = video_contact_sheet(source_path, max_size)
+    elif source_format in settings.SUPPORTED_IMAGE_FORMATS:
+        img, _ = load_image(source_path, {'width': max_size, 'height': max_size})
+    
+    if img is None:
+        return None
+    
+    preview_path = get_temp_path(source_path, 'preview.jpg')
+    with img:
+        _flatten_for_jpeg(img).save(preview_path, 'JPEG', quality=80)
+    return preview_path
+
+
+def generate_preview_buffer(output, target_format):
+    """
+    In-memory generate_preview for buffer conversions
+    
+    Returns:
+        BytesIO: JPEG preview of the converted output, or None
+    """
+    max_size = settings.PREVIEW_MAX_SIZE
+    target_format = target_format.lower()
+    
+    output.seek(0)
+    if target_format in settings.SUPPORTED_IMAGE_FORMATS:
+        img, _ = load_image(output, {'width': max_size, 'height': max_size})
+    elif target_format == 'pdf':
+        img = render_pdf_page(output, max_size)
+    else:
+        return None
+    output.seek(0)
+    
+    preview = BytesIO()
+    with img:
+        _flatten_for_jpeg(img).save(preview, 'JPEG', quality=80)
+    preview.seek(0)
+    return preview
+
+
 # ==================== CONVERSION ROUTER ====================
 
 CONVERSION_MAP = {
@@ -286,7 +1234,15 @@ CONVERSION_MAP = {
     ('webp', 'pdf'): image_to_pdf,
     ('tiff', 'jpg'): convert_image_format,
     ('tiff', 'png'): convert_image_format,
+    ('tiff', 'tiff'): convert_image_format,
     ('tiff', 'pdf'): image_to_pdf,
+    ('jpg', 'auto'): convert_image_auto,
+    ('jpeg', 'auto'): convert_image_auto,
+    ('png', 'auto'): convert_image_auto,
+    ('gif', 'auto'): convert_image_auto,
+    ('bmp', 'auto'): convert_image_auto,
+    ('webp', 'auto'): convert_image_auto,
+    ('tiff', 'auto'): convert_image_auto,
     
     # Document conversions
     ('pdf', 'docx'): pdf_to_docx,
@@ -1,16 +1,30 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse, FileResponse, Http404
+from django.http import JsonResponse, FileResponse, StreamingHttpResponse, Http404, HttpResponseNotModified
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
 from django.core.files.storage import default_storage
 from django.utils import timezone
+from django.utils.http import content_disposition_header, parse_etags
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from datetime import timedelta
+import hashlib
+import mimetypes
 import os
 import json
+import uuid
 
-from .models import FileConversion
+from .admission import AdmissionRejected, check_capacity, consume_upload_token, get_client_id
+from .decorators import async_csrf_exempt, async_require_http_methods
+from .models import ConversionDailyRollup, FileConversion, BATCH_ID_RE, session_digest
 from .forms import FileUploadForm
-from .tasks import convert_file_task
+from .progress import revoke_conversion, send_progress_update
+from .tasks import enqueue_conversion
+from .estimator import aget_eta_model, estimate_conversion, predicted_finish, remaining_seconds
+from .reuse import CONTENT_HASH_RE, clone_conversion, find_reusable, hash_upload, release_files
+from .rollups import get_totals
+from .utils import parse_effort_option, parse_image_options, parse_video_options, probe_media_info
 
 
 def index(request):
@@ -31,11 +45,74 @@ def convert_file(request, conversion_type):
     return render(request, 'converter/convert.html', context)
 
 
-@csrf_exempt
-@require_http_methods(["POST"])
-def upload_file(request):
+async def aget_conversion_or_404(conversion_id):
+    """Async equivalent of get_object_or_404 for FileConversion"""
+    try:
+        return await FileConversion.objects.aget(id=conversion_id)
+    except FileConversion.DoesNotExist:
+        raise Http404("No FileConversion matches the given query.")
+
+
+async def aiter_file(file, chunk_size=FileResponse.block_size):
+    """
+    Stream a file as an async iterator
+    
+    Each read runs in the thread pool, so no thread is held for the
+    whole download. Django 4.2 consumes sync iterators into memory
+    before serving them from an async view.
+    """
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+def too_many_requests(rejection):
+    """429 response for a refused upload"""
+    response = JsonResponse({
+        'success': False,
+        'error': str(rejection),
+        'retry_after': rejection.retry_after
+    }, status=429)
+    response['Retry-After'] = str(rejection.retry_after)
+    return response
+
+
+def get_session_hash(request):
+    """
+    session_digest of the request's session, starting a session if there is none
+    
+    Anonymous uploads are tied to their session, so a new session is saved
+    and its cookie sent with the response.
+    """
+    if not request.session.session_key:
+        request.session.save()
+        request.session.modified = True
+    return session_digest(request.session.session_key)
+
+
+@async_csrf_exempt
+@async_require_http_methods(["POST"])
+async def upload_file(request):
     """Handle file upload and start conversion"""
     try:
+        user = await sync_to_async(
+            lambda: request.user if request.user.is_authenticated else None
+        )()
+        
+        # Per-client token bucket, checked before any parsing work
+        try:
+            await sync_to_async(consume_upload_token)(get_client_id(request, user))
+        except AdmissionRejected as e:
+            return too_many_requests(e)
+        
+        # Parsing the multipart body is blocking work
+        await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
         file = request.FILES.get('file')
         target_format = request.POST.get('target_format')
         conversion_type = request.POST.get('conversion_type')
@@ -67,25 +144,76 @@ def upload_file(request):
                 'error': f'Unsupported file format: {original_format}'
             }, status=400)
         
+        # Optional batch id used to group progress streams
+        batch_id = request.POST.get('batch_id') or None
+        if batch_id and not BATCH_ID_RE.match(batch_id):
+            return JsonResponse({
+                'success': False,
+                'error': 'Invalid batch_id'
+            }, status=400)
+        
+        # Parse conversion options (image pipeline, video segmenting)
+        options = {}
+        try:
+            if conversion_type == 'image':
+                options = parse_image_options(request.POST)
+            elif conversion_type == 'video':
+                options = parse_video_options(request.POST)
+            options.update(parse_effort_option(request.POST))
+        except ValueError as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e)
+            }, status=400)
+        
+        # Refuse new work while the queue is over capacity
+        try:
+            await sync_to_async(check_capacity)(conversion_type)
+        except AdmissionRejected as e:
+            return too_many_requests(e)
+        
+        # Header-only probe (pixels, pages) used for ETA and scheduling
+        media_info = await sync_to_async(probe_media_info, thread_sensitive=False)(file, original_format)
+        
+        # Content hash, so later clients can skip uploading the same bytes
+        content_hash = await sync_to_async(hash_upload, thread_sensitive=False)(file)
+        
+        # Anonymous uploads (and their batch streams) belong to the session
+        session_hash = '' if user else await sync_to_async(get_session_hash)(request)
+        
         # Create conversion record
-        conversion = FileConversion.objects.create(
+        conversion = await FileConversion.objects.acreate(
             original_file=file,
             original_filename=file.name,
             original_format=original_format,
             target_format=target_format.lower(),
+            options=options,
             conversion_type=conversion_type,
             file_size=file.size,
+            content_hash=content_hash,
+            media_info=media_info,
+            batch_id=batch_id,
+            user=user,
+            session_hash=session_hash,
             status='pending'
         )
         
-        # Start async conversion task
-        task = convert_file_task.delay(str(conversion.id))
-        conversion.task_id = task.id
-        conversion.save()
+        # Videos are probed with ffmpeg, which needs a path: in-memory uploads
+        # only have one once stored
+        if not media_info and original_format in settings.SUPPORTED_VIDEO_FORMATS:
+            conversion.media_info = await sync_to_async(probe_media_info, thread_sensitive=False)(
+                conversion.original_file.path, original_format
+            )
+            await conversion.asave(update_fields=['media_info'])
         
+        # Start async conversion task, small jobs first
+        await sync_to_async(enqueue_conversion)(conversion)
+        
+        await aget_eta_model()
         return JsonResponse({
             'success': True,
             'conversion_id': str(conversion.id),
+            'eta_seconds': round(estimate_conversion(conversion), 1),
             'message': 'File uploaded successfully. Conversion started.'
         })
         
@@ -96,30 +224,261 @@ def upload_file(request):
         }, status=500)
 
 
-@require_http_methods(["GET"])
-def conversion_status(request, conversion_id):
+def parse_check_request(body):
+    """
+    Fields of a check-before-upload request
+    
+    Returns:
+        dict: content_hash, file_size, filename, original_format,
+        target_format, options and batch_id
+    
+    Raises:
+        ValueError: If a field is missing or invalid
+    """
+    try:
+        data = json.loads(body or b'{}')
+    except json.JSONDecodeError:
+        raise ValueError('Body must be a JSON object')
+    if not isinstance(data, dict):
+        raise ValueError('Body must be a JSON object')
+    
+    content_hash = str(data.get('sha256', '')).lower()
+    if not CONTENT_HASH_RE.match(content_hash):
+        raise ValueError('sha256 must be a hex SHA-256 digest')
+    
+    try:
+        file_size = int(data.get('size'))
+    except (TypeError, ValueError):
+        raise ValueError('size must be a number of bytes')
+    if file_size <= 0 or file_size > settings.MAX_UPLOAD_SIZE:
+        raise ValueError('Invalid size')
+    
+    filename = data.get('filename')
+    target_format = data.get('target_format')
+    conversion_type = data.get('conversion_type')
+    if not all(isinstance(v, str) and v for v in (filename, target_format, conversion_type)):
+        raise ValueError('Missing required parameters')
+    
+    batch_id = data.get('batch_id') or None
+    if batch_id and not BATCH_ID_RE.match(str(batch_id)):
+        raise ValueError('Invalid batch_id')
+    
+    # Same option parameters as an upload, as a JSON object
+    params = data.get('options') or {}
+    if not isinstance(params, dict):
+        raise ValueError('options must be an object')
+    params = {key: str(value) for key, value in params.items()}
+    options = {}
+    if conversion_type == 'image':
+        options = parse_image_options(params)
+    elif conversion_type == 'video':
+        options = parse_video_options(params)
+    options.update(parse_effort_option(params))
+    
+    return {
+        'content_hash': content_hash,
+        'file_size': file_size,
+        'filename': filename,
+        'original_format': os.path.splitext(filename)[1][1:].lower(),
+        'target_format': target_format.lower(),
+        'options': options,
+        'batch_id': batch_id,
+    }
+
+
+@async_csrf_exempt
+@async_require_http_methods(["POST"])
+async def check_existing_conversion(request):
+    """
+    Check whether content was already converted, before uploading it
+    
+    The client sends the SHA-256 and size of the file with the target
+    format and options it would upload. If one of the user's completed
+    conversions (for anonymous clients, one from the same session) has the
+    same content, a new completed conversion sharing its output is created
+    and returned; otherwise the client uploads as usual.
+    """
+    try:
+        check = parse_check_request(request.body)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    try:
+        user = await sync_to_async(
+            lambda: request.user if request.user.is_authenticated else None
+        )()
+        session_hash = '' if user else await sync_to_async(get_session_hash)(request)
+        source = await sync_to_async(find_reusable)(
+            user, session_hash, check['content_hash'], check['file_size'], check['original_format'],
+            check['target_format'], check['options']
+        )
+        if source is None:
+            return JsonResponse({'success': True, 'found': False})
+        
+        conversion = await sync_to_async(clone_conversion)(
+            source,
+            original_filename=check['filename'],
+            batch_id=check['batch_id'],
+            user=user,
+            session_hash=session_hash,
+        )
+        
+        # Batch and user streams see the copy complete like any other
+        await sync_to_async(send_progress_update)(
+            get_channel_layer(), conversion.id, 100, 'completed', groups=conversion.get_progress_groups()
+        )
+        
+        return JsonResponse({
+            'success': True,
+            'found': True,
+            'conversion_id': str(conversion.id),
+            'conversion': conversion_status_data(conversion),
+        })
+        
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+def conversion_status_data(conversion):
+    """
+    Status payload of one conversion, shared by the single and bulk endpoints
+    
+    Async callers await aget_eta_model first, so the ETA doesn't read the cache.
+    """
+    data = {
+        'id': str(conversion.id),
+        'status': conversion.status,
+        'original_filename': conversion.original_filename,
+        'original_format': conversion.original_format,
+        'target_format': conversion.target_format,
+        'created_at': conversion.created_at.isoformat(),
+        'updated_at': conversion.updated_at.isoformat(),
+    }
+    
+    if conversion.status == 'completed':
+        data['download_url'] = f'/api/download/{conversion.id}/'
+        data['preview_url'] = conversion.get_preview_url()
+        data['completed_at'] = conversion.completed_at.isoformat()
+        data['processing_time'] = conversion.get_processing_time()
+        data['stage_timings'] = conversion.stage_timings
+    elif conversion.status == 'failed':
+        data['error_message'] = conversion.error_message
+        data['stage_timings'] = conversion.stage_timings
+    elif conversion.status == 'cancelled':
+        data['stage_timings'] = conversion.stage_timings
+    else:
+        data['eta_seconds'] = remaining_seconds(conversion)
+        finish = predicted_finish(conversion)
+        data['eta_at'] = finish.isoformat() if finish else None
+    
+    return data
+
+
+@async_require_http_methods(["GET"])
+async def conversion_status(request, conversion_id):
     """Get conversion status"""
     try:
-        conversion = get_object_or_404(FileConversion, id=conversion_id)
+        conversion = await aget_conversion_or_404(conversion_id)
+        await aget_eta_model()
+        return JsonResponse(conversion_status_data(conversion))
         
-        data = {
-            'id': str(conversion.id),
-            'status': conversion.status,
-            'original_filename': conversion.original_filename,
-            'original_format': conversion.original_format,
-            'target_format': conversion.target_format,
-            'created_at': conversion.created_at.isoformat(),
-            'updated_at': conversion.updated_at.isoformat(),
+    except Exception as e:
+        return JsonResponse({
+            'error': str(e)
+        }, status=500)
+
+
+# Columns read by conversion_status_data (and the ETA estimate)
+STATUS_FIELDS = [
+    'id', 'status', 'original_filename', 'original_format', 'target_format',
+    'conversion_type', 'file_size', 'media_info', 'stage_timings', 'preview_file',
+    'error_message', 'created_at', 'updated_at', 'started_at', 'completed_at',
+]
+
+
+def parse_conversion_ids(request):
+    """
+    Conversion ids of a bulk status request
+    
+    GET takes ``?ids=<id>,<id>``; POST takes a JSON body ``{"ids": [...]}``
+    for lists too long for a URL.
+    
+    Raises:
+        ValueError: If the ids are missing, malformed or too many
+    """
+    if request.method == 'POST':
+        try:
+            ids = json.loads(request.body or b'{}').get('ids')
+        except (json.JSONDecodeError, AttributeError):
+            raise ValueError('Body must be a JSON object with an "ids" list')
+        if not isinstance(ids, list):
+            raise ValueError('ids must be a list')
+    else:
+        ids = [i for i in request.GET.get('ids', '').split(',') if i]
+    
+    if not ids:
+        raise ValueError('No conversion ids given')
+    if len(ids) > settings.STATUS_BULK_MAX_IDS:
+        raise ValueError(f'At most {settings.STATUS_BULK_MAX_IDS} ids per request')
+    
+    try:
+        # Deduplicate, keeping the request order
+        return list(dict.fromkeys(uuid.UUID(str(i)) for i in ids))
+    except ValueError:
+        raise ValueError('Invalid conversion id')
+
+
+@async_csrf_exempt
+@async_require_http_methods(["GET", "POST"])
+async def bulk_conversion_status(request):
+    """
+    Status of many conversions in one request
+    
+    All rows are read with a single ``id__in`` query. The response carries a
+    weak ETag built from each conversion's ``updated_at`` and its ETA: the
+    predicted finish time ``eta_at`` once processing, which stays put while
+    ``eta_seconds`` counts down, else ``eta_seconds`` itself. A request
+    whose If-None-Match matches gets 304 Not Modified.
+    """
+    try:
+        ids = parse_conversion_ids(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    try:
+        conversions = {
+            c.id: c
+            async for c in FileConversion.objects.filter(id__in=ids).order_by().only(*STATUS_FIELDS)
         }
         
-        if conversion.status == 'completed':
-            data['download_url'] = f'/api/download/{conversion.id}/'
-            data['completed_at'] = conversion.completed_at.isoformat()
-            data['processing_time'] = conversion.get_processing_time()
-        elif conversion.status == 'failed':
-            data['error_message'] = conversion.error_message
+        await aget_eta_model()
+        statuses = {i: conversion_status_data(c) for i, c in conversions.items()}
+        
+        fingerprint = hashlib.md5(usedforsecurity=False)
+        for conversion_id in ids:
+            data = statuses.get(conversion_id)
+            if data:
+                eta = data.get('eta_at') or data.get('eta_seconds')
+                stamp = f"{data['updated_at']}:{eta}"
+            else:
+                stamp = '-'
+            fingerprint.update(f'{conversion_id}:{stamp};'.encode())
+        etag = f'W/"{fingerprint.hexdigest()}"'
         
-        return JsonResponse(data)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        
+        response = JsonResponse({
+            'conversions': [statuses[i] for i in ids if i in statuses],
+            'missing': [str(i) for i in ids if i not in conversions],
+        })
+        response['ETag'] = etag
+        return response
         
     except Exception as e:
         return JsonResponse({
@@ -127,11 +486,11 @@ def conversion_status(request, conversion_id):
         }, status=500)
 
 
-@require_http_methods(["GET"])
-def download_file(request, conversion_id):
+@async_require_http_methods(["GET"])
+async def download_file(request, conversion_id):
     """Download converted file"""
     try:
-        conversion = get_object_or_404(FileConversion, id=conversion_id)
+        conversion = await aget_conversion_or_404(conversion_id)
         
         if conversion.status != 'completed':
             return JsonResponse({
@@ -143,10 +502,10 @@ def download_file(request, conversion_id):
                 'error': 'Converted file not found'
             }, status=404)
         
-        # Get file path
-        file_path = conversion.converted_file.path
+        storage = conversion.converted_file.storage
+        name = conversion.converted_file.name
         
-        if not os.path.exists(file_path):
+        if not await sync_to_async(storage.exists, thread_sensitive=False)(name):
             return JsonResponse({
                 'error': 'File not found on server'
             }, status=404)
@@ -155,12 +514,16 @@ def download_file(request, conversion_id):
         base_name = os.path.splitext(conversion.original_filename)[0]
         download_filename = f"{base_name}_converted.{conversion.target_format}"
         
-        # Return file
-        response = FileResponse(
-            open(file_path, 'rb'),
-            as_attachment=True,
-            filename=download_filename
+        # Stream file without tying up a thread for the whole download
+        file = await sync_to_async(storage.open, thread_sensitive=False)(name, 'rb')
+        content_type, _ = mimetypes.guess_type(download_filename)
+        response = StreamingHttpResponse(
+            aiter_file(file),
+            content_type=content_type or 'application/octet-stream'
         )
+        response['Content-Disposition'] = content_disposition_header(True, download_filename)
+        if conversion.converted_file_size:
+            response['Content-Length'] = str(conversion.converted_file_size)
         return response
         
     except Exception as e:
@@ -169,14 +532,14 @@ def download_file(request, conversion_id):
         }, status=500)
 
 
-@require_http_methods(["GET"])
-def conversion_history(request):
+@async_require_http_methods(["GET"])
+async def conversion_history(request):
     """Get conversion history"""
     try:
         # Check if it's an API request (JSON)
         if request.headers.get('Accept') == 'application/json' or request.GET.get('format') == 'json':
             limit = int(request.GET.get('limit', 10))
-            conversions = FileConversion.objects.all()[:limit]
+            conversions = [c async for c in FileConversion.objects.all()[:limit]]
             
             data = {
                 'conversions': [
@@ -189,6 +552,7 @@ def conversion_history(request):
                         'conversion_type': c.conversion_type,
                         'created_at': c.created_at.isoformat(),
                         'file_size_mb': c.get_file_size_mb(),
+                        'preview_url': c.get_preview_url(),
                     }
                     for c in conversions
                 ]
@@ -198,17 +562,84 @@ def conversion_history(request):
         
         # Render HTML page
         limit = int(request.GET.get('limit', 50))
-        conversions = FileConversion.objects.all()[:limit]
+        conversions = [c async for c in FileConversion.objects.all()[:limit]]
         
+        # Totals come from the daily rollups rather than counting every row
+        totals = await sync_to_async(get_totals)()
         context = {
             'conversions': conversions,
-            'total_count': FileConversion.objects.count(),
+            'total_count': totals['total'],
+            'completed_count': totals['completed'],
         }
         
-        return render(request, 'converter/history.html', context)
+        # Context processors (e.g. auth) may touch the database
+        return await sync_to_async(render)(request, 'converter/history.html', context)
+        
+    except Exception as e:
+        return JsonResponse({
+            'error': str(e)
+        }, status=500)
+
+
+@async_require_http_methods(["GET"])
+async def conversion_stats(request):
+    """Daily conversion statistics per format pair, read from the rollups"""
+    try:
+        days = max(1, min(int(request.GET.get('days', 30)), 366))
+    except ValueError:
+        return JsonResponse({'error': 'days must be an integer'}, status=400)
+    
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rollups = ConversionDailyRollup.objects.filter(date__gte=since)
+    
+    data = {
+        'since': since.isoformat(),
+        'totals': await sync_to_async(get_totals)(since),
+        'daily': [
+            {
+                'date': r.date.isoformat(),
+                'original_format': r.original_format,
+                'target_format': r.target_format,
+                'conversion_type': r.conversion_type,
+                'status': r.status,
+                'count': r.count,
+                'input_bytes': r.input_bytes,
+                'output_bytes': r.output_bytes,
+                'average_seconds': r.get_average_seconds(),
+            }
+            async for r in rollups
+        ]
+    }
+    
+    return JsonResponse(data)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def cancel_conversion(request, conversion_id):
+    """Cancel a pending or processing conversion"""
+    try:
+        conversion = get_object_or_404(FileConversion, id=conversion_id)
+        
+        if not revoke_conversion(conversion):
+            conversion.refresh_from_db(fields=['status'])
+            return JsonResponse({
+                'success': False,
+                'status': conversion.status,
+                'error': f'Conversion already {conversion.status}'
+            }, status=409)
         
+        return JsonResponse({
+            'success': True,
+            'status': 'cancelled',
+            'message': 'Conversion cancelled'
+        })
+        
+    except Http404:
+        raise
     except Exception as e:
         return JsonResponse({
+            'success': False,
             'error': str(e)
         }, status=500)
 
@@ -220,14 +651,11 @@ def delete_conversion(request, conversion_id):
     try:
         conversion = get_object_or_404(FileConversion, id=conversion_id)
         
-        # Delete files from storage
-        if conversion.original_file:
-            if os.path.exists(conversion.original_file.path):
-                os.remove(conversion.original_file.path)
+        # Stop a running task first so it doesn't keep working on deleted files
+        revoke_conversion(conversion)
         
-        if conversion.converted_file:
-            if os.path.exists(conversion.converted_file.path):
-                os.remove(conversion.converted_file.path)
+        # Delete files from storage, unless a reused conversion shares them
+        release_files(conversion)
         
         # Delete database record
         conversion.delete()
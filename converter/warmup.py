@@ -0,0 +1,113 @@
+"""
+Worker warm-up: preload heavy libraries and per-process caches
+
+Runs in the main worker process at ``worker_init``, before a prefork
+pool forks its children, so every child starts with the libraries loaded
+and the first conversion on a fresh worker costs the same as the
+hundredth. Children then refresh their per-process state (OpenCV's thread
+pool is not inherited across fork) before taking tasks. Readiness is
+exposed through ``is_ready()`` and, when WORKER_READY_FILE is set, a file
+that exists while the worker is warm (suitable for container readiness
+probes).
+"""
+from celery.signals import worker_init, worker_process_init, worker_ready, worker_shutdown
+from django.conf import settings
+from io import BytesIO
+import os
+import time
+
+_ready = False
+
+
+def is_ready():
+    """Whether this process has completed its warm-up"""
+    return _ready
+
+
+def warm_up():
+    """
+    Preload libraries and build reusable objects for this process
+
+    Returns:
+        float: Seconds spent warming up
+    """
+    global _ready
+    start = time.monotonic()
+
+    from PIL import Image
+    import cv2
+    import numpy as np
+
+    from .utils import get_ffmpeg_binary, get_pdf_styles
+
+    # Register every Pillow plugin now instead of on the first unknown format
+    Image.init()
+
+    # OpenCV allocates its thread pool and codec tables on first use
+    ok, encoded = cv2.imencode('.png', np.zeros((8, 8, 3), dtype=np.uint8))
+    if ok:
+        cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+    # reportlab: stylesheet, font metrics and the PDF writer
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph
+    pdf_buffer = BytesIO()
+    SimpleDocTemplate(pdf_buffer, pagesize=letter).build(
+        [Paragraph('warm-up', get_pdf_styles()['Normal'])]
+    )
+
+    # pdf2docx pulls in PyMuPDF; open a document so its parser is initialised
+    try:
+        import fitz
+        fitz.open(stream=pdf_buffer.getvalue(), filetype='pdf').close()
+    except Exception as e:
+        print(f"Warm-up: PyMuPDF not available: {e}")
+
+    # MoviePy/ffmpeg binary discovery
+    get_ffmpeg_binary()
+
+    _ready = True
+    return time.monotonic() - start
+
+
+def _ready_file():
+    return getattr(settings, 'WORKER_READY_FILE', None)
+
+
+@worker_init.connect
+@worker_process_init.connect
+def warm_up_worker_process(**kwargs):
+    """
+    Warm up the main process before the pool starts, then each prefork child
+
+    The main process serves solo/threads pools itself and is forked for
+    prefork ones, so children inherit its loaded libraries and only
+    repeat the cheap per-process steps.
+    """
+    try:
+        elapsed = warm_up()
+        print(f"Worker process {os.getpid()} warmed up in {elapsed:.2f}s")
+    except Exception as e:
+        print(f"Worker warm-up failed: {e}")
+
+
+@worker_ready.connect
+def mark_worker_ready(**kwargs):
+    """
+    Publish readiness once the worker starts consuming
+
+    The main process was warmed at ``worker_init``, before any child was
+    forked, so every pool process is warm by now.
+    """
+    path = _ready_file()
+    if path and is_ready():
+        with open(path, 'w') as f:
+            f.write(str(os.getpid()))
+
+
+@worker_shutdown.connect
+def clear_worker_ready(**kwargs):
+    """Remove the readiness file when the worker stops"""
+    path = _ready_file()
+    if path and os.path.exists(path):
+        os.remove(path)
@@ -4,6 +4,7 @@ Django settings for fileconverter project.
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -140,7 +141,7 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 
 # Media files
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', BASE_DIR / 'media')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -157,6 +158,101 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
+# Size-aware priorities (converter/scheduling.py): Redis serves priority 0 first.
+# Workers reserve one message at a time so that priorities take effect
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# A conversion gets priority n when its predicted processing time exceeds n of these
+# thresholds (seconds); one still waiting is promoted a level every PRIORITY_AGING_SECONDS
+PRIORITY_STEP_SECONDS = [1, 3, 10, 30, 60, 120, 300, 600, 1200]
+PRIORITY_AGING_SECONDS = int(os.environ.get('PRIORITY_AGING_SECONDS', '30'))
+# Running tasks check for a cancellation this often (seconds); a cancelled
+# conversion's ffmpeg processes are killed and it stops at its next checkpoint
+CANCEL_POLL_SECONDS = float(os.environ.get('CANCEL_POLL_SECONDS', '1'))
+# PDF -> DOCX conversions of at least PDF_SHARD_MIN_PAGES pages are split into
+# PDF_SHARD_PAGES-page subtasks and merged by a chord callback
+PDF_SHARD_MIN_PAGES = int(os.environ.get('PDF_SHARD_MIN_PAGES', '60'))
+PDF_SHARD_PAGES = int(os.environ.get('PDF_SHARD_PAGES', '25'))
+# Segment-parallel video transcoding: videos of at least VIDEO_SEGMENT_MIN_DURATION
+# seconds are split at keyframes into ~VIDEO_SEGMENT_SECONDS pieces encoded by
+# VIDEO_SEGMENT_WORKERS ffmpeg processes (0 = one per CPU)
+VIDEO_SEGMENT_MIN_DURATION = float(os.environ.get('VIDEO_SEGMENT_MIN_DURATION', '120'))
+VIDEO_SEGMENT_SECONDS = int(os.environ.get('VIDEO_SEGMENT_SECONDS', '30'))
+VIDEO_SEGMENT_WORKERS = int(os.environ.get('VIDEO_SEGMENT_WORKERS', '0'))
+# Scratch space for conversion intermediates (use a tmpfs such as /dev/shm for speed).
+# Each conversion reserves SCRATCH_RESERVE_FACTOR x its input size; when the
+# reservations would exceed SCRATCH_QUOTA_BYTES (0 = no quota) the task waits and retries
+SCRATCH_ROOT = os.environ.get('SCRATCH_ROOT', os.path.join(tempfile.gettempdir(), 'fileconverter-scratch'))
+SCRATCH_QUOTA_BYTES = int(os.environ.get('SCRATCH_QUOTA_BYTES', str(10 * 1024 * 1024 * 1024)))
+SCRATCH_RESERVE_FACTOR = 3
+SCRATCH_RETRY_SECONDS = 30
+# Image inputs up to this size are converted in memory (no temp files)
+IN_MEMORY_MAX_BYTES = int(os.environ.get('IN_MEMORY_MAX_BYTES', str(2 * 1024 * 1024)))
+# Encoder effort profile (fast / balanced / max, see converter/utils.py) for jobs
+# that do not choose one; EFFORT_QUEUE_DEFAULTS ('queue:profile,...') sets it per
+# Celery queue, e.g. 'batch:max'
+EFFORT_DEFAULT = os.environ.get('EFFORT_DEFAULT', 'balanced')
+EFFORT_QUEUE_DEFAULTS = dict(
+    item.split(':', 1) for item in os.environ.get('EFFORT_QUEUE_DEFAULTS', '').split(',') if ':' in item
+)
+# target_format 'auto': candidates ('<format>:<quality>', 'png8' = 256-colour PNG) are
+# encoded AUTO_FORMAT_WORKERS at a time and the smallest with SSIM >= AUTO_FORMAT_MIN_SSIM
+# is kept. Each worker holds about one decoded full-size candidate in memory.
+# SSIM is the lowest over Y, Cb and Cr fitted into AUTO_FORMAT_SSIM_SIZE px and a
+# full-resolution centre crop of Y of that size
+AUTO_FORMAT_CANDIDATES = os.environ.get(
+    'AUTO_FORMAT_CANDIDATES', 'webp:85,webp:70,jpg:90,jpg:80,jpg:65,png8,png'
+).split(',')
+AUTO_FORMAT_MIN_SSIM = float(os.environ.get('AUTO_FORMAT_MIN_SSIM', '0.95'))
+AUTO_FORMAT_SSIM_SIZE = 1024
+AUTO_FORMAT_WORKERS = int(os.environ.get('AUTO_FORMAT_WORKERS', '3'))
+# TIFFs of at least TILED_MIN_PIXELS converted to TIFF, PNG or PDF are streamed in
+# bands of about TILED_BAND_BYTES of pixels instead of being decoded whole
+TILED_MIN_PIXELS = int(os.environ.get('TILED_MIN_PIXELS', str(50 * 1000 * 1000)))
+TILED_BAND_BYTES = int(os.environ.get('TILED_BAND_BYTES', str(32 * 1024 * 1024)))
+# Longest edge (px) of the preview stored alongside each converted file
+PREVIEW_MAX_SIZE = int(os.environ.get('PREVIEW_MAX_SIZE', '320'))
+# ETA estimation: a per format pair model fitted on the last ETA_TRAINING_DAYS of
+# completed conversions (pairs with fewer than ETA_MIN_SAMPLES use the type model)
+ETA_TRAINING_DAYS = int(os.environ.get('ETA_TRAINING_DAYS', '14'))
+ETA_TRAINING_LIMIT = 20000
+ETA_MIN_SAMPLES = 10
+ETA_REFRESH_SECONDS = int(os.environ.get('ETA_REFRESH_SECONDS', '600'))
+ETA_MODEL_RELOAD_SECONDS = 60  # how often each process re-reads the published model
+# Conversions older than ARCHIVE_AFTER_DAYS lose their files; finished ones move to
+# the compact archive table. Reports read daily rollups refreshed every ROLLUP_REFRESH_SECONDS
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '7'))
+ARCHIVE_BATCH_SIZE = 500
+ROLLUP_REFRESH_SECONDS = int(os.environ.get('ROLLUP_REFRESH_SECONDS', '3600'))
+
+CELERY_BEAT_SCHEDULE = {
+    'refresh-eta-model': {
+        'task': 'converter.tasks.refresh_eta_model_task',
+        'schedule': ETA_REFRESH_SECONDS,
+    },
+    'rollup-conversions': {
+        'task': 'converter.tasks.rollup_conversions_task',
+        'schedule': ROLLUP_REFRESH_SECONDS,
+    },
+    'age-queued-conversions': {
+        'task': 'converter.tasks.age_queued_conversions_task',
+        'schedule': PRIORITY_AGING_SECONDS,
+    },
+    'archive-old-conversions': {
+        'task': 'converter.tasks.cleanup_old_files',
+        'schedule': 24 * 60 * 60,
+    },
+}
+
+# Largest number of ids accepted by /api/status/bulk/
+STATUS_BULK_MAX_IDS = 500
+
+# Written once a worker has preloaded its libraries (readiness probe); unset to disable
+WORKER_READY_FILE = os.environ.get('WORKER_READY_FILE')
 
 # Channels Configuration
 # Parse Redis URL for channels
@@ -179,11 +275,45 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache (shared across web and worker processes)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    },
+}
+
+# Latest progress event per conversion, replayed to late WebSocket subscribers
+PROGRESS_SNAPSHOT_TTL = int(os.environ.get('PROGRESS_SNAPSHOT_TTL', '3600'))  # seconds
+
+# Multiplexed WebSocket streams (ws/conversions/)
+WEBSOCKET_FLUSH_INTERVAL = float(os.environ.get('WEBSOCKET_FLUSH_INTERVAL', '0.25'))  # seconds
+WEBSOCKET_MAX_SUBSCRIPTIONS = int(os.environ.get('WEBSOCKET_MAX_SUBSCRIPTIONS', '500'))
+
 # File Upload Settings
 MAX_UPLOAD_SIZE = 100 * 1024 * 1024  # 100MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = MAX_UPLOAD_SIZE
 FILE_UPLOAD_MAX_MEMORY_SIZE = MAX_UPLOAD_SIZE
 
+# Admission control: upload_file returns 429 + Retry-After when the broker queue
+# holds ADMISSION_MAX_QUEUE_DEPTH messages or the estimated backlog (unfinished
+# jobs x ADMISSION_TYPE_SECONDS / ADMISSION_WORKER_CONCURRENCY) exceeds
+# ADMISSION_MAX_BACKLOG_SECONDS
+ADMISSION_MAX_QUEUE_DEPTH = int(os.environ.get('ADMISSION_MAX_QUEUE_DEPTH', '500'))
+ADMISSION_MAX_BACKLOG_SECONDS = int(os.environ.get('ADMISSION_MAX_BACKLOG_SECONDS', '900'))
+ADMISSION_WORKER_CONCURRENCY = int(os.environ.get('ADMISSION_WORKER_CONCURRENCY', '2'))
+ADMISSION_TYPE_SECONDS = {
+    'image': 2,
+    'document': 15,
+    'video': 120,
+}
+ADMISSION_SNAPSHOT_SECONDS = 2  # how long a queue/backlog reading is reused
+
+# Per-client token bucket for uploads: BURST tokens, refilled at PER_MINUTE (0 disables)
+UPLOAD_RATE_LIMIT_PER_MINUTE = int(os.environ.get('UPLOAD_RATE_LIMIT_PER_MINUTE', '30'))
+UPLOAD_RATE_LIMIT_BURST = int(os.environ.get('UPLOAD_RATE_LIMIT_BURST', '10'))
+UPLOAD_RATE_LIMIT_TRUST_FORWARDED_FOR = os.environ.get('UPLOAD_RATE_LIMIT_TRUST_FORWARDED_FOR', 'False') == 'True'
+
 # Supported file formats
 SUPPORTED_IMAGE_FORMATS = ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'tiff']
 SUPPORTED_DOCUMENT_FORMATS = ['pdf', 'docx', 'txt']
@@ -193,6 +323,17 @@ SUPPORTED_VIDEO_FORMATS = ['mp4', 'avi', 'mov', 'mkv', 'flv', 'wmv']
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
 SUPABASE_BUCKET_NAME = os.environ.get('SUPABASE_BUCKET_NAME', 'file-converter')
+# Files larger than the threshold use resumable (TUS) uploads in SUPABASE_CHUNK_SIZE
+# parts; Supabase requires 6MB parts
+SUPABASE_RESUMABLE_THRESHOLD = int(os.environ.get('SUPABASE_RESUMABLE_THRESHOLD', str(6 * 1024 * 1024)))
+SUPABASE_CHUNK_SIZE = 6 * 1024 * 1024
+SUPABASE_UPLOAD_RETRIES = 5
+SUPABASE_UPLOAD_TIMEOUT = 120
+# Opened files are read lazily with range requests: blocks of SUPABASE_READ_BLOCK_SIZE,
+# an LRU of SUPABASE_READ_CACHE_BLOCKS and read-ahead for sequential reads
+SUPABASE_READ_BLOCK_SIZE = 256 * 1024
+SUPABASE_READ_CACHE_BLOCKS = 32
+SUPABASE_READ_AHEAD_BLOCKS = 8
 
 # Use Supabase Storage if credentials are provided (for production)
 if SUPABASE_URL and SUPABASE_KEY:
@@ -5,9 +5,140 @@ Custom storage backend for Supabase Storage
 from django.core.files.storage import Storage
 from django.conf import settings
 from supabase import create_client, Client
-from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files import File
+from urllib.parse import quote, urljoin
+import base64
+import httpx
+import io
 import mimetypes
 import os
+import re
+import time
+
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+class SupabaseRemoteFile(io.RawIOBase):
+    """
+    Seekable, read-only view of a Supabase object backed by HTTP range requests
+    
+    Data is fetched in blocks kept in a small LRU cache. Sequential reads
+    fetch several blocks per request (read-ahead); random access, such as
+    a PDF trailer or an image header, fetches only the blocks it touches.
+    """
+    
+    def __init__(self, http, url, headers, block_size, cache_blocks, readahead_blocks):
+        self._http = http
+        self._url = url
+        self._headers = headers
+        self._block_size = block_size
+        self._cache_blocks = cache_blocks
+        self._readahead_blocks = readahead_blocks
+        self._blocks = OrderedDict()
+        self._position = 0
+        self._last_block = None
+        self.size = None
+        
+        # The first request also tells us the object size
+        self._fetch(0, 1)
+    
+    def _fetch(self, first_block, count):
+        """Fetch ``count`` blocks starting at ``first_block`` into the cache"""
+        start = first_block * self._block_size
+        end = start + count * self._block_size - 1
+        response = self._http.get(self._url, headers={**self._headers, 'Range': f'bytes={start}-{end}'})
+        
+        if response.status_code == 416:
+            # Empty object, or a range past its end
+            if self.size is None:
+                self.size = 0
+            return
+        if response.status_code == 404:
+            raise FileNotFoundError(self._url)
+        response.raise_for_status()
+        
+        data = response.content
+        if response.status_code == 206:
+            match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+            if match and match.group(3) != '*':
+                self.size = int(match.group(3))
+            elif self.size is None:
+                self.size = start + len(data)
+        else:
+            # Range not honoured: the whole object came back, keep all of it
+            start = 0
+            first_block = 0
+            self.size = len(data)
+            self._cache_blocks = None
+        
+        for offset in range(0, len(data), self._block_size):
+            block = first_block + offset // self._block_size
+            self._blocks[block] = data[offset:offset + self._block_size]
+            self._blocks.move_to_end(block)
+        while self._cache_blocks and len(self._blocks) > self._cache_blocks:
+            self._blocks.popitem(last=False)
+    
+    def _get_block(self, block, wanted_blocks):
+        if block not in self._blocks:
+            # Read ahead when the caller is streaming through the file
+            count = wanted_blocks
+            if self._last_block is not None and block == self._last_block + 1:
+                count = max(count, self._readahead_blocks)
+            last = (self.size - 1) // self._block_size
+            count = max(1, min(count, last - block + 1, self._cache_blocks or count))
+            self._fetch(block, count)
+        self._last_block = block
+        if block not in self._blocks:
+            return b''
+        self._blocks.move_to_end(block)
+        return self._blocks[block]
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self._position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self._position = position
+        return position
+    
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        filled = 0
+        while filled < len(view) and self._position < self.size:
+            block, offset = divmod(self._position, self._block_size)
+            wanted = -(-(min(self.size, self._position + len(view) - filled) - block * self._block_size)
+                       // self._block_size)
+            data = self._get_block(block, wanted)
+            n = min(len(view) - filled, len(data) - offset)
+            if n <= 0:
+                break
+            view[filled:filled + n] = data[offset:offset + n]
+            filled += n
+            self._position += n
+        return filled
+    
+    def close(self):
+        if not self.closed:
+            self._blocks.clear()
+            self._http.close()
+        super().close()
 
 
 class SupabaseStorage(Storage):
@@ -57,6 +188,12 @@ class SupabaseStorage(Storage):
             str: The name of the saved file
         """
         try:
+            # Large files are streamed in chunks instead of read into memory
+            size = getattr(content, 'size', None)
+            if hasattr(content, 'read') and size and size > settings.SUPABASE_RESUMABLE_THRESHOLD:
+                self._resumable_upload(name, content, size)
+                return name
+            
             # Read content
             if hasattr(content, 'read'):
                 file_content = content.read()
@@ -89,23 +226,139 @@ class SupabaseStorage(Storage):
             print(f"Error uploading to Supabase: {e}")
             raise
     
+    def _http_client(self):
+        """HTTP client for the resumable upload endpoint"""
+        return httpx.Client(timeout=settings.SUPABASE_UPLOAD_TIMEOUT)
+    
+    def _resumable_upload(self, name, content, size):
+        """
+        Upload a large file with Supabase's resumable (TUS) endpoint
+        
+        The file is sent in SUPABASE_CHUNK_SIZE parts. The next part is read
+        while the current one is in flight, so at most two parts are held in
+        memory. A failed part is retried from the offset the server reports.
+        
+        Args:
+            name: File path/name
+            content: File object opened for reading
+            size: Total size in bytes
+        """
+        endpoint = f"{self.supabase_url}/storage/v1/upload/resumable"
+        headers = {
+            'Authorization': f'Bearer {self.supabase_key}',
+            'apikey': self.supabase_key,
+            'Tus-Resumable': '1.0.0',
+        }
+        metadata = {
+            'bucketName': self.bucket_name,
+            'objectName': name,
+            'contentType': self._guess_content_type(name),
+            'cacheControl': '3600',
+        }
+        upload_metadata = ','.join(
+            f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in metadata.items()
+        )
+        chunk_size = settings.SUPABASE_CHUNK_SIZE
+        
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        
+        with self._http_client() as http, ThreadPoolExecutor(max_workers=1) as reader:
+            response = http.post(endpoint, headers={
+                **headers,
+                'Upload-Length': str(size),
+                'Upload-Metadata': upload_metadata,
+                'x-upsert': 'true',
+            })
+            response.raise_for_status()
+            location = urljoin(endpoint, response.headers['Location'])
+            
+            offset = 0
+            next_chunk = reader.submit(content.read, chunk_size)
+            while offset < size:
+                chunk = next_chunk.result()
+                if not chunk:
+                    raise IOError(f"{name}: content ended at {offset} of {size} bytes")
+                next_chunk = reader.submit(content.read, chunk_size)
+                offset = self._upload_chunk(http, location, headers, chunk, offset)
+        
+        if hasattr(content, 'seek'):
+            content.seek(0)
+    
+    def _upload_chunk(self, http, location, headers, chunk, offset):
+        """
+        PATCH one part of a resumable upload, retrying with backoff
+        
+        Returns:
+            int: Upload offset after the part
+        """
+        start = offset
+        end = offset + len(chunk)
+        retries = settings.SUPABASE_UPLOAD_RETRIES
+        
+        for attempt in range(retries + 1):
+            try:
+                response = http.patch(location, content=chunk[offset - start:], headers={
+                    **headers,
+                    'Upload-Offset': str(offset),
+                    'Content-Type': 'application/offset+octet-stream',
+                })
+                response.raise_for_status()
+                offset = int(response.headers['Upload-Offset'])
+                if offset >= end:
+                    return offset
+            except (httpx.HTTPError, KeyError, ValueError) as e:
+                if attempt == retries:
+                    raise
+                print(f"Supabase upload part at {offset} failed ({e}), retrying")
+                time.sleep(min(2 ** attempt, 30))
+                
+                # Resume from whatever the server already has
+                try:
+                    response = http.head(location, headers=headers)
+                    response.raise_for_status()
+                    offset = int(response.headers['Upload-Offset'])
+                except (httpx.HTTPError, KeyError, ValueError):
+                    pass
+                if not start <= offset <= end:
+                    raise IOError(f"Upload offset {offset} is outside the part {start}-{end}")
+                if offset == end:
+                    return offset
+        
+        raise IOError(f"Upload part {start}-{end} did not complete")
+    
     def _open(self, name, mode='rb'):
         """
-        Download and open file from Supabase Storage
+        Open a file from Supabase Storage
+        
+        Nothing is downloaded up front: reads are served by range requests
+        (see SupabaseRemoteFile), so probing a header transfers kilobytes.
         
         Args:
             name: File path/name
             mode: File open mode (default 'rb')
             
         Returns:
-            BytesIO: File-like object
+            File: Seekable, read-only file object
         """
+        url = f"{self.supabase_url}/storage/v1/object/{self.bucket_name}/{quote(name)}"
+        headers = {
+            'Authorization': f'Bearer {self.supabase_key}',
+            'apikey': self.supabase_key,
+        }
+        http = self._http_client()
         try:
-            response = self.client.storage.from_(self.bucket_name).download(name)
-            return BytesIO(response)
+            remote = SupabaseRemoteFile(
+                http, url, headers,
+                block_size=settings.SUPABASE_READ_BLOCK_SIZE,
+                cache_blocks=settings.SUPABASE_READ_CACHE_BLOCKS,
+                readahead_blocks=settings.SUPABASE_READ_AHEAD_BLOCKS,
+            )
         except Exception as e:
+            http.close()
             print(f"Error downloading from Supabase: {e}")
             raise IOError(f"File not found: {name}")
+        return File(remote, name=name)
     
     def exists(self, name):
         """